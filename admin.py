@@ -67,11 +67,42 @@ class GalleyProofingAdmin(admin.ModelAdmin):
         return obj.round.article.title
 
 
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        'handler',
+        'journal',
+        'status',
+        'attempts',
+        'next_attempt',
+        'date_sent',
+        'pk',
+    )
+    list_filter = ('status', 'handler', 'journal')
+    raw_id_fields = ('journal',)
+
+
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = (
+        'filename',
+        'kind',
+        'article',
+        'owner',
+        'offset',
+        'size',
+        'date_updated',
+        'date_completed',
+    )
+    list_filter = ('kind',)
+    raw_id_fields = ('owner', 'article', 'assignment')
+
+
 admin_list = [
     (models.TypesettingRound, TypesettingRoundAdmin),
     (models.TypesettingClaim, ),
     (models.TypesettingAssignment, TypesettingAssignmentAdmin),
     (models.GalleyProofing, GalleyProofingAdmin),
+    (models.OutboxMessage, OutboxMessageAdmin),
+    (models.ChunkedUpload, ChunkedUploadAdmin),
 ]
 
 [admin.site.register(*t) for t in admin_list]
\ No newline at end of file
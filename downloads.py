@@ -0,0 +1,387 @@
+"""
+Helpers for serving the files of the typesetting plugin.
+"""
+import os
+import re
+import threading
+import zipfile
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
+from django.utils.http import http_date, parse_http_date_safe
+
+from core import models as core_models
+from plugins.typesetting import models, plugin_settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Checksums are computed on cache misses by a single background thread
+CHECKSUM_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+CHECKSUM_LOCK = threading.Lock()
+CHECKSUMS_QUEUED = set()
+
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+# Files already compressed are stored as they are in ZIP bundles
+COMPRESSED_EXTENSIONS = (
+    '.7z', '.docx', '.epub', '.gif', '.gz', '.idml', '.jpeg', '.jpg',
+    '.mp3', '.mp4', '.odt', '.pdf', '.png', '.pptx', '.rar', '.tif', '.tiff',
+    '.webp', '.xlsx', '.zip',
+)
+
+
+def file_validators(file_obj):
+    """
+    Returns the validators used for conditional requests of a file: an ETag
+    and the timestamp of its modification date. The ETag is strong, built
+    from the checksum and modification date, when the checksum is cached.
+    Otherwise a weak ETag is built from the size and modification time of
+    the file on disk and the checksum is computed in the background, so
+    that a request never waits for a large file to be hashed.
+    :param file_obj: a core.File object
+    :return: a tuple of the quoted ETag and Last-Modified timestamp
+    """
+    stat = os.stat(file_obj.self_article_path())
+    checksum = models.FileChecksum.objects.cached(file_obj, stat)
+    last_modified = None
+    if file_obj.date_modified:
+        last_modified = timegm(file_obj.date_modified.utctimetuple())
+
+    if checksum is None:
+        fill_checksum(file_obj)
+        etag = 'W/{}'.format(quote_etag('{0}-{1}'.format(
+            stat.st_size,
+            int(stat.st_mtime),
+        )))
+    else:
+        etag = quote_etag('{0}-{1}'.format(checksum, last_modified or 0))
+
+    return etag, last_modified
+
+
+def fill_checksum(file_obj):
+    """ Queues a file to have its checksum computed by a background thread,
+    unless it is already queued
+    """
+    with CHECKSUM_LOCK:
+        if file_obj.pk in CHECKSUMS_QUEUED:
+            return
+        CHECKSUMS_QUEUED.add(file_obj.pk)
+    CHECKSUM_EXECUTOR.submit(compute_checksum, file_obj.pk)
+
+
+def compute_checksum(file_id):
+    try:
+        file_obj = core_models.File.objects.filter(pk=file_id).first()
+        if file_obj:
+            models.FileChecksum.objects.for_file(file_obj)
+    except Exception:
+        logger.exception('Unable to compute the checksum of file %s', file_id)
+    finally:
+        with CHECKSUM_LOCK:
+            CHECKSUMS_QUEUED.discard(file_id)
+        connection.close()
+
+
+def file_path(file_obj, path_parts):
+    """
+    Returns the path on disk of a file stored under files/<path_parts>.
+    :param file_obj: a core.File object
+    :param path_parts: a tuple of the folders under the files directory
+    :return: an absolute path
+    """
+    return os.path.join(
+        settings.BASE_DIR,
+        'files',
+        *[str(part) for part in path_parts],
+        file_obj.uuid_filename
+    )
+
+
+def parse_range(header, size):
+    """
+    Parses a single byte range of a Range header.
+    Multiple ranges are not supported, the caller serves the full file.
+    :param header: the value of the Range header
+    :param size: the size of the file in bytes
+    :return: a tuple of the first and last byte, None if the header can't be
+    used or False if the range can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or not (match.group('start') or match.group('end')):
+        return None
+
+    if not match.group('start'):
+        # Suffix range, the last n bytes of the file
+        length = int(match.group('end'))
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(match.group('start'))
+    end = int(match.group('end')) if match.group('end') else size - 1
+    if start > end:
+        return None
+    if start >= size:
+        return False
+
+    return start, min(end, size - 1)
+
+
+def if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+
+    return bool(last_modified) and (
+        parse_http_date_safe(if_range) == last_modified
+    )
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as file_handle:
+        file_handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file_handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def range_response(request, file_obj, path):
+    """
+    Returns a 206 response for the range requested or None if the full file
+    has to be served instead.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+
+    byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is None:
+        return None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{0}'.format(size)
+        return response
+
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        read_range(path, start, end),
+        status=206,
+        content_type=file_obj.mime_type or 'application/octet-stream',
+    )
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, size)
+    response['Content-Disposition'] = 'inline; filename="{0}"'.format(
+        file_obj.original_filename,
+    )
+    return response
+
+
+def offload_response(file_obj, path_parts):
+    """
+    Returns a response asking the web server to send the file, according to
+    plugin_settings.FILE_OFFLOAD, or None if the file has to be streamed by
+    Django.
+    """
+    path = file_path(file_obj, path_parts)
+    if not os.path.isfile(path):
+        return None
+
+    response = HttpResponse(
+        content_type=file_obj.mime_type or 'application/octet-stream',
+    )
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+        file_obj.original_filename,
+    )
+
+    if plugin_settings.FILE_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = quote('{0}{1}'.format(
+            plugin_settings.FILE_OFFLOAD_PREFIX,
+            '/'.join(
+                [str(part) for part in path_parts] + [file_obj.uuid_filename],
+            ),
+        ))
+    elif plugin_settings.FILE_OFFLOAD == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        logger.warning(
+            'Unknown TYPESETTING_FILE_OFFLOAD %s',
+            plugin_settings.FILE_OFFLOAD,
+        )
+        return None
+
+    return response
+
+
+def conditional_file_response(request, file_obj, serve, path_parts=None):
+    """
+    Serves a file honouring If-None-Match/If-Modified-Since and, when the
+    location of the file is given, single byte Range requests. Files are sent
+    by the web server when plugin_settings.FILE_OFFLOAD is set.
+    :param request: HttpRequest
+    :param file_obj: the core.File object to be served
+    :param serve: a callable returning the full response for the file
+    :param path_parts: a tuple of the folders the file is stored under
+    :return: HttpResponseNotModified, a partial response or the response
+    returned by serve
+    """
+    try:
+        etag, last_modified = file_validators(file_obj)
+    except (OSError, TypeError):
+        # Let serve() deal with files missing from disk
+        logger.warning('Unable to compute validators for file %s', file_obj.pk)
+        return serve()
+
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified,
+    )
+    if (
+        response is None
+        and path_parts is not None
+        and plugin_settings.FILE_OFFLOAD
+    ):
+        # The web server handles Range requests of offloaded files
+        response = offload_response(file_obj, path_parts)
+    elif (
+        response is None
+        and path_parts is not None
+        and request.method in ('GET', 'HEAD')
+        and request.META.get('HTTP_RANGE')
+        and if_range_passes(request, etag, last_modified)
+    ):
+        response = range_response(
+            request,
+            file_obj,
+            file_path(file_obj, path_parts),
+        )
+    if response is None:
+        response = serve()
+        if not 200 <= response.status_code < 300:
+            return response
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if path_parts is not None:
+        response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(
+        response,
+        private=True,
+        max_age=0,
+        must_revalidate=True,
+    )
+
+    return response
+
+
+class ZipStream(object):
+    """ A write-only, unseekable file that collects what ZipFile writes """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def unique_archive_name(name, used_names):
+    base, extension = os.path.splitext(name)
+    candidate, index = name, 1
+    while candidate.lower() in used_names:
+        candidate = '{0} ({1}){2}'.format(base, index, extension)
+        index += 1
+    used_names.add(candidate.lower())
+
+    return candidate
+
+
+def zip_chunks(files):
+    """
+    Generates a ZIP archive of files, chunk by chunk, without holding the
+    archive in memory or writing it to disk.
+    :param files: an iterable of (path on disk, name in the archive) tuples
+    :return: a generator of bytes
+    """
+    stream = ZipStream()
+    used_names = set()
+    with zipfile.ZipFile(stream, mode='w', allowZip64=True) as archive:
+        for path, name in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                logger.warning('Skipping missing file %s from ZIP', path)
+                continue
+
+            info = zipfile.ZipInfo.from_file(
+                path,
+                arcname=unique_archive_name(name, used_names),
+            )
+            info.file_size = stat.st_size
+            if os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            with open(path, 'rb') as source, archive.open(info, 'w') as dest:
+                while True:
+                    data = source.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    dest.write(data)
+                    yield stream.pop()
+            yield stream.pop()
+
+    yield stream.pop()
+
+
+def zip_response(file_objects, path_parts, filename):
+    """
+    Streams a ZIP archive of files stored under the same folder.
+    :param file_objects: an iterable of core.File objects
+    :param path_parts: a tuple of the folders the files are stored under
+    :param filename: the name of the archive
+    :return: StreamingHttpResponse
+    """
+    response = StreamingHttpResponse(
+        zip_chunks(
+            (file_path(file_obj, path_parts), file_obj.original_filename)
+            for file_obj in file_objects
+        ),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+        filename,
+    )
+    patch_cache_control(response, private=True, no_store=True)
+
+    return response
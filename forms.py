@@ -54,14 +54,20 @@ class AssignTypesetter(forms.ModelForm):
                 for file in self.cleaned_data.get('files_to_typeset'):
                     assignment.files_to_typeset.add(file)
 
-                for galley_id in self.cleaned_data.get("corrections", []):
-                    galley = core_models.Galley.objects.get(pk=galley_id)
+                galleys = core_models.Galley.objects.filter(
+                    pk__in=self.cleaned_data.get("corrections", []),
+                ).select_related('file__typesetting_checksum')
+                for galley in galleys:
                     correction, _ = assignment.corrections.get_or_create(
                         task=assignment,
                         galley=galley,
                         label=galley.label,
                     )
 
+                assignment.refresh_task_counter(
+                    previous_typesetter_id=self.initial.get('typesetter'),
+                )
+
         return assignment
 
     def clean(self):
@@ -70,6 +76,40 @@ class AssignTypesetter(forms.ModelForm):
             raise ValidationError("At least one file must be made picked")
 
 
+class BulkAssignTypesetter(forms.Form):
+    typesetter = forms.ModelChoiceField(queryset=None)
+    articles = forms.ModelMultipleChoiceField(
+        queryset=None,
+        widget=forms.CheckboxSelectMultiple,
+    )
+    due = forms.DateField(required=False, widget=HTMLDateInput())
+    task = forms.CharField(
+        widget=forms.Textarea,
+        label='Typesetting Task',
+        help_text='Please let the typesetter know what you want them to create'
+                  ' and if there are any special circumstances. They will have'
+                  ' access to the articles metadata.',
+    )
+    display_proof_comments = forms.BooleanField(
+        required=False,
+        initial=True,
+        help_text="Allow the typesetter to see the proofreading comments",
+    )
+    request_corrections = forms.BooleanField(
+        required=False,
+        initial=True,
+        help_text='Request corrections for any existing typeset files',
+    )
+
+    def __init__(self, *args, **kwargs):
+        typesetters = kwargs.pop('typesetters')
+        articles = kwargs.pop('articles')
+        super().__init__(*args, **kwargs)
+
+        self.fields['typesetter'].queryset = typesetters
+        self.fields['articles'].queryset = articles
+
+
 class AssignProofreader(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
@@ -95,6 +135,7 @@ class AssignProofreader(forms.ModelForm):
 
         if commit:
             assignment.save()
+            assignment.refresh_task_counter()
 
         return assignment
 
@@ -0,0 +1,329 @@
+"""
+A local HTTP load driver replaying the journeys of the managers, typesetters
+and proofreaders of a journal against a running Janeway instance.
+
+The journeys are built from the open tasks of the journal, the users are
+logged in by creating sessions for them in the session store, so the driver
+needs the settings of the instance it is run against.
+"""
+import math
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+)
+from django.shortcuts import reverse
+
+from core import models as core_models
+from submission import models as submission_models
+from plugins.typesetting import models, plugin_settings
+
+# How often a journey of each role is picked
+JOURNEY_WEIGHTS = {
+    'manager': 2,
+    'typesetter': 5,
+    'proofreader': 3,
+}
+PERCENTILES = (50, 95, 99)
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """ Reports redirects, e.g. to the login page, without following them """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def manager_journey(article):
+    assignment = models.TypesettingAssignment.objects.filter(
+        round__article=article,
+    ).order_by('-round__round_number').first()
+    galley = article.galley_set.order_by('pk').first()
+
+    steps = [
+        ('articles', reverse('typesetting_articles')),
+        ('articles_data', '{}?draw=1&start=0&length=25'.format(
+            reverse('typesetting_articles_data'),
+        )),
+        ('article', reverse(
+            'typesetting_article',
+            kwargs={'article_id': article.pk},
+        )),
+    ]
+    if assignment:
+        steps.append(('review_assignment', reverse(
+            'typesetting_review_assignment',
+            kwargs={'article_id': article.pk, 'assignment_id': assignment.pk},
+        )))
+    if galley:
+        steps.append(('edit_galley', reverse(
+            'typesetting_edit_galley',
+            kwargs={'article_id': article.pk, 'galley_id': galley.pk},
+        )))
+        steps.append(('editor_preview_galley', reverse(
+            'editor_preview_galley',
+            kwargs={'article_id': article.pk, 'galley_id': galley.pk},
+        )))
+    return steps
+
+
+def typesetter_journey(assignment):
+    article = assignment.round.article
+    galley = article.galley_set.order_by('pk').first()
+
+    steps = [
+        ('assignments', reverse('typesetting_assignments')),
+        ('assignment', reverse(
+            'typesetting_assignment',
+            kwargs={'assignment_id': assignment.pk},
+        )),
+    ]
+    if galley:
+        steps.append(('typesetter_download_file', reverse(
+            'typesetting_typesetter_download_file',
+            kwargs={'assignment_id': assignment.pk, 'file_id': galley.file_id},
+        )))
+        steps.append(('typesetter_preview_galley', reverse(
+            'typesetting_preview_galley',
+            kwargs={
+                'article_id': article.pk,
+                'galley_id': galley.pk,
+                'assignment_id': assignment.pk,
+            },
+        )))
+    return steps
+
+
+def proofreader_journey(proofing):
+    article = proofing.round.article
+    galley = article.galley_set.order_by('pk').first()
+
+    steps = [
+        ('proofreading_assignments', reverse(
+            'typesetting_proofreading_assignments',
+        )),
+        ('proofreading_assignment', reverse(
+            'typesetting_proofreading_assignment',
+            kwargs={'assignment_id': proofing.pk},
+        )),
+    ]
+    if galley:
+        steps.append(('proofreader_preview_galley', reverse(
+            'typesetting_preview_galley',
+            kwargs={
+                'article_id': article.pk,
+                'galley_id': galley.pk,
+                'assignment_id': proofing.pk,
+            },
+        )))
+        steps.append(('proofing_download', reverse(
+            'typesetting_proofing_download',
+            kwargs={
+                'article_id': article.pk,
+                'assignment_id': proofing.pk,
+                'file_id': galley.file_id,
+            },
+        )))
+    return steps
+
+
+def build_journeys(journal, manager, sample_size=100):
+    """
+    Builds journeys for a sample of the articles and open tasks of a journal.
+    :param journal: the Journal to load
+    :param manager: the Account replaying the manager journeys
+    :param sample_size: the most journeys built for each role
+    :return: a dict of role to a list of (Account, steps) tuples, where the
+    steps are a list of (label, path) tuples
+    """
+    articles = list(submission_models.Article.objects.filter(
+        journal=journal,
+        stage=plugin_settings.STAGE,
+    ).order_by('?')[:sample_size])
+    assignments = models.TypesettingAssignment.objects.filter(
+        round__article__journal=journal,
+        round__article__stage=plugin_settings.STAGE,
+        typesetter__isnull=False,
+        completed__isnull=True,
+        cancelled__isnull=True,
+    ).select_related('typesetter', 'round__article').order_by('?')
+    proofing_tasks = models.GalleyProofing.objects.filter(
+        round__article__journal=journal,
+        round__article__stage=plugin_settings.STAGE,
+        proofreader__isnull=False,
+        completed__isnull=True,
+        cancelled=False,
+    ).select_related('proofreader', 'round__article').order_by('?')
+
+    return {
+        'manager': [
+            (manager, manager_journey(article)) for article in articles
+        ],
+        'typesetter': [
+            (assignment.typesetter, typesetter_journey(assignment))
+            for assignment in assignments[:sample_size]
+        ],
+        'proofreader': [
+            (proofing.proofreader, proofreader_journey(proofing))
+            for proofing in proofing_tasks[:sample_size]
+        ],
+    }
+
+
+def create_session(user):
+    """
+    Logs a user in by creating a session for them.
+    :return: a SessionStore object
+    """
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session
+
+
+def fetch(opener, url, session_key, timeout):
+    """
+    Requests a URL and reads the full response.
+    :return: a tuple of the status (None when the request failed), the
+    number of bytes received and the seconds taken
+    """
+    request = urllib.request.Request(
+        url,
+        headers={'Cookie': '{0}={1}'.format(
+            settings.SESSION_COOKIE_NAME,
+            session_key,
+        )},
+    )
+    start = time.perf_counter()
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            status, received = response.status, len(response.read())
+    except urllib.error.HTTPError as error:
+        status, received = error.code, len(error.read())
+    except (urllib.error.URLError, OSError):
+        status, received = None, 0
+
+    return status, received, time.perf_counter() - start
+
+
+def run_load(
+        base_url,
+        journeys,
+        session_keys,
+        count,
+        concurrency=10,
+        timeout=60,
+        seed=None,
+):
+    """
+    Replays journeys picked at random according to JOURNEY_WEIGHTS.
+    :param base_url: the URL of the journal, e.g. http://localhost:8000/TST
+    :param journeys: the journeys returned by build_journeys
+    :param session_keys: a dict of Account pk to session key
+    :param count: the number of journeys to replay
+    :param concurrency: the number of journeys replayed at the same time
+    :param timeout: the seconds after which a request fails
+    :param seed: the seed of the random choices, to repeat a run
+    :return: a list of (label, status, bytes, seconds) tuples
+    """
+    rng = random.Random(seed)
+    roles = [role for role in JOURNEY_WEIGHTS if journeys.get(role)]
+    if not roles:
+        return []
+
+    picked = [
+        rng.choice(journeys[role])
+        for role in rng.choices(
+            roles,
+            weights=[JOURNEY_WEIGHTS[role] for role in roles],
+            k=count,
+        )
+    ]
+    opener = urllib.request.build_opener(NoRedirectHandler)
+    base_url = base_url.rstrip('/')
+
+    def replay(journey):
+        user, steps = journey
+        results = []
+        for label, path in steps:
+            status, received, seconds = fetch(
+                opener,
+                base_url + path,
+                session_keys[user.pk],
+                timeout,
+            )
+            results.append((label, status, received, seconds))
+        return results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return [
+            result
+            for results in executor.map(replay, picked)
+            for result in results
+        ]
+
+
+def percentile(values, percent):
+    """ Returns the nearest-rank percentile of a list of numbers """
+    ordered = sorted(values)
+    index = int(math.ceil(percent / 100 * len(ordered))) - 1
+    return ordered[max(index, 0)]
+
+
+def summarise(results):
+    """
+    Aggregates the results of run_load by view.
+    :return: a dict of label to a dict of the number of requests, errors,
+    bytes received and latency percentiles in milliseconds
+    """
+    by_label = {}
+    for label, status, received, seconds in results:
+        by_label.setdefault(label, []).append((status, received, seconds))
+
+    summary = {}
+    for label, rows in sorted(by_label.items()):
+        timings = [seconds * 1000 for _, _, seconds in rows]
+        summary[label] = {
+            'requests': len(rows),
+            'errors': len([
+                status for status, _, _ in rows
+                if status is None or status >= 300
+            ]),
+            'bytes': sum(received for _, received, _ in rows),
+            'max': max(timings),
+        }
+        for percent in PERCENTILES:
+            summary[label]['p{}'.format(percent)] = percentile(
+                timings,
+                percent,
+            )
+
+    return summary
+
+
+def get_manager(journal, email=None):
+    """
+    Returns the account replaying the manager journeys: the given one, the
+    manager created by the load generator or any editor of the journal.
+    :return: an Account object or None if no editor of the journal matches
+    """
+    accounts = core_models.Account.objects.filter(
+        accountrole__journal=journal,
+        accountrole__role__slug='editor',
+    )
+    if email:
+        return accounts.filter(username=email).first()
+
+    return accounts.filter(
+        username='load-manager@{}.example.org'.format(journal.code.lower()),
+    ).first() or accounts.first()
@@ -1,21 +1,51 @@
+import codecs
+import hashlib
+import json
+import mimetypes
+import os
+import statistics
 import time
 import uuid
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
+from django.db.models import (
+    Count,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Coalesce
 from django.shortcuts import redirect, reverse
+from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 from django.contrib import messages
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from django.template.loader import render_to_string
 
+from copyediting import models as copyediting_models
 from core import models as core_models, files
 from events import logic as event_logic
 from identifiers import logic as ident_logic
 from identifiers.models import DOI_RE
+from journal import logic as journal_logic
 from production import logic
+from review import models as review_models
+from submission import models as submission_models
 from utils import setting_handler, render_template
+from utils import models as utils_models
 
-from plugins.typesetting import models, plugin_settings
+from plugins.typesetting import models, plugin_settings, security
 from plugins.typesetting.notifications import notify
 
 
@@ -48,43 +78,972 @@ def production_ready_files(article, file_objects=False):
         }
 
 
+def production_ready_file_ids(article_ids):
+    """
+    Gathers the production ready files of many articles in one query.
+    :param article_ids: a list of Article pks
+    :return: a dict of Article pk to the pks of the files
+    production_ready_files returns for it
+    """
+    manuscript_files = submission_models.Article.manuscript_files.through
+    copyeditor_files = (
+        copyediting_models.CopyeditAssignment.copyeditor_files.through
+    )
+
+    rows = manuscript_files.objects.filter(
+        article_id__in=article_ids,
+        file__is_galley=False,
+    ).values_list('article_id', 'file_id').union(
+        copyeditor_files.objects.filter(
+            copyeditassignment__article_id__in=article_ids,
+        ).values_list('copyeditassignment__article_id', 'file_id'),
+    )
+
+    file_ids = defaultdict(list)
+    for article_id, file_id in rows:
+        file_ids[article_id].append(file_id)
+    return file_ids
+
+
+def load_article_workspace(request, article, rounds):
+    """
+    Loads what the typesetting article page and its included templates
+    render, in a fixed number of queries regardless of the number of rounds,
+    tasks and files of the article.
+    :param request: HttpRequest
+    :param article: an Article object
+    :param rounds: the rounds of the article, loaded with
+    TypesettingRound.objects.with_stats()
+    :return: a dictionary to update the template context with
+    """
+    prefetch_related_objects(
+        [article],
+        'correspondence_author',
+        'typesettingclaim__editor',
+        'source_files',
+        Prefetch(
+            'supplementary_files',
+            queryset=core_models.SupplementaryFile.objects.select_related(
+                'file',
+            ),
+        ),
+    )
+
+    rounds = list(rounds)
+    for round in rounds:
+        round.article = article
+        if hasattr(round, 'typesettingassignment'):
+            round.typesettingassignment.round = round
+        for proofing in round.galleyproofing_set.all():
+            proofing.round = round
+
+    galleys = galleys_with_analysis(article.galley_set.all())
+    for galley in galleys:
+        galley.article = article
+
+    return {
+        'article': article,
+        'rounds': rounds,
+        'galleys': galleys,
+        'manuscript_files': production_ready_files(article),
+        'pending_tasks': typesetting_pending_tasks(rounds[0], galleys=galleys),
+        'next_element': get_next_element('typesetting_articles', request),
+    }
+
+
+class HashingUploadedFile(object):
+    """
+    Wraps an uploaded file so that it is hashed while it is written to disk.
+    Janeway streams uploads to storage through chunks(), so the digest is
+    built from the same pass instead of re-reading the file afterwards.
+    """
+
+    def __init__(self, uploaded_file):
+        self.uploaded_file = uploaded_file
+        self.md5 = hashlib.md5()
+        self.bytes_hashed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.uploaded_file, name)
+
+    def __iter__(self):
+        return iter(self.uploaded_file)
+
+    def chunks(self, *args, **kwargs):
+        self.md5 = hashlib.md5()
+        self.bytes_hashed = 0
+        for chunk in self.uploaded_file.chunks(*args, **kwargs):
+            self.md5.update(chunk)
+            self.bytes_hashed += len(chunk)
+            yield chunk
+
+    def store_checksum(self, file_obj):
+        """
+        Records the streamed digest against the file written to storage.
+        If the bytes on disk don't match what was hashed (e.g. the file was
+        not written through chunks()) the file is hashed from disk instead.
+        :param file_obj: the core.File object created for the upload
+        :return: a FileChecksum object
+        """
+        stat = os.stat(file_obj.self_article_path())
+        checksum = None
+        if self.bytes_hashed and self.bytes_hashed == stat.st_size:
+            checksum = self.md5.hexdigest()
+
+        return models.FileChecksum.objects.store(
+            file_obj,
+            checksum=checksum,
+            stat=stat,
+        )
+
+
+def save_galley(article, request, uploaded_file, label=None, public=True):
+    """
+    Saves a new galley, hashing it as it is written to disk
+    :param article: an Article object
+    :param request: HttpRequest
+    :param uploaded_file: an UploadedFile object
+    :param label: the galley label
+    :param public: whether the galley is public
+    :return: a Galley object
+    """
+    hashing_file = HashingUploadedFile(uploaded_file)
+    galley = logic.save_galley(
+        article,
+        request,
+        hashing_file,
+        True,
+        label=label,
+        public=public,
+    )
+    checksum = hashing_file.store_checksum(galley.file).checksum
+    analyse_galley(galley, checksum=checksum)
+
+    return galley
+
+
+GALLEY_UPLOAD_WORKERS = 4
+TEXT_GALLEY_EXTENSIONS = ('.html', '.htm', '.xml')
+
+
+def galley_upload_error(exc):
+    """ Returns the message displayed to the user for a failed galley upload
+    :param exc: the exception raised while saving the galley
+    :return: a string
+    """
+    if isinstance(exc, UnicodeDecodeError):
+        return "Uploaded file is not UTF-8 encoded"
+    elif isinstance(exc, logic.ZippedGalleyError):
+        return "You tried to upload a compressed file. " \
+               "Please upload each Typeset File separately"
+    return str(exc)
+
+
+class StagedGalleyUpload(object):
+    """
+    An uploaded galley written to a staging file ahead of its registration.
+    The upload is hashed and HTML/XML files are checked to be UTF-8 encoded
+    in the same pass that writes it, so that a batch of uploads can be
+    staged in parallel without touching the database.
+    """
+
+    def __init__(self, uploaded_file):
+        self.uploaded_file = uploaded_file
+        self.path = os.path.join(
+            settings.BASE_DIR,
+            'files',
+            'temp',
+            'typesetting_uploads',
+            str(uuid.uuid4()),
+        )
+        self.checksum = None
+        self.size = 0
+        self.error = None
+
+    @property
+    def name(self):
+        return self.uploaded_file.name
+
+    @property
+    def is_text(self):
+        return os.path.splitext(
+            self.name,
+        )[1].lower() in TEXT_GALLEY_EXTENSIONS
+
+    def stage(self):
+        md5 = hashlib.md5()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.path, 'wb') as staged_file:
+                for chunk in self.uploaded_file.chunks():
+                    if self.is_text:
+                        decoder.decode(chunk)
+                    md5.update(chunk)
+                    self.size += len(chunk)
+                    staged_file.write(chunk)
+                if self.is_text:
+                    decoder.decode(b'', final=True)
+        except UnicodeDecodeError as exc:
+            self.error = galley_upload_error(exc)
+            self.delete()
+        else:
+            self.checksum = md5.hexdigest()
+
+        return self
+
+    def open(self):
+        """ Returns the staged file as an UploadedFile, to be closed """
+        content_type, _ = mimetypes.guess_type(self.name)
+        return UploadedFile(
+            file=open(self.path, 'rb'),
+            name=self.name,
+            content_type=content_type or 'application/octet-stream',
+            size=self.size,
+        )
+
+    def store_checksum(self, file_obj):
+        stat = os.stat(file_obj.self_article_path())
+        checksum = self.checksum if self.size == stat.st_size else None
+
+        return models.FileChecksum.objects.store(
+            file_obj,
+            checksum=checksum,
+            stat=stat,
+        )
+
+    def delete(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def save_galleys(article, request, uploaded_files, label=None, public=True):
+    """
+    Saves a batch of galleys. The uploads are staged, hashed and validated
+    in a bounded thread pool, then registered one after the other in a
+    single transaction, with a savepoint per file so that a failed file
+    doesn't prevent the others from being saved.
+    :param article: an Article object
+    :param request: HttpRequest
+    :param uploaded_files: a list of UploadedFile objects
+    :param label: the galley label
+    :param public: whether the galleys are public
+    :return: a tuple of the list of Galley objects created and the list of
+    (file name, error message) tuples of the files that couldn't be saved
+    """
+    galleys, errors = [], []
+    if not uploaded_files:
+        return galleys, errors
+
+    staged_uploads = [
+        StagedGalleyUpload(uploaded_file) for uploaded_file in uploaded_files
+    ]
+    try:
+        workers = min(GALLEY_UPLOAD_WORKERS, len(staged_uploads))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(StagedGalleyUpload.stage, staged_uploads))
+
+        with transaction.atomic():
+            for staged in staged_uploads:
+                if staged.error:
+                    errors.append((staged.name, staged.error))
+                    continue
+                try:
+                    with transaction.atomic(), staged.open() as staged_file:
+                        galley = logic.save_galley(
+                            article,
+                            request,
+                            staged_file,
+                            True,
+                            label=label,
+                            public=public,
+                        )
+                        checksum = staged.store_checksum(galley.file).checksum
+                        analyse_galley(galley, checksum=checksum)
+                except (
+                        TypeError,
+                        UnicodeDecodeError,
+                        logic.ZippedGalleyError,
+                ) as exc:
+                    errors.append((staged.name, galley_upload_error(exc)))
+                else:
+                    galleys.append(galley)
+    finally:
+        for staged in staged_uploads:
+            staged.delete()
+
+    return galleys, errors
+
+
+def replace_galley_file(article, request, galley, uploaded_file):
+    """
+    Replaces the file of a galley, hashing the new file as it is written
+    :param article: an Article object
+    :param request: HttpRequest
+    :param galley: the Galley object to update
+    :param uploaded_file: an UploadedFile object or None
+    :return: None
+    """
+    if not uploaded_file:
+        return logic.replace_galley_file(article, request, galley, None)
+
+    hashing_file = HashingUploadedFile(uploaded_file)
+    logic.replace_galley_file(article, request, galley, hashing_file)
+    checksum = hashing_file.store_checksum(galley.file).checksum
+    analyse_galley(galley, checksum=checksum)
+
+
+ZIP_IMAGES_MAX_ENTRIES = 1000
+ZIP_IMAGES_MAX_SIZE = 1024 * 1024 * 1024
+
+
+def save_galley_images_from_zip(request, galley, zip_file, label=None):
+    """
+    Saves the images of a galley from a ZIP archive. Entries are read one at
+    a time from the archive and matched by file name to the images
+    referenced by the galley, all matching images are saved in a single
+    transaction.
+    :param request: HttpRequest
+    :param galley: a Galley object
+    :param zip_file: an UploadedFile object for the archive
+    :param label: the label of the images
+    :return: a list of (entry name, saved, message) tuples
+    """
+    try:
+        archive = zipfile.ZipFile(zip_file)
+    except zipfile.BadZipFile:
+        return [(zip_file.name, False, 'Not a valid ZIP file')]
+
+    entries = [info for info in archive.infolist() if not info.is_dir()]
+    if len(entries) > ZIP_IMAGES_MAX_ENTRIES:
+        return [(zip_file.name, False, 'Too many files in the archive')]
+    if sum(info.file_size for info in entries) > ZIP_IMAGES_MAX_SIZE:
+        return [(zip_file.name, False, 'The archive is too large')]
+
+    analysis = get_galley_analysis(galley)
+    references = {
+        os.path.basename(name).lower(): os.path.basename(name)
+        for name in analysis.image_names + analysis.missing_images
+    }
+    missing = {name.lower() for name in analysis.missing_images}
+
+    results = []
+    with transaction.atomic():
+        for info in entries:
+            name = os.path.basename(info.filename)
+            reference = references.get(name.lower())
+            if not reference:
+                results.append(
+                    (info.filename, False, 'Not referenced by the galley'),
+                )
+                continue
+            if reference.lower() not in missing:
+                results.append((info.filename, False, 'Already uploaded'))
+                continue
+
+            content_type = mimetypes.guess_type(reference)[0]
+            with archive.open(info) as entry:
+                logic.save_galley_image(
+                    galley,
+                    request,
+                    UploadedFile(
+                        file=entry,
+                        name=reference,
+                        content_type=content_type,
+                        size=info.file_size,
+                    ),
+                    label or reference,
+                    fixed=False,
+                )
+            missing.discard(reference.lower())
+            results.append((info.filename, True, 'Saved as {}'.format(reference)))
+
+    return results
+
+
+def get_articles_in_typesetting(request, article_filter=None):
+    """
+    Returns the articles of the current journal that are in the plugin stage.
+    :param request: HttpRequest
+    :param article_filter: 'me' to only return articles claimed by the user
+    :return: a queryset of Article objects
+    """
+    articles = submission_models.Article.objects.filter(
+        journal=request.journal,
+        stage=plugin_settings.STAGE,
+    )
+
+    if article_filter == 'me':
+        articles = articles.filter(
+            typesettingclaim__editor=request.user,
+        )
+
+    return articles
+
+
+# Maps the DataTables column index of typesetting_articles.html to the field
+# used to sort it. Columns not listed here are not sortable.
+ARTICLE_TABLE_ORDERING = {
+    0: 'pk',
+    1: 'title',
+    2: 'date_submitted',
+    3: 'correspondence_author__last_name',
+    6: 'projected_issue__date',
+    7: 'typesettingclaim__editor__last_name',
+}
+ARTICLE_TABLE_MAX_LENGTH = 100
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def articles_in_typesetting_table(request):
+    """
+    Builds a page of articles for a DataTables server-side processing request.
+    Filtering, searching, sorting and paging are all done in SQL and the
+    related objects shown in the table are loaded up front, so a page costs
+    the same number of queries whatever its length.
+    :param request: HttpRequest
+    :return: a dict to be serialised as the DataTables JSON response
+    """
+    params = request.GET
+    articles = get_articles_in_typesetting(
+        request,
+        article_filter=params.get('filter'),
+    )
+    records_total = articles.count()
+
+    search = params.get('search[value]', '').strip()
+    if search:
+        search_filter = (
+            Q(title__icontains=search)
+            | Q(correspondence_author__first_name__icontains=search)
+            | Q(correspondence_author__last_name__icontains=search)
+            | Q(typesettingclaim__editor__last_name__icontains=search)
+        )
+        if search.isdigit():
+            search_filter |= Q(pk=search)
+        articles = articles.filter(search_filter)
+        records_filtered = articles.count()
+    else:
+        records_filtered = records_total
+
+    order_field = ARTICLE_TABLE_ORDERING.get(
+        _int_param(params, 'order[0][column]', 0),
+        'pk',
+    )
+    if params.get('order[0][dir]') == 'desc':
+        order_field = '-{}'.format(order_field)
+
+    start = max(_int_param(params, 'start', 0), 0)
+    length = _int_param(params, 'length', 25)
+    if length <= 0 or length > ARTICLE_TABLE_MAX_LENGTH:
+        length = ARTICLE_TABLE_MAX_LENGTH
+
+    page = articles.select_related(
+        'correspondence_author',
+        'section',
+        'projected_issue',
+        'typesettingclaim__editor',
+    ).prefetch_related(
+        'editorassignment_set__editor',
+    ).order_by(order_field, 'pk')[start:start + length]
+
+    return {
+        'draw': _int_param(params, 'draw', 0),
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': [article_table_row(article) for article in page],
+    }
+
+
+def article_table_row(article):
+    """
+    Renders the cells of an article row of typesetting_articles.html
+    :param article: an Article object loaded by articles_in_typesetting_table
+    :return: a list of HTML strings
+    """
+    claim = getattr(article, 'typesettingclaim', None)
+    if claim:
+        manager = format_html('{}', claim.editor.full_name())
+    else:
+        manager = format_html(
+            '<a href="{}">Claim Article</a>',
+            reverse('typesetting_claim_article', args=[article.pk, 'claim']),
+        )
+
+    author = article.correspondence_author
+    issue = article.projected_issue
+    submitted = ''
+    if article.date_submitted:
+        submitted = date_format(
+            timezone.localtime(article.date_submitted),
+            'DATETIME_FORMAT',
+        )
+
+    return [
+        format_html('{}', article.pk),
+        format_html('{}', article.title),
+        format_html('{}', submitted),
+        format_html('{}', author.full_name() if author else ''),
+        format_html('{}', ', '.join(
+            assignment.editor.full_name()
+            for assignment in article.editorassignment_set.all()
+        )),
+        format_html('{}', article.section.name if article.section else ''),
+        format_html('{}', issue.display_title if issue else 'None'),
+        manager,
+        format_html(
+            '<a href="{}">View</a>',
+            reverse('typesetting_article', args=[article.pk]),
+        ),
+    ]
+
+
+@transaction.atomic
+def bulk_assign_typesetter(
+        request,
+        articles,
+        typesetter,
+        due=None,
+        task='',
+        display_proof_comments=True,
+        request_corrections=True,
+        skip=False,
+):
+    """
+    Assigns one typesetter to the current round of many articles at once.
+    Missing rounds, the assignments, their files and corrections are all
+    created with bulk_create and a single notification is sent.
+    Articles whose current round already has a typesetter are skipped.
+    :param request: HttpRequest
+    :param articles: an iterable of Article objects in the plugin stage
+    :param typesetter: the Account to assign
+    :param due: the due date of the assignments
+    :param task: the task description
+    :param display_proof_comments: Boolean
+    :param request_corrections: Boolean, request corrections for galleys
+    :param skip: Boolean, if True the typesetter isn't notified
+    :return: a tuple of the created assignments and the skipped articles
+    """
+    articles = {article.pk: article for article in articles}
+
+    latest_rounds = {}
+    for round in models.TypesettingRound.objects.filter(
+        article_id__in=articles.keys(),
+    ).select_related(
+        'typesettingassignment',
+    ).order_by('article_id', '-round_number'):
+        latest_rounds.setdefault(round.article_id, round)
+
+    missing_rounds = [pk for pk in articles if pk not in latest_rounds]
+    if missing_rounds:
+        models.TypesettingRound.objects.bulk_create([
+            models.TypesettingRound(article_id=pk) for pk in missing_rounds
+        ])
+        for round in models.TypesettingRound.objects.filter(
+            article_id__in=missing_rounds,
+        ):
+            latest_rounds[round.article_id] = round
+
+    rounds, skipped = [], []
+    for article_id, round in latest_rounds.items():
+        if hasattr(round, 'typesettingassignment'):
+            skipped.append(articles[article_id])
+        else:
+            rounds.append(round)
+
+    models.TypesettingAssignment.objects.bulk_create([
+        models.TypesettingAssignment(
+            round=round,
+            manager=request.user,
+            typesetter=typesetter,
+            due=due,
+            task=task,
+            display_proof_comments=display_proof_comments,
+            notified=not skip,
+        ) for round in rounds
+    ])
+    # bulk_create only sets primary keys on some backends
+    assignments = list(
+        models.TypesettingAssignment.objects.filter(
+            round__in=rounds,
+        ).select_related('round')
+    )
+
+    file_ids = production_ready_file_ids(
+        [assignment.round.article_id for assignment in assignments],
+    )
+    FileLink = models.TypesettingAssignment.files_to_typeset.through
+    FileLink.objects.bulk_create([
+        FileLink(typesettingassignment=assignment, file_id=file_id)
+        for assignment in assignments
+        for file_id in file_ids[assignment.round.article_id]
+    ])
+
+    if request_corrections:
+        galleys = defaultdict(list)
+        for galley in core_models.Galley.objects.filter(
+            article_id__in=[a.round.article_id for a in assignments],
+        ).select_related('file__typesetting_checksum'):
+            galleys[galley.article_id].append(galley)
+
+        models.TypesettingCorrection.objects.bulk_create([
+            models.TypesettingCorrection(
+                task=assignment,
+                galley=galley,
+                label=galley.label,
+                file_checksum=models.FileChecksum.objects.for_file(
+                    galley.file,
+                ),
+            )
+            for assignment in assignments
+            for galley in galleys[assignment.round.article_id]
+        ])
+
+    for assignment in assignments:
+        utils_models.LogEntry.add_entry(
+            types='Typesetting Assignment',
+            description='{0} has been assigned as a typesetter for {1}'.format(
+                typesetter.full_name(),
+                articles[assignment.round.article_id].title,
+            ),
+            level='Info',
+            request=request,
+            target=articles[assignment.round.article_id],
+        )
+
+    models.TaskCounter.objects.refresh_on_commit(
+        request.journal.pk,
+        [typesetter.pk],
+    )
+
+    if assignments:
+        notify.event_typesetting_bulk_assignment(
+            request,
+            typesetter,
+            assignments,
+            skip=skip,
+        )
+
+    return assignments, skipped
+
+
+TYPESETTER_DIRECTORY_TIMEOUT = 60 * 60
+
+
+def _count_per_account(queryset, account_field):
+    """
+    Returns an expression counting the rows of a queryset that belong to the
+    Account of the outer query, to be used with annotate().
+    """
+    counts = queryset.filter(
+        **{account_field: OuterRef('pk')}
+    ).order_by().values(account_field).annotate(
+        count=Count('pk'),
+    ).values('count')
+
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
 def get_typesetters(journal):
-    typesetter_pks = [
-        role.user.pk for role in core_models.AccountRole.objects.filter(
+    """
+    Returns the typesetters of a journal in a single query, annotated with
+    open_typesetting_tasks and overdue_typesetting_tasks.
+    :param journal: a Journal object
+    :return: a queryset of Account objects
+    """
+    open_tasks = models.TypesettingAssignment.objects.filter(
+        round__article__journal=journal,
+        completed__isnull=True,
+        cancelled__isnull=True,
+    )
+
+    return core_models.Account.objects.filter(
+        pk__in=core_models.AccountRole.objects.filter(
             role__slug='typesetter',
             journal=journal,
+        ).values('user'),
+    ).annotate(
+        open_typesetting_tasks=_count_per_account(open_tasks, 'typesetter'),
+        overdue_typesetting_tasks=_count_per_account(
+            open_tasks.filter(due__lt=timezone.now().date()),
+            'typesetter',
+        ),
+    ).order_by('last_name', 'first_name')
+
+
+def get_typesetter_directory(journal):
+    """
+    Returns the typesetters of a journal with their workload, for display.
+    On top of the annotations of get_typesetters each typesetter has a
+    median_turnaround_days attribute: the median number of days between
+    assignment and completion of their completed tasks.
+    The pks and workload of the typesetters are cached per journal and
+    invalidated when their tasks or the journal's roles change, the accounts
+    themselves are loaded in a single query.
+    :param journal: a Journal object
+    :return: a list of Account objects
+    """
+    cache_key = models.typesetter_directory_cache_key(journal.pk)
+    workloads = cache.get(cache_key)
+    if workloads is None:
+        workloads = get_typesetter_workloads(journal)
+        cache.set(cache_key, workloads, TYPESETTER_DIRECTORY_TIMEOUT)
+
+    directory = list(core_models.Account.objects.filter(
+        pk__in=[workload['pk'] for workload in workloads],
+    ).order_by('last_name', 'first_name'))
+    workloads = {workload['pk']: workload for workload in workloads}
+    for typesetter in directory:
+        workload = workloads[typesetter.pk]
+        typesetter.open_typesetting_tasks = workload['open']
+        typesetter.overdue_typesetting_tasks = workload['overdue']
+        typesetter.median_turnaround_days = workload['median_turnaround']
+
+    return directory
+
+
+def get_typesetter_workloads(journal):
+    """
+    Computes the workload of the typesetters of a journal.
+    :param journal: a Journal object
+    :return: a list of dicts of the pk, open and overdue task counts and
+    median turnaround in days of each typesetter
+    """
+    typesetters = list(get_typesetters(journal).values_list(
+        'pk',
+        'open_typesetting_tasks',
+        'overdue_typesetting_tasks',
+    ))
+    turnarounds = defaultdict(list)
+    for typesetter_id, assigned, completed in \
+            models.TypesettingAssignment.objects.filter(
+                round__article__journal=journal,
+                typesetter__in=[pk for pk, _, _ in typesetters],
+                accepted__isnull=False,
+                completed__isnull=False,
+            ).values_list('typesetter', 'assigned', 'completed'):
+        turnarounds[typesetter_id].append(
+            (completed - assigned).total_seconds() / 86400,
         )
-    ]
 
-    return core_models.Account.objects.filter(pk__in=typesetter_pks)
+    workloads = []
+    for pk, open_tasks, overdue_tasks in typesetters:
+        durations = turnarounds.get(pk)
+        workloads.append({
+            'pk': pk,
+            'open': open_tasks,
+            'overdue': overdue_tasks,
+            'median_turnaround': round(
+                statistics.median(durations), 1,
+            ) if durations else None,
+        })
 
+    return workloads
 
-def get_proofreaders(article, round, assignment=None):
-    pks = list()
-    current_proofer_pks = [
-        p.proofreader.pk for p in round.galleyproofing_set.all()
-    ]
 
-    for editor in article.editor_list():
-        pks.append(editor.pk)
+RENDERED_GALLEY_TYPES = ('html', 'xml')
+
+
+def analyse_galley(galley, article_content=None, checksum=None):
+    """
+    Parses a galley and stores the result in its GalleyAnalysis.
+    Tables are only extracted when the rendered content of the galley is
+    given, rendering is left to the galley preview.
+    :param galley: a Galley object
+    :param article_content: the rendered content of the galley
+    :param checksum: the checksum of the galley file if already known
+    :return: a GalleyAnalysis object
+    """
+    if checksum is None:
+        checksum = models.FileChecksum.objects.for_file(galley.file)
+
+    missing_images, image_names, tables = [], [], None
+    previous = getattr(galley, 'typesetting_analysis', None)
+    if (
+        previous
+        and previous.checksum == checksum
+        and previous.xsl_file_id == galley.xsl_file_id
+    ):
+        tables = previous.tables
+    if galley.file.mime_type in galley.mimetypes_with_figures:
+        missing_images = list(galley.has_missing_image_files() or [])
+        image_names = list(logic.get_image_names(galley))
+    if article_content is not None:
+        tables = [
+            str(table) for table in
+            journal_logic.get_all_tables_from_html(article_content)
+        ]
+
+    analysis, _ = models.GalleyAnalysis.objects.update_or_create(
+        galley=galley,
+        defaults={
+            'checksum': checksum,
+            'xsl_file_id': galley.xsl_file_id,
+            'image_count': galley.images.count(),
+            'missing_images_json': json.dumps(missing_images),
+            'image_names_json': json.dumps(image_names),
+            'tables_json': json.dumps(tables) if tables is not None else None,
+        },
+    )
+    galley.typesetting_analysis = analysis
+
+    return analysis
+
+
+def get_galley_analysis(galley, article_content=None):
+    """
+    Returns the GalleyAnalysis of a galley, parsing the galley only when its
+    file, XSL file or images changed since it was last analysed.
+    Galleys fetched with galleys_with_analysis() are checked without further
+    queries unless they need analysing.
+    :param galley: a Galley object
+    :param article_content: the rendered content of the galley, to extract
+    its tables if they weren't yet
+    :return: a GalleyAnalysis object
+    """
+    checksum = models.FileChecksum.objects.for_file(galley.file)
+    image_count = getattr(galley, 'typesetting_image_count', None)
+    if image_count is None:
+        image_count = galley.images.count()
+
+    analysis = getattr(galley, 'typesetting_analysis', None)
+    if (
+        analysis
+        and analysis.matches(galley, checksum, image_count)
+        and (article_content is None or analysis.tables is not None)
+    ):
+        return analysis
+
+    return analyse_galley(galley, article_content, checksum=checksum)
+
+
+def galleys_with_analysis(galleys):
+    """
+    Fetches galleys along with what's needed to read their analysis and sets
+    a missing_images attribute on each of them.
+    :param galleys: a queryset of Galley objects
+    :return: a list of Galley objects
+    """
+    galleys = list(galleys.select_related(
+        'file__typesetting_checksum',
+        'typesetting_analysis',
+    ).annotate(typesetting_image_count=Count('images')))
+
+    for galley in galleys:
+        galley.missing_images = get_galley_analysis(galley).missing_images
+
+    return galleys
+
+
+def galley_preview_content(galley):
+    """
+    Returns the content and tables needed to preview a galley.
+    Only HTML and XML galleys are rendered server side, other galleys (PDF,
+    EPUB...) are displayed in the browser from their download URL so their
+    file is never read here.
+    The tables of a galley are read from its GalleyAnalysis.
+    :param galley: a Galley object
+    :return: a tuple of the rendered content and list of tables
+    """
+    if galley.type not in RENDERED_GALLEY_TYPES:
+        return None, []
+
+    article_content = galley.file_content()
+    analysis = get_galley_analysis(galley, article_content=article_content)
+    tables = journal_logic.get_all_tables_from_html(''.join(analysis.tables))
+
+    return article_content, tables
 
-    for author in article.authors.all():
-        pks.append(author.pk)
 
-    for proofreader in core_models.AccountRole.objects.filter(
-        role__slug='proofreader',
-        journal=article.journal
+def galley_preview_url(request, galley, proofing_task=None,
+                       typesetting_task=None):
+    """
+    Returns the URL the browser loads a galley file from when previewing it.
+    The plugin's download views support Range requests so pdf.js can render
+    the first pages of a PDF before the rest of the file is downloaded.
+    :param request: HttpRequest
+    :param galley: a Galley object
+    :param proofing_task: the GalleyProofing the galley is previewed for
+    :param typesetting_task: the TypesettingAssignment the galley is
+    previewed for
+    :return: a URL or None when the user can't download the file, e.g. the
+    typesetter of a completed assignment
+    """
+    if proofing_task:
+        return reverse(
+            'typesetting_proofing_download',
+            args=[galley.article_id, proofing_task.pk, galley.file_id],
+        )
+
+    if (
+        typesetting_task
+        and typesetting_task.typesetter == request.user
+        and not typesetting_task.completed
     ):
-        pks.append(proofreader.user.pk)
+        return reverse(
+            'typesetting_typesetter_download_file',
+            args=[typesetting_task.pk, galley.file_id],
+        )
 
+    if security.can_manage_file(request, galley.file) is True:
+        return reverse(
+            'typesetting_download_file',
+            args=[galley.article_id, galley.file_id],
+        )
+
+    return None
+
+
+def get_proofreaders(article, round, assignment=None):
+    """
+    Returns the accounts that can be assigned to proofread an article in a
+    single query: the article's editors and authors and the journal's
+    proofreaders, excluding those already proofreading the round.
+    Each account is annotated with open_proofing_tasks, their number of open
+    proofreading tasks for the journal.
+    :param article: an Article object
+    :param round: the TypesettingRound to assign proofreaders to
+    :param assignment: a GalleyProofing object whose proofreader should
+        remain in the list
+    :return: a queryset of Account objects
+    """
+    current_proofreaders = models.GalleyProofing.objects.filter(
+        round=round,
+        proofreader__isnull=False,
+    )
     # If fetching for an assignment we want that user to remain in the list
-    if assignment and assignment.proofreader.pk in pks:
-        current_proofer_pks.remove(assignment.proofreader.pk)
+    if assignment:
+        current_proofreaders = current_proofreaders.exclude(
+            proofreader=assignment.proofreader,
+        )
+
+    open_tasks = models.GalleyProofing.objects.filter(
+        round__article__journal=article.journal,
+        completed__isnull=True,
+        cancelled=False,
+    )
 
     return core_models.Account.objects.filter(
-        pk__in=pks,
+        Q(pk__in=review_models.EditorAssignment.objects.filter(
+            article=article,
+        ).values('editor'))
+        | Q(pk__in=article.authors.values('pk'))
+        | Q(pk__in=core_models.AccountRole.objects.filter(
+            role__slug='proofreader',
+            journal=article.journal,
+        ).values('user'))
     ).exclude(
-        pk__in=current_proofer_pks,
+        pk__in=current_proofreaders.values('proofreader'),
+    ).annotate(
+        open_proofing_tasks=_count_per_account(open_tasks, 'proofreader'),
     )
 
 
@@ -138,6 +1097,7 @@ def handle_proofreader_file(request, assignment, article):
             )
 
 
+@transaction.atomic
 def new_typesetting_round(article, rounds, request):
     if not rounds:
         new_round = models.TypesettingRound.objects.create(
@@ -161,6 +1121,23 @@ def new_typesetting_round(article, rounds, request):
     return new_round
 
 
+def pending_corrections(assignment):
+    """
+    Returns the corrections of an assignment whose galley hasn't changed.
+    The cached galley checksums are loaded alongside the corrections so that
+    no file has to be re-hashed to work out if it was corrected.
+    :param assignment: a TypesettingAssignment object
+    :return: a list of TypesettingCorrection objects
+    """
+    corrections = assignment.corrections.select_related(
+        'galley__file__typesetting_checksum',
+    )
+    return [
+        correction for correction in corrections
+        if not correction.corrected
+    ]
+
+
 MISSING_GALLEYS = _("Article has no typeset files")
 MISSING_IMAGES = _("One or more typeset files are missing images")
 OPEN_TASKS = _(
@@ -168,16 +1145,14 @@ OPEN_TASKS = _(
 )
 
 
-def typesetting_pending_tasks(round):
+def typesetting_pending_tasks(round, galleys=None):
     pending_tasks = []
-    galleys = round.article.galley_set.all()
+    if galleys is None:
+        galleys = galleys_with_analysis(round.article.galley_set.all())
     if not galleys:
         pending_tasks.append(MISSING_GALLEYS)
-    else:
-        for galley in galleys:
-            if galley.has_missing_image_files():
-                pending_tasks.append(MISSING_IMAGES)
-                break
+    elif any(galley.missing_images for galley in galleys):
+        pending_tasks.append(MISSING_IMAGES)
 
     if round.has_open_tasks:
         pending_tasks.append(OPEN_TASKS)
@@ -221,12 +1196,17 @@ def complete_typesetting(request, article):
 
 def get_next_element(handshake_url, request):
     workflow = core_models.Workflow.objects.get(journal=request.journal)
-    workflow_elements = workflow.elements.all()
+    workflow_elements = list(workflow.elements.all())
 
-    current_element = workflow.elements.get(handshake_url=handshake_url)
+    current_element = [
+        element for element in workflow_elements
+        if element.handshake_url == handshake_url
+    ]
+    if not current_element:
+        raise core_models.WorkflowElement.DoesNotExist
 
     try:
-        index = list(workflow_elements).index(current_element) + 1
+        index = workflow_elements.index(current_element[0]) + 1
         return workflow_elements[index]
     except IndexError:
         # An index error will occur here when the workflow is complete
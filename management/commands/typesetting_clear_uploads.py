@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from plugins.typesetting import uploads
+
+
+class Command(BaseCommand):
+    """ Deletes the resumable uploads that were abandoned """
+
+    help = "Deletes the staged files of resumable uploads that were not " \
+           "completed nor resumed for a number of days."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=uploads.STALE_UPLOAD_DAYS,
+            help='Days without activity after which an upload is abandoned',
+        )
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for upload in uploads.stale_uploads(days=options['days']):
+            upload.delete_staged_file()
+            upload.delete()
+            deleted += 1
+
+        self.stdout.write('Deleted {} abandoned uploads'.format(deleted))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+
+from journal import models as journal_models
+from plugins.typesetting import synthetic
+
+
+class Command(BaseCommand):
+    """ Fills a journal with synthetic articles in the typesetting stage """
+
+    help = "Creates articles in the typesetting stage with rounds, tasks, " \
+           "corrections and galley files following realistic " \
+           "distributions, for load testing. Do not run it against a " \
+           "production journal."
+
+    def add_arguments(self, parser):
+        parser.add_argument('journal_code')
+        parser.add_argument(
+            '--articles',
+            type=int,
+            default=1000,
+        )
+        parser.add_argument(
+            '--typesetters',
+            type=int,
+            default=10,
+            help='Number of typesetters sharing the assignments',
+        )
+        parser.add_argument(
+            '--proofreaders',
+            type=int,
+            default=30,
+            help='Number of proofreaders sharing the proofing tasks',
+        )
+        parser.add_argument(
+            '--pdf_median_size',
+            type=int,
+            default=synthetic.LOAD_PDF_MEDIAN_SIZE,
+            help='Median size of the PDF galleys in bytes',
+        )
+        parser.add_argument(
+            '--pdf_max_size',
+            type=int,
+            default=synthetic.LOAD_PDF_MAX_SIZE,
+            help='Largest size of a PDF galley in bytes',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Seed of the random choices, to repeat a run',
+        )
+
+    def handle(self, *args, **options):
+        journal = journal_models.Journal.objects.get(
+            code=options['journal_code'],
+        )
+
+        created = 0
+        for article in synthetic.generate_load(
+            journal,
+            options['articles'],
+            typesetters=options['typesetters'],
+            proofreaders=options['proofreaders'],
+            pdf_median_size=options['pdf_median_size'],
+            pdf_max_size=options['pdf_max_size'],
+            seed=options['seed'],
+        ):
+            created += 1
+            if not created % 100:
+                self.stdout.write('Created {} articles'.format(created))
+
+        self.stdout.write(
+            'Created {0} articles in {1}'.format(created, journal.code)
+        )
@@ -0,0 +1,121 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from journal import models as journal_models
+from plugins.typesetting import loadtest
+
+
+class Command(BaseCommand):
+    """ Replays typesetting journeys against a running instance """
+
+    help = "Replays the journeys of managers, typesetters and proofreaders " \
+           "over HTTP and reports the latency percentiles of each view."
+
+    def add_arguments(self, parser):
+        parser.add_argument('journal_code')
+        parser.add_argument(
+            'base_url',
+            help='URL of the journal, e.g. http://localhost:8000/TST',
+        )
+        parser.add_argument(
+            '--journeys',
+            type=int,
+            default=200,
+            help='Number of journeys to replay',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=10,
+            help='Number of journeys replayed at the same time',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=60,
+        )
+        parser.add_argument(
+            '--manager',
+            default=None,
+            help='Username of the editor replaying the manager journeys',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            '--report',
+            default=None,
+            help='Path of a JSON file to write the summary to',
+        )
+
+    def handle(self, *args, **options):
+        journal = journal_models.Journal.objects.get(
+            code=options['journal_code'],
+        )
+        manager = loadtest.get_manager(journal, options['manager'])
+        if manager is None:
+            if options['manager']:
+                raise CommandError(
+                    '{0} is not an editor of {1}.'.format(
+                        options['manager'],
+                        journal.code,
+                    )
+                )
+            raise CommandError(
+                'No editor found for {}. Run typesetting_generate_load or '
+                'pass the username of an editor with --manager.'.format(
+                    journal.code,
+                )
+            )
+        journeys = loadtest.build_journeys(journal, manager)
+
+        users = {
+            user.pk: user
+            for role_journeys in journeys.values()
+            for user, _ in role_journeys
+        }
+        sessions = [loadtest.create_session(user) for user in users.values()]
+        try:
+            results = loadtest.run_load(
+                options['base_url'],
+                journeys,
+                {
+                    user_pk: session.session_key
+                    for user_pk, session in zip(users, sessions)
+                },
+                options['journeys'],
+                concurrency=options['concurrency'],
+                timeout=options['timeout'],
+                seed=options['seed'],
+            )
+        finally:
+            for session in sessions:
+                session.delete()
+
+        summary = loadtest.summarise(results)
+        self.stdout.write(
+            '{0:<30}{1:>9}{2:>8}{3:>10}{4:>10}{5:>10}{6:>10}'.format(
+                'view', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+                'max ms',
+            )
+        )
+        for label, row in summary.items():
+            self.stdout.write(
+                '{0:<30}{1:>9}{2:>8}{3:>10.0f}{4:>10.0f}{5:>10.0f}'
+                '{6:>10.0f}'.format(
+                    label,
+                    row['requests'],
+                    row['errors'],
+                    row['p50'],
+                    row['p95'],
+                    row['p99'],
+                    row['max'],
+                )
+            )
+
+        if options['report']:
+            with open(options['report'], 'w') as report:
+                json.dump(summary, report, indent=2)
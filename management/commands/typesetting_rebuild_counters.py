@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from journal import models as journal_models
+from plugins.typesetting import models
+
+
+class Command(BaseCommand):
+    """ Rebuilds the typesetting dashboard counters from the task tables """
+
+    help = "Rebuilds the typesetting dashboard counters from the task tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--journal_code',
+            default=None,
+            help='Only rebuild the counters of the given journal',
+        )
+
+    def handle(self, *args, **options):
+        journals = journal_models.Journal.objects.all()
+        if options.get('journal_code'):
+            journals = journals.filter(code=options['journal_code'])
+
+        for journal in journals:
+            with transaction.atomic():
+                counters = self.count_journal(journal)
+                models.TaskCounter.objects.filter(journal=journal).delete()
+                models.TaskCounter.objects.bulk_create(counters)
+                models.StageCounter.objects.refresh(journal.pk)
+
+            self.stdout.write(
+                'Rebuilt {0} counters for {1}'.format(
+                    len(counters),
+                    journal.code,
+                )
+            )
+
+    @staticmethod
+    def count_journal(journal):
+        typesetting_tasks = models.TypesettingAssignment.objects.filter(
+            round__article__journal=journal,
+            typesetter__isnull=False,
+            completed__isnull=True,
+            cancelled__isnull=True,
+        ).values('typesetter').annotate(count=Count('pk'))
+        proofing_tasks = models.GalleyProofing.objects.filter(
+            round__article__journal=journal,
+            proofreader__isnull=False,
+            completed__isnull=True,
+            cancelled=False,
+        ).values('proofreader').annotate(count=Count('pk'))
+
+        user_counters = {}
+        for row in typesetting_tasks:
+            counter = user_counters.setdefault(
+                row['typesetter'],
+                models.TaskCounter(journal=journal, user_id=row['typesetter']),
+            )
+            counter.typesetting_tasks = row['count']
+        for row in proofing_tasks:
+            counter = user_counters.setdefault(
+                row['proofreader'],
+                models.TaskCounter(journal=journal, user_id=row['proofreader']),
+            )
+            counter.proofing_tasks = row['count']
+
+        return list(user_counters.values())
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from plugins.typesetting import metrics, plugin_settings
+from plugins.typesetting.notifications import outbox
+
+
+class Command(BaseCommand):
+    """ Sends the typesetting notifications waiting in the outbox """
+
+    help = "Sends the typesetting notifications waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            default=False,
+            help='Keep polling the outbox instead of exiting when it is empty',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between polls when looping',
+        )
+        parser.add_argument(
+            '--batch_size',
+            type=int,
+            default=50,
+        )
+        parser.add_argument(
+            '--max_attempts',
+            type=int,
+            default=outbox.MAX_ATTEMPTS,
+            help='Attempts after which a message is moved to dead letter',
+        )
+        parser.add_argument(
+            '--metrics_file',
+            default=None,
+            help='Path of a file to write the notification metrics to after '
+                 'each batch, when TYPESETTING_METRICS is enabled',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = outbox.process_outbox(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+            )
+            if sent or failed:
+                self.stdout.write(
+                    'Sent {0} notifications, {1} failed'.format(sent, failed)
+                )
+            if options['metrics_file'] and plugin_settings.METRICS:
+                metrics.write_textfile(options['metrics_file'])
+
+            if not options['loop']:
+                if sent + failed < options['batch_size']:
+                    break
+            elif not sent + failed:
+                time.sleep(options['interval'])
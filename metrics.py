@@ -0,0 +1,287 @@
+"""
+Optional instrumentation of the typesetting plugin, enabled with the
+TYPESETTING_METRICS setting and built on prometheus_client.
+
+The views of urls.py are wrapped to record their wall time, database queries
+and the bytes they serve, and the notifications record how long each email
+and Slack message takes to send. Under a multi-process server the
+PROMETHEUS_MULTIPROC_DIR environment variable must point every process at
+the same directory before they start: the processes then write their
+measures to that directory and the typesetting_metrics view aggregates all
+of them on each scrape.
+"""
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from plugins.typesetting import plugin_settings
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+)
+QUERIES_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 200, 500, 1000)
+BYTES_BUCKETS = (
+    1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2,
+    100 * 1024 ** 2, 1024 ** 3,
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def histogram(name, description, label_names, buckets):
+    """ Returns a prometheus_client Histogram, None when not installed """
+    if prometheus_client is None:
+        return None
+    return prometheus_client.Histogram(
+        name,
+        description,
+        label_names,
+        buckets=buckets,
+    )
+
+
+VIEW_SECONDS = histogram(
+    'typesetting_view_seconds',
+    'Wall time of the typesetting views until the response is returned.',
+    ('view', 'method'),
+    SECONDS_BUCKETS,
+)
+VIEW_QUERIES = histogram(
+    'typesetting_view_queries',
+    'Database queries run by the typesetting views.',
+    ('view', 'method'),
+    QUERIES_BUCKETS,
+)
+VIEW_QUERY_SECONDS = histogram(
+    'typesetting_view_query_seconds',
+    'Time spent in database queries by the typesetting views.',
+    ('view', 'method'),
+    SECONDS_BUCKETS,
+)
+VIEW_RESPONSE_BYTES = histogram(
+    'typesetting_view_response_bytes',
+    'Bytes of the response bodies of the typesetting views.',
+    ('view', 'method'),
+    BYTES_BUCKETS,
+)
+NOTIFICATION_SECONDS = histogram(
+    'typesetting_notification_seconds',
+    'Time taken to send the typesetting notifications.',
+    ('notification', 'channel'),
+    SECONDS_BUCKETS,
+)
+
+
+def check_installed():
+    if prometheus_client is None:
+        raise ImproperlyConfigured(
+            'TYPESETTING_METRICS requires the prometheus_client package.',
+        )
+
+
+class QueryCounter(object):
+    """
+    A database execute wrapper counting the queries run through it and the
+    time they take.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class WrappedCursor(object):
+    """ Passes the queries of a cursor through an execute wrapper """
+
+    def __init__(self, cursor, wrapper):
+        self.cursor = cursor
+        self.wrapper = wrapper
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _execute(self, sql, params, many, context):
+        if many:
+            return self.cursor.executemany(sql, params)
+        return self.cursor.execute(sql, params)
+
+    def execute(self, sql, params=None):
+        context = {'connection': connection, 'cursor': self}
+        return self.wrapper(self._execute, sql, params, False, context)
+
+    def executemany(self, sql, param_list):
+        context = {'connection': connection, 'cursor': self}
+        return self.wrapper(self._execute, sql, param_list, True, context)
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """
+    Installs an execute wrapper on the default database connection while
+    the block runs. Django 2.0 and later provide this as
+    connection.execute_wrapper(), on older versions the cursors created by
+    the connection are wrapped instead.
+    :param wrapper: a callable taking (execute, sql, params, many, context)
+    """
+    if hasattr(connection, 'execute_wrapper'):
+        with connection.execute_wrapper(wrapper):
+            yield
+        return
+
+    prepare_cursor = connection._prepare_cursor
+    connection._prepare_cursor = lambda cursor: WrappedCursor(
+        prepare_cursor(cursor),
+        wrapper,
+    )
+    try:
+        yield
+    finally:
+        del connection._prepare_cursor
+
+
+@contextmanager
+def record_queries():
+    """
+    Counts the queries run on the default database connection while the
+    block runs, and the time they take.
+    :return: a QueryCounter updated as the queries run
+    """
+    counter = QueryCounter()
+    with execute_wrapper(counter):
+        yield counter
+
+
+def count_streamed_bytes(content, labels):
+    """ Passes a streamed body through, recording its size once sent """
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        VIEW_RESPONSE_BYTES.labels(**labels).observe(sent)
+
+
+def instrument_view(func):
+    """
+    Records the wall time, queries and response size of a view, labelled
+    with the name of the URL it was resolved from. Views raising an
+    exception are recorded too.
+    :param func: the view function to instrument
+    :return: the instrumented view function
+    """
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        url_name = getattr(request.resolver_match, 'url_name', None)
+        labels = {
+            'view': url_name or func.__name__,
+            'method': request.method,
+        }
+
+        start = time.perf_counter()
+        try:
+            with record_queries() as queries:
+                response = func(request, *args, **kwargs)
+        finally:
+            VIEW_SECONDS.labels(**labels).observe(time.perf_counter() - start)
+            VIEW_QUERIES.labels(**labels).observe(queries.count)
+            VIEW_QUERY_SECONDS.labels(**labels).observe(queries.seconds)
+
+        if getattr(response, 'streaming', False):
+            response.streaming_content = count_streamed_bytes(
+                response.streaming_content,
+                labels,
+            )
+        else:
+            VIEW_RESPONSE_BYTES.labels(**labels).observe(len(response.content))
+
+        return response
+
+    return wrapper
+
+
+def instrument_urlpatterns(urlpatterns):
+    """ Wraps the views of a list of url() patterns with instrument_view """
+    check_installed()
+    for pattern in urlpatterns:
+        pattern.callback = instrument_view(pattern.callback)
+    return urlpatterns
+
+
+@contextmanager
+def notification_timer(notification, channel):
+    """
+    Times the block sending a notification when metrics are enabled.
+    :param notification: the name of the notification, e.g. the event
+    :param channel: 'email' or 'slack'
+    """
+    if not plugin_settings.METRICS or prometheus_client is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        NOTIFICATION_SECONDS.labels(
+            notification=notification,
+            channel=channel,
+        ).observe(time.perf_counter() - start)
+
+
+def registry():
+    """
+    Returns the registry to render: the measures of every process sharing
+    PROMETHEUS_MULTIPROC_DIR when it is set, those of the current process
+    otherwise.
+    """
+    check_installed()
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return prometheus_client.REGISTRY
+
+    collector_registry = prometheus_client.CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def render():
+    """ Returns the histograms in the Prometheus text format """
+    return prometheus_client.generate_latest(registry())
+
+
+def write_textfile(path):
+    """
+    Writes the histograms to a file, for processes that don't share the
+    PROMETHEUS_MULTIPROC_DIR of the web server, such as a notification
+    worker running on another host, to be collected with e.g. the
+    node_exporter textfile collector. The file is replaced atomically so a
+    reader never sees it half written.
+    """
+    prometheus_client.write_to_textfile(path, registry())
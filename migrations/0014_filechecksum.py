@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_fix_url_emails'),
+        ('typesetting', '0013_merge_20210205_1049'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileChecksum',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=255)),
+                ('uuid_filename', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('date_computed', models.DateTimeField(auto_now=True)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='typesetting_checksum', to='core.File')),
+            ],
+        ),
+    ]
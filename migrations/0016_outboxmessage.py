@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('journal', '0001_initial'),
+        ('typesetting', '0015_taskcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handler', models.CharField(max_length=255)),
+                ('payload', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('dead', 'Dead Letter')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('delivered_channels', models.CharField(blank=True, max_length=255)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_sent', models.DateTimeField(blank=True, null=True)),
+                ('journal', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='journal.Journal')),
+            ],
+            options={
+                'ordering': ('next_attempt', 'pk'),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxmessage',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
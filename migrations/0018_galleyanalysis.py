@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_fix_url_emails'),
+        ('typesetting', '0017_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleyAnalysis',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=255)),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('missing_images_json', models.TextField(default='[]')),
+                ('image_names_json', models.TextField(default='[]')),
+                ('tables_json', models.TextField(blank=True, null=True)),
+                ('date_computed', models.DateTimeField(auto_now=True)),
+                ('galley', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='typesetting_analysis', to='core.Galley')),
+                ('xsl_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.XSLFile')),
+            ],
+        ),
+    ]
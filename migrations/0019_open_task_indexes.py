@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Partial indexes of the open tasks, on the backends supporting them. The
+# composite indexes below serve the same lookups on the other backends.
+PARTIAL_INDEXES = {
+    'postgresql': [
+        'CREATE INDEX typesetting_assignment_open_idx '
+        'ON typesetting_typesettingassignment (typesetter_id) '
+        'WHERE completed IS NULL AND cancelled IS NULL',
+        'CREATE INDEX typesetting_proofing_open_idx '
+        'ON typesetting_galleyproofing (proofreader_id) '
+        'WHERE completed IS NULL AND cancelled = false',
+    ],
+    'sqlite': [
+        'CREATE INDEX typesetting_assignment_open_idx '
+        'ON typesetting_typesettingassignment (typesetter_id) '
+        'WHERE completed IS NULL AND cancelled IS NULL',
+        'CREATE INDEX typesetting_proofing_open_idx '
+        'ON typesetting_galleyproofing (proofreader_id) '
+        'WHERE completed IS NULL AND cancelled = 0',
+    ],
+}
+PARTIAL_INDEX_NAMES = (
+    'typesetting_assignment_open_idx',
+    'typesetting_proofing_open_idx',
+)
+
+
+def create_partial_indexes(apps, schema_editor):
+    for statement in PARTIAL_INDEXES.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in PARTIAL_INDEXES:
+        for name in PARTIAL_INDEX_NAMES:
+            schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_fix_url_emails'),
+        ('typesetting', '0018_galleyanalysis'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='typesettingassignment',
+            index_together=set([('typesetter', 'completed', 'cancelled')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='galleyproofing',
+            index_together=set([('proofreader', 'completed', 'cancelled')]),
+        ),
+        migrations.RunPython(
+            create_partial_indexes,
+            reverse_code=drop_partial_indexes,
+        ),
+    ]
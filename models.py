@@ -1,14 +1,64 @@
+import json
+import os
+import uuid
 from datetime import date, timedelta
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
 from django.utils import timezone
 
+from core import models as core_models
+from journal import models as journal_models
 from plugins.typesetting import plugin_settings
+from submission import models as submission_models
 from utils import models as utils_models
 from utils import notify_helpers
 from events import logic as events_logic
 
 
+def typesetter_directory_cache_key(journal_id):
+    return 'typesetting_typesetter_workloads_{}'.format(journal_id)
+
+
+def invalidate_typesetter_directory(journal_id):
+    cache.delete(typesetter_directory_cache_key(journal_id))
+
+
+def preview_grant_version_key(model_label, assignment_id):
+    return 'typesetting_preview_grant_version_{0}_{1}'.format(
+        model_label,
+        assignment_id,
+    )
+
+
+def revoke_preview_grants(assignment):
+    """ Invalidates the preview grants issued for a typesetting or proofing
+    assignment
+    """
+    key = preview_grant_version_key(assignment._meta.label_lower, assignment.pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
 def review_choices():
     return (
         ('accept', 'Accept'),
@@ -26,11 +76,54 @@ class TypesettingClaim(models.Model):
         unique_together = ('editor', 'article',)
 
 
+class TypesettingRoundManager(models.Manager):
+
+    def with_stats(self):
+        """ Returns rounds loaded along with their tasks
+
+        Each round is annotated with proofing_total, proofing_completed and
+        proofing_open and has its typesetting assignment and proofing tasks
+        loaded, so that listing the rounds of an article costs a fixed number
+        of queries.
+        :return: a queryset of TypesettingRound objects
+        """
+        def count_proofing(**filters):
+            counts = GalleyProofing.objects.filter(
+                round=OuterRef('pk'),
+                **filters
+            ).order_by().values('round').annotate(
+                count=Count('pk'),
+            ).values('count')
+            return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+        return self.get_queryset().select_related(
+            'typesettingassignment__typesetter',
+            'typesettingassignment__manager',
+        ).prefetch_related(
+            Prefetch(
+                'galleyproofing_set',
+                queryset=GalleyProofing.objects.select_related(
+                    'proofreader',
+                    'manager',
+                ),
+            ),
+        ).annotate(
+            proofing_total=count_proofing(),
+            proofing_completed=count_proofing(
+                accepted__isnull=False,
+                completed__isnull=False,
+            ),
+            proofing_open=count_proofing(completed__isnull=True),
+        )
+
+
 class TypesettingRound(models.Model):
     article = models.ForeignKey('submission.Article')
     round_number = models.PositiveIntegerField(default=1)
     date_created = models.DateTimeField(auto_now_add=True)
 
+    objects = TypesettingRoundManager()
+
     class Meta:
         ordering = ('-round_number', 'date_created')
         unique_together = ('round_number', 'article',)
@@ -52,6 +145,10 @@ class TypesettingRound(models.Model):
             if not self.typesettingassignment.done:
                 return True
 
+        # Rounds loaded with TypesettingRound.objects.with_stats()
+        if hasattr(self, 'proofing_open'):
+            return bool(self.proofing_open)
+
         if self.galleyproofing_set.filter(completed__isnull=True).exists():
             return True
 
@@ -123,6 +220,10 @@ class TypesettingAssignment(models.Model):
         verbose_name='Note to Editor',
     )
 
+    class Meta:
+        # Open tasks of a typesetter, see also the partial index of 0019
+        index_together = ('typesetter', 'completed', 'cancelled')
+
     @property
     def time_to_due(self):
         if not self.due:
@@ -180,6 +281,7 @@ class TypesettingAssignment(models.Model):
             target=self.round.article,
         )
         self.save()
+        self.refresh_task_counter()
 
     def delete(self, user=None):
         utils_models.LogEntry.add_entry(
@@ -190,6 +292,7 @@ class TypesettingAssignment(models.Model):
             actor=user,
             target=self.round.article,
         )
+        revoke_preview_grants(self)
         super().delete()
 
     def cancel(self, user=None):
@@ -203,6 +306,8 @@ class TypesettingAssignment(models.Model):
         )
         self.cancelled = timezone.now()
         self.save()
+        self.refresh_task_counter()
+        revoke_preview_grants(self)
 
     def complete(self, note='', user=None):
         utils_models.LogEntry.add_entry(
@@ -221,6 +326,22 @@ class TypesettingAssignment(models.Model):
 
         self.completed = timezone.now()
         self.save()
+        self.refresh_task_counter()
+        revoke_preview_grants(self)
+
+    def decline(self):
+        self.completed = timezone.now()
+        self.save()
+        self.refresh_task_counter()
+
+    def refresh_task_counter(self, previous_typesetter_id=None):
+        """ Recounts the open tasks of the typesetter, and of the one the
+        task was taken from, once the current transaction commits
+        """
+        TaskCounter.objects.refresh_on_commit(
+            self.round.article.journal_id,
+            [self.typesetter_id, previous_typesetter_id],
+        )
 
     FRIENDLY_STATUSES = {
         "assigned": "Awaiting response from the typesetter.",
@@ -242,6 +363,40 @@ class TypesettingAssignment(models.Model):
     def friendly_status(self):
         return self.FRIENDLY_STATUSES.get(self.status)
 
+    def typesetter_files(self):
+        """ Returns the files of the article the typesetter can download
+        The files to typeset, the data/figure, supplementary and galley files
+        of the article and the files annotated by the proofreaders whose
+        corrections this round addresses. The queryset is built from
+        subqueries only, so checking whether it contains a file is a single
+        EXISTS query.
+        """
+        article_id = self.round.article_id
+        article_model = submission_models.Article
+        previous_round = TypesettingRound.objects.filter(
+            article_id=article_id,
+        ).values('pk')[1:2]
+
+        return core_models.File.objects.filter(
+            article_id=article_id,
+        ).filter(
+            Q(pk__in=self.files_to_typeset.values('pk'))
+            | Q(pk__in=article_model.data_figure_files.through.objects.filter(
+                article_id=article_id,
+            ).values('file_id'))
+            | Q(pk__in=article_model.supplementary_files.through.objects.filter(
+                article_id=article_id,
+            ).values('supplementaryfile__file_id'))
+            | Q(pk__in=core_models.Galley.objects.filter(
+                article_id=article_id,
+            ).values('file_id'))
+            | Q(pk__in=GalleyProofing.annotated_files.through.objects.filter(
+                galleyproofing__round=Subquery(previous_round),
+                galleyproofing__completed__isnull=False,
+                galleyproofing__cancelled=False,
+            ).values('file_id'))
+        )
+
     def proofing_assignments_for_corrections(self):
         """ Returns the proofreading assignemnts for corrections
         The proofreadings relevant for round n of proofing would have been
@@ -286,6 +441,8 @@ class GalleyProofing(models.Model):
 
     class Meta:
         ordering = ('assigned', 'accepted', 'pk')
+        # Open tasks of a proofreader, see also the partial index of 0019
+        index_together = ('proofreader', 'completed', 'cancelled')
 
     def __str__(self):
         return 'Proofing for Article {0} by {1}'.format(
@@ -293,6 +450,10 @@ class GalleyProofing(models.Model):
             self.proofreader.full_name(),
         )
 
+    def delete(self, *args, **kwargs):
+        revoke_preview_grants(self)
+        return super().delete(*args, **kwargs)
+
     def assign(self, user=None, skip=False):
         if not skip:
             self.notified = True
@@ -313,6 +474,8 @@ class GalleyProofing(models.Model):
         self.cancelled = True
         self.completed = timezone.now()
         self.save()
+        self.refresh_task_counter()
+        revoke_preview_grants(self)
 
         utils_models.LogEntry.add_entry(
             types='Proofreading Assignment Cancelled',
@@ -330,6 +493,7 @@ class GalleyProofing(models.Model):
         self.completed = None
         self.accepted = None
         self.save()
+        self.refresh_task_counter()
 
         utils_models.LogEntry.add_entry(
             types='Proofreading Assignment Reset',
@@ -347,6 +511,8 @@ class GalleyProofing(models.Model):
         self.completed = timezone.now()
         self.accepted = timezone.now()
         self.save()
+        self.refresh_task_counter()
+        revoke_preview_grants(self)
 
         utils_models.LogEntry.add_entry(
             types='Proofreading Assignment Complete',
@@ -358,6 +524,15 @@ class GalleyProofing(models.Model):
             target=self.round.article,
         )
 
+    def refresh_task_counter(self):
+        """ Recounts the open tasks of the proofreader once the current
+        transaction commits
+        """
+        TaskCounter.objects.refresh_on_commit(
+            self.round.article.journal_id,
+            [self.proofreader_id],
+        )
+
     def unproofed_galleys(self, galleys):
         check = []
         proofed_files = self.proofed_files.all()
@@ -469,11 +644,469 @@ class TypesettingCorrection(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.pk and not self.file_checksum:
-            self.file_checksum = self.galley.file.checksum()
+            self.file_checksum = FileChecksum.objects.for_file(
+                self.galley.file,
+            )
         super().save(*args, **kwargs)
 
     @property
     def corrected(self):
         if self.galley:
-            return self.file_checksum != self.galley.file.checksum()
+            current_checksum = FileChecksum.objects.for_file(self.galley.file)
+            return self.file_checksum != current_checksum
         return False
+
+
+class FileChecksumManager(models.Manager):
+
+    def for_file(self, file_obj):
+        """ Returns the checksum of a file, hashing it only on a cache miss
+
+        The cached value is trusted as long as the file on disk still has the
+        uuid, size and modification time recorded when it was hashed.
+        :param file_obj: a core.File object
+        :return: the file checksum as a string
+        """
+        try:
+            cached = file_obj.typesetting_checksum
+        except self.model.DoesNotExist:
+            cached = None
+
+        stat = os.stat(file_obj.self_article_path())
+        if cached and cached.matches(file_obj, stat):
+            return cached.checksum
+
+        return self.store(file_obj, file_obj.checksum(), stat=stat).checksum
+
+    def cached(self, file_obj, stat):
+        """ Returns the cached checksum of a file without ever hashing it
+        :param file_obj: a core.File object
+        :param stat: the os.stat_result of the file
+        :return: the file checksum as a string or None if not cached
+        """
+        try:
+            cached = file_obj.typesetting_checksum
+        except self.model.DoesNotExist:
+            return None
+
+        if cached.matches(file_obj, stat):
+            return cached.checksum
+        return None
+
+    def store(self, file_obj, checksum=None, stat=None):
+        """ Records the checksum of a file, hashing it if one isn't given
+        :param file_obj: a core.File object
+        :param checksum: an already computed checksum for the file
+        :param stat: an already computed os.stat_result for the file
+        :return: a FileChecksum object
+        """
+        if stat is None:
+            stat = os.stat(file_obj.self_article_path())
+        if checksum is None:
+            checksum = file_obj.checksum()
+
+        cached, _ = self.update_or_create(
+            file=file_obj,
+            defaults={
+                'checksum': checksum,
+                'uuid_filename': file_obj.uuid_filename,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+            },
+        )
+        file_obj.typesetting_checksum = cached
+
+        return cached
+
+
+class FileChecksum(models.Model):
+    """ A persisted checksum for a file, so it is hashed once per version """
+    file = models.OneToOneField(
+        'core.File',
+        on_delete=models.CASCADE,
+        related_name='typesetting_checksum',
+    )
+    checksum = models.CharField(max_length=255)
+    uuid_filename = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    date_computed = models.DateTimeField(auto_now=True)
+
+    objects = FileChecksumManager()
+
+    def __str__(self):
+        return 'Checksum for file {0}'.format(self.file_id)
+
+    def matches(self, file_obj, stat):
+        return (
+            self.uuid_filename == file_obj.uuid_filename
+            and self.size == stat.st_size
+            and self.mtime == stat.st_mtime
+        )
+
+
+class GalleyAnalysis(models.Model):
+    """ The result of parsing a galley file, so it is parsed once per version
+
+    Stores the images referenced by the galley that haven't been uploaded,
+    the names of its images and the tables of its rendered content. The
+    record is valid for the file checksum, XSL file and number of images it
+    was computed for.
+    """
+    galley = models.OneToOneField(
+        'core.Galley',
+        on_delete=models.CASCADE,
+        related_name='typesetting_analysis',
+    )
+    checksum = models.CharField(max_length=255)
+    xsl_file = models.ForeignKey(
+        'core.XSLFile',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+    )
+    image_count = models.PositiveIntegerField(default=0)
+    missing_images_json = models.TextField(default='[]')
+    image_names_json = models.TextField(default='[]')
+    tables_json = models.TextField(blank=True, null=True)
+    date_computed = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return 'Analysis of galley {0}'.format(self.galley_id)
+
+    def matches(self, galley, checksum, image_count):
+        return (
+            self.checksum == checksum
+            and self.xsl_file_id == galley.xsl_file_id
+            and self.image_count == image_count
+        )
+
+    @property
+    def missing_images(self):
+        return json.loads(self.missing_images_json)
+
+    @property
+    def image_names(self):
+        return json.loads(self.image_names_json)
+
+    @property
+    def tables(self):
+        """ The HTML of each table of the rendered galley, if extracted """
+        if self.tables_json is None:
+            return None
+        return json.loads(self.tables_json)
+
+
+class TaskCounterManager(models.Manager):
+
+    def for_dashboard(self, journal, user):
+        """ Returns the counters shown on the dashboard
+
+        Both counters are read in one query, missing counters are computed
+        and stored on first access.
+        :param journal: a Journal object
+        :param user: an Account object
+        :return: a tuple of the user's TaskCounter and the journal's
+        StageCounter
+        """
+        user_counter = self.filter(
+            journal=journal,
+            user=user,
+        ).select_related('journal__stagecounter').first()
+        if user_counter is None:
+            user_counter = self.refresh_user(journal.pk, user.pk)
+
+        try:
+            stage_counter = user_counter.journal.stagecounter
+        except StageCounter.DoesNotExist:
+            stage_counter = StageCounter.objects.refresh(journal.pk)
+
+        return user_counter, stage_counter
+
+    def refresh_user(self, journal_id, user_id):
+        """ Recounts the open tasks of a user for a journal """
+        typesetting_tasks = TypesettingAssignment.objects.filter(
+            typesetter_id=user_id,
+            round__article__journal_id=journal_id,
+            completed__isnull=True,
+            cancelled__isnull=True,
+        ).count()
+        proofing_tasks = GalleyProofing.objects.filter(
+            proofreader_id=user_id,
+            round__article__journal_id=journal_id,
+            completed__isnull=True,
+            cancelled=False,
+        ).count()
+        counter, _ = self.update_or_create(
+            journal_id=journal_id,
+            user_id=user_id,
+            defaults={
+                'typesetting_tasks': typesetting_tasks,
+                'proofing_tasks': proofing_tasks,
+            },
+        )
+        return counter
+
+    def refresh_on_commit(self, journal_id, user_ids=(), stage=False):
+        """ Recounts the counters of a journal once the current transaction
+        commits, so that the recount sees the changes made by the transaction
+        and nothing is recounted when it rolls back.
+
+        The lifecycle methods of the tasks call this. Changes that bypass
+        them, e.g. bulk_create() and update(), are covered as long as their
+        callers refresh the counters.
+        :param journal_id: the pk of a Journal
+        :param user_ids: the pks of the Accounts whose tasks changed
+        :param stage: whether articles entered or left the plugin stage
+        """
+        user_ids = set(user_ids) - {None}
+
+        def refresh():
+            # The journal or users may have been deleted by the transaction
+            if not journal_models.Journal.objects.filter(
+                pk=journal_id,
+            ).exists():
+                return
+            for user_id in core_models.Account.objects.filter(
+                pk__in=user_ids,
+            ).values_list('pk', flat=True):
+                self.refresh_user(journal_id, user_id)
+            if user_ids:
+                invalidate_typesetter_directory(journal_id)
+            if stage:
+                StageCounter.objects.refresh(journal_id)
+
+        transaction.on_commit(refresh)
+
+
+class TaskCounter(models.Model):
+    """ Denormalised open task counts of a user for the typesetting dashboard
+    """
+    journal = models.ForeignKey('journal.Journal', on_delete=models.CASCADE)
+    user = models.ForeignKey('core.Account', on_delete=models.CASCADE)
+    typesetting_tasks = models.PositiveIntegerField(default=0)
+    proofing_tasks = models.PositiveIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    objects = TaskCounterManager()
+
+    class Meta:
+        unique_together = ('journal', 'user')
+
+    def __str__(self):
+        return 'Typesetting counters for {0} in {1}'.format(
+            self.user_id,
+            self.journal_id,
+        )
+
+
+class StageCounterManager(models.Manager):
+
+    def refresh(self, journal_id):
+        """ Recounts the articles of a journal in the plugin stage """
+        articles_in_stage = submission_models.Article.objects.filter(
+            journal_id=journal_id,
+            stage=plugin_settings.STAGE,
+        ).count()
+        counter, _ = self.update_or_create(
+            journal_id=journal_id,
+            defaults={'articles_in_stage': articles_in_stage},
+        )
+        return counter
+
+
+class StageCounter(models.Model):
+    """ Denormalised number of articles of a journal in the plugin stage """
+    journal = models.OneToOneField(
+        'journal.Journal',
+        on_delete=models.CASCADE,
+    )
+    articles_in_stage = models.PositiveIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    objects = StageCounterManager()
+
+    def __str__(self):
+        return 'Typesetting stage counter for {0}'.format(self.journal_id)
+
+
+@receiver(pre_delete, sender=TypesettingAssignment)
+def refresh_typesetter_counter(sender, instance, **kwargs):
+    """ Recounts the tasks of the typesetter of a deleted assignment,
+    including assignments deleted along with their round or article
+    """
+    TaskCounter.objects.refresh_on_commit(
+        instance.round.article.journal_id,
+        [instance.typesetter_id],
+    )
+
+
+@receiver(pre_delete, sender=GalleyProofing)
+def refresh_proofreader_counter(sender, instance, **kwargs):
+    """ Recounts the tasks of the proofreader of a deleted proofing task,
+    including tasks deleted along with their round or article
+    """
+    TaskCounter.objects.refresh_on_commit(
+        instance.round.article.journal_id,
+        [instance.proofreader_id],
+    )
+
+
+@receiver(post_save, sender=core_models.AccountRole)
+@receiver(post_delete, sender=core_models.AccountRole)
+def invalidate_typesetter_directory_on_role_change(
+        sender,
+        instance,
+        **kwargs
+):
+    """ Drops the typesetter directory of a journal when its roles change """
+    if instance.journal_id:
+        invalidate_typesetter_directory(instance.journal_id)
+
+
+@receiver(pre_save, sender=submission_models.Article)
+def track_article_stage(sender, instance, **kwargs):
+    """ Records whether a saved article was in the plugin stage before """
+    instance._typesetting_was_in_stage = bool(
+        instance.pk
+    ) and submission_models.Article.objects.filter(
+        pk=instance.pk,
+        stage=plugin_settings.STAGE,
+    ).exists()
+
+
+@receiver(post_save, sender=submission_models.Article)
+def refresh_stage_counter(sender, instance, **kwargs):
+    """ Recounts the articles in the plugin stage when an article enters or
+    leaves it
+    """
+    in_stage = instance.stage == plugin_settings.STAGE
+    if in_stage != getattr(instance, '_typesetting_was_in_stage', False):
+        TaskCounter.objects.refresh_on_commit(
+            instance.journal_id,
+            stage=True,
+        )
+
+
+@receiver(pre_delete, sender=submission_models.Article)
+def refresh_stage_counter_on_delete(sender, instance, **kwargs):
+    """ Recounts the articles in the plugin stage when one of them is
+    deleted
+    """
+    if instance.stage == plugin_settings.STAGE:
+        TaskCounter.objects.refresh_on_commit(
+            instance.journal_id,
+            stage=True,
+        )
+
+
+def outbox_statuses():
+    return (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead Letter'),
+    )
+
+
+class OutboxMessage(models.Model):
+    """ A notification waiting to be sent by the outbox worker
+
+    Rows are written in the same transaction as the state change that
+    triggered the notification and drained by the
+    typesetting_send_notifications management command. The channels
+    (email, slack) a message went out on are recorded as they are sent, so
+    that a retry only sends the remaining channels.
+    """
+    handler = models.CharField(max_length=255)
+    journal = models.ForeignKey(
+        'journal.Journal',
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    payload = models.TextField()
+    status = models.CharField(
+        choices=outbox_statuses(),
+        max_length=10,
+        default='pending',
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    delivered_channels = models.CharField(max_length=255, blank=True)
+    date_created = models.DateTimeField(default=timezone.now)
+    date_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('next_attempt', 'pk')
+        index_together = ('status', 'next_attempt')
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.handler, self.status)
+
+
+def chunked_upload_kinds():
+    return (
+        ('galley', 'Typeset File'),
+        ('source', 'Source File'),
+        ('supp', 'Supplementary File'),
+        ('prod', 'Production Ready File'),
+    )
+
+
+class ChunkedUpload(models.Model):
+    """ A file being uploaded in chunks
+
+    The chunks are appended to a staging file until `offset` reaches `size`,
+    the file is then saved against the article as a file of the given kind.
+    """
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    owner = models.ForeignKey(
+        'core.Account',
+        on_delete=models.CASCADE,
+    )
+    article = models.ForeignKey(
+        'submission.Article',
+        on_delete=models.CASCADE,
+    )
+    assignment = models.ForeignKey(
+        TypesettingAssignment,
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+    )
+    kind = models.CharField(choices=chunked_upload_kinds(), max_length=10)
+    filename = models.CharField(max_length=1000)
+    label = models.CharField(max_length=400, blank=True)
+    public = models.BooleanField(default=True)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    date_created = models.DateTimeField(default=timezone.now)
+    date_updated = models.DateTimeField(auto_now=True)
+    date_completed = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('-date_created',)
+
+    def __str__(self):
+        return '{0} ({1}/{2})'.format(self.filename, self.offset, self.size)
+
+    @property
+    def staging_path(self):
+        return os.path.join(
+            settings.BASE_DIR,
+            'files',
+            'temp',
+            'typesetting_uploads',
+            str(self.token),
+        )
+
+    @property
+    def complete(self):
+        return self.offset >= self.size
+
+    def delete_staged_file(self):
+        try:
+            os.unlink(self.staging_path)
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,12 @@
 from django.shortcuts import reverse
 
+from plugins.typesetting import models
 from utils import notify_helpers
 from utils import models as utils_models
 
 
 def send_typesetting_complete(**kwargs):
+    delivery = kwargs['delivery']
     request = kwargs['request']
     article = kwargs['article']
 
@@ -18,7 +20,9 @@ def send_typesetting_complete(**kwargs):
         'target': article,
     }
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typesetting_complete',
         'subject_typesetting_complete',
@@ -26,10 +30,17 @@ def send_typesetting_complete(**kwargs):
         {'article': article},
         log_dict=log_dict,
     )
-    notify_helpers.send_slack(request, description, ['slack_editors'])
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
+        request,
+        description,
+        ['slack_editors'],
+    )
 
 
 def send_proofreader_assign_notification(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
     message = kwargs['message']
@@ -47,14 +58,18 @@ def send_proofreader_assign_notification(**kwargs):
             'types': 'Proofing Assignment',
             'target': assignment.round.article,
         }
-        notify_helpers.send_email_with_body_from_user(
+        delivery.send(
+            'email',
+            notify_helpers.send_email_with_body_from_user,
             request,
             'Proofing Request',
             assignment.proofreader.email,
             message,
             log_dict=log_dict,
         )
-        notify_helpers.send_slack(
+        delivery.send(
+            'slack',
+            notify_helpers.send_slack,
             request,
             description,
             ['slack_editors'],
@@ -70,6 +85,7 @@ def send_proofreader_assign_notification(**kwargs):
 
 
 def send_proofreader_assign_transaction_email(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
     event_type = kwargs.get('event_type')
@@ -93,7 +109,9 @@ def send_proofreader_assign_transaction_email(**kwargs):
     else:
         message_target = assignment.manager.email
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typesetting_proofreader_{}'.format(event_type),
         'Proofreader Assignment {}'.format(event_type),
@@ -104,7 +122,9 @@ def send_proofreader_assign_transaction_email(**kwargs):
         },
         log_dict=log_dict,
     )
-    notify_helpers.send_slack(
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
         request,
         description,
         ['slack_editors'],
@@ -112,6 +132,7 @@ def send_proofreader_assign_transaction_email(**kwargs):
 
 
 def send_typesetting_assign_notification(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
     skip = kwargs['skip']
@@ -129,14 +150,18 @@ def send_typesetting_assign_notification(**kwargs):
             'types': 'Typesetting Assignment',
             'target': assignment.round.article,
         }
-        notify_helpers.send_email_with_body_from_user(
+        delivery.send(
+            'email',
+            notify_helpers.send_email_with_body_from_user,
             request,
             'subject_typesetter_notification',
             assignment.typesetter.email,
             message,
             log_dict=log_dict,
         )
-        notify_helpers.send_slack(
+        delivery.send(
+            'slack',
+            notify_helpers.send_slack,
             request,
             description,
             ['slack_editors'],
@@ -151,7 +176,43 @@ def send_typesetting_assign_notification(**kwargs):
         )
 
 
+def send_typesetting_bulk_assign_notification(**kwargs):
+    delivery = kwargs['delivery']
+    typesetter = kwargs['typesetter']
+    request = kwargs['request']
+    skip = kwargs['skip']
+    assignments = models.TypesettingAssignment.objects.filter(
+        pk__in=kwargs['assignment_ids'],
+    ).select_related('round__article')
+
+    if not skip:
+        description = '{0} has been assigned as a typesetter for {1} ' \
+                      'articles'.format(typesetter.full_name(), len(assignments))
+        url = request.journal.site_url(reverse("typesetting_assignments"))
+        delivery.send(
+            'email',
+            notify_helpers.send_email_with_body_from_setting_template,
+            request,
+            'typesetting_notify_typesetter_bulk',
+            'subject_typesetting_notify_typesetter_bulk',
+            typesetter.email,
+            context={
+                'typesetter': typesetter,
+                'assignments': assignments,
+                'typesetting_assignments_url': url,
+            },
+        )
+        delivery.send(
+            'slack',
+            notify_helpers.send_slack,
+            request,
+            description,
+            ['slack_editors'],
+        )
+
+
 def send_typesetting_assign_decision(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
     decision = kwargs['decision']
@@ -170,7 +231,9 @@ def send_typesetting_assign_decision(**kwargs):
         'target': assignment.round.article,
     }
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typsetting_typesetter_decision_{}'.format(decision),
         'Typesetting Assignment Decision',
@@ -179,10 +242,17 @@ def send_typesetting_assign_decision(**kwargs):
         log_dict=log_dict,
     )
 
-    notify_helpers.send_slack(request, description, ['slack_editors'])
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
+        request,
+        description,
+        ['slack_editors'],
+    )
 
 
 def send_typesetting_assign_cancelled(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
 
@@ -198,7 +268,9 @@ def send_typesetting_assign_cancelled(**kwargs):
         'target': assignment.round.article,
     }
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typesetting_typesetter_cancelled',
         'Typesetting Assignment Cancelled',
@@ -207,10 +279,17 @@ def send_typesetting_assign_cancelled(**kwargs):
         log_dict=log_dict,
     )
 
-    notify_helpers.send_slack(request, description, ['slack_editors'])
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
+        request,
+        description,
+        ['slack_editors'],
+    )
 
 
 def send_typesetting_assign_deleted(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     request = kwargs['request']
 
@@ -226,7 +305,9 @@ def send_typesetting_assign_deleted(**kwargs):
         'target': assignment.round.article,
     }
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typesetting_typesetter_deleted',
         'Typesetting Assignment Deleted',
@@ -235,10 +316,17 @@ def send_typesetting_assign_deleted(**kwargs):
         log_dict=log_dict,
     )
 
-    notify_helpers.send_slack(request, description, ['slack_editors'])
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
+        request,
+        description,
+        ['slack_editors'],
+    )
 
 
 def send_typesetting_assign_complete(**kwargs):
+    delivery = kwargs['delivery']
     assignment = kwargs['assignment']
     article = assignment.round.article
     request = kwargs['request']
@@ -257,7 +345,9 @@ def send_typesetting_assign_complete(**kwargs):
         'target': article,
     }
 
-    notify_helpers.send_email_with_body_from_setting_template(
+    delivery.send(
+        'email',
+        notify_helpers.send_email_with_body_from_setting_template,
         request,
         'typesetting_typesetter_complete',
         'Typesetting Assignment Complete',
@@ -269,4 +359,10 @@ def send_typesetting_assign_complete(**kwargs):
         log_dict=log_dict,
     )
 
-    notify_helpers.send_slack(request, description, ['slack_editors'])
+    delivery.send(
+        'slack',
+        notify_helpers.send_slack,
+        request,
+        description,
+        ['slack_editors'],
+    )
@@ -21,6 +21,20 @@ def event_typesetting_assignment(request, assignment, message, skip):
         assignment.save()
 
 
+def event_typesetting_bulk_assignment(request, typesetter, assignments, skip):
+    kwargs = {
+        'typesetter': typesetter,
+        'assignment_ids': [assignment.pk for assignment in assignments],
+        'request': request,
+        'skip': skip,
+    }
+
+    events_logic.Events.raise_event(
+        plugin_settings.ON_TYPESETTING_BULK_ASSIGN_NOTIFICATION,
+        **kwargs,
+    )
+
+
 def event_decision_notification(assignment, request, note, decision):
     kwargs = {
         'assignment': assignment,
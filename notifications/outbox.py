@@ -0,0 +1,277 @@
+"""
+A transactional outbox for the typesetting notifications.
+
+Event handlers registered through `queued` don't send anything during the
+request, they serialise their arguments into an OutboxMessage row written in
+the same transaction as the state change that raised the event. The
+typesetting_send_notifications management command drains the outbox one
+message at a time: each message is claimed in a short transaction, sent
+outside of any transaction and its outcome recorded. Failed deliveries are
+retried with exponential backoff, only resending the channels that didn't go
+out, and messages that keep failing are moved to the dead letter status.
+
+To try it locally point EMAIL_HOST/EMAIL_PORT at a debugging SMTP server
+(e.g. `python -m aiosmtpd -n -l localhost:1025`) and run the worker.
+"""
+import json
+import traceback
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models as django_models, transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from core import models as core_models
+from journal import models as journal_models
+from press import models as press_models
+from plugins.typesetting import metrics, models
+from plugins.typesetting.notifications import emails
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 6 * 60 * 60
+# Seconds after which a message claimed by a worker that died is retried
+CLAIM_SECONDS = 10 * 60
+
+
+class OutboxRequest(object):
+    """
+    Stands in for the HttpRequest the email handlers were written against,
+    providing the attributes that notify_helpers and the email templates use.
+    """
+
+    def __init__(self, journal=None, user=None, remote_addr=None):
+        self.journal = journal
+        self.press = press_models.Press.objects.first()
+        self.repository = None
+        self.site_type = journal or self.press
+        self.model_content_type = ContentType.objects.get_for_model(
+            self.site_type,
+        )
+        self.user = user or AnonymousUser()
+        self.META = {'REMOTE_ADDR': remote_addr or '127.0.0.1'}
+        self.GET = QueryDict()
+        self.POST = QueryDict()
+        self.FILES = {}
+        self.path = self.path_info = '/'
+
+
+def queued(handler):
+    """
+    Returns an event handler that enqueues the given email handler.
+    :param handler: a function from plugins.typesetting.notifications.emails
+    :return: a function to register for the event
+    """
+    def enqueue(**kwargs):
+        request = kwargs.get('request')
+        models.OutboxMessage.objects.create(
+            handler=handler.__name__,
+            journal=getattr(request, 'journal', None),
+            payload=json.dumps(serialise_kwargs(kwargs), cls=DjangoJSONEncoder),
+        )
+
+    enqueue.__name__ = 'queued_{}'.format(handler.__name__)
+    return enqueue
+
+
+def serialise_kwargs(kwargs):
+    payload = {}
+    for key, value in kwargs.items():
+        if key == 'request':
+            payload[key] = {
+                'type': 'request',
+                'journal': getattr(value.journal, 'pk', None),
+                'user': getattr(value.user, 'pk', None),
+                'remote_addr': value.META.get('REMOTE_ADDR'),
+            }
+        elif isinstance(value, django_models.Model):
+            # The field values let the handler render an object deleted by
+            # the change that raised the event (e.g. a deleted assignment)
+            # or before the message is delivered.
+            payload[key] = {
+                'type': 'instance',
+                'model': value._meta.label_lower,
+                'pk': value.pk,
+                'fields': serializers.serialize(
+                    'python',
+                    [value],
+                    fields=[
+                        field.name for field in value._meta.concrete_fields
+                    ],
+                )[0]['fields'],
+            }
+        else:
+            payload[key] = {'type': 'value', 'value': value}
+
+    return payload
+
+
+def deserialise_kwargs(payload):
+    kwargs = {}
+    for key, item in payload.items():
+        if item['type'] == 'request':
+            kwargs[key] = OutboxRequest(
+                journal=journal_models.Journal.objects.filter(
+                    pk=item['journal'],
+                ).first(),
+                user=core_models.Account.objects.filter(
+                    pk=item['user'],
+                ).first(),
+                remote_addr=item['remote_addr'],
+            )
+        elif item['type'] == 'instance':
+            kwargs[key] = deserialise_instance(item)
+        else:
+            kwargs[key] = item['value']
+
+    return kwargs
+
+
+def deserialise_instance(item):
+    model = apps.get_model(item['model'])
+    if item['pk'] is not None:
+        instance = model.objects.filter(pk=item['pk']).first()
+        if instance is not None:
+            return instance
+
+    deserialised = next(serializers.deserialize('python', [{
+        'model': item['model'],
+        'pk': item['pk'],
+        'fields': item['fields'],
+    }]))
+    return deserialised.object
+
+
+def backoff(attempts):
+    seconds = BASE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, MAX_BACKOFF_SECONDS))
+
+
+class Delivery(object):
+    """
+    Passed to the email handlers as `delivery`, sends each channel of a
+    message unless an earlier attempt already sent it, recording the channels
+    as they go out and timing them when metrics are enabled.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.notification = message.handler.replace('send_', '', 1)
+
+    @property
+    def channels(self):
+        return set(filter(None, self.message.delivered_channels.split(',')))
+
+    def send(self, channel, send, *args, **kwargs):
+        """
+        Sends through a channel, once per message.
+        :param channel: 'email' or 'slack'
+        :param send: the function sending the notification, e.g. one of
+        notify_helpers
+        """
+        if channel in self.channels:
+            return
+
+        with metrics.notification_timer(self.notification, channel):
+            send(*args, **kwargs)
+        self.message.delivered_channels = ','.join(
+            sorted(self.channels | {channel}),
+        )
+        self.message.save(update_fields=['delivered_channels'])
+
+
+def claim(claim_seconds=CLAIM_SECONDS):
+    """
+    Claims the next due outbox message by marking it as sending in a short
+    transaction. A message whose worker died while sending becomes due again
+    once the claim expires.
+    :return: an OutboxMessage object or None when none are due
+    """
+    with transaction.atomic():
+        due = models.OutboxMessage.objects.filter(
+            status__in=['pending', 'sending'],
+            next_attempt__lte=timezone.now(),
+        )
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        else:
+            due = due.select_for_update()
+
+        message = due.first()
+        if message is None:
+            return None
+
+        message.status = 'sending'
+        message.attempts += 1
+        message.next_attempt = timezone.now() + timedelta(
+            seconds=claim_seconds,
+        )
+        message.save(update_fields=['status', 'attempts', 'next_attempt'])
+
+    return message
+
+
+def deliver(message, max_attempts=MAX_ATTEMPTS):
+    """
+    Runs the email handler of a claimed outbox message outside of any
+    transaction, then records the outcome.
+    :param message: an OutboxMessage object returned by claim
+    :param max_attempts: attempts after which the message is dead lettered
+    :return: True if the message was sent
+    """
+    try:
+        handler = getattr(emails, message.handler)
+        handler(
+            delivery=Delivery(message),
+            **deserialise_kwargs(json.loads(message.payload))
+        )
+    except Exception:
+        message.last_error = traceback.format_exc()
+        if message.attempts >= max_attempts:
+            message.status = 'dead'
+            logger.error(
+                'Typesetting notification %s dead lettered after %s attempts',
+                message.pk,
+                message.attempts,
+            )
+        else:
+            message.status = 'pending'
+            message.next_attempt = timezone.now() + backoff(message.attempts)
+        message.save(
+            update_fields=['status', 'next_attempt', 'last_error'],
+        )
+        return False
+
+    message.status = 'sent'
+    message.date_sent = timezone.now()
+    message.last_error = ''
+    message.save(update_fields=['status', 'date_sent', 'last_error'])
+    return True
+
+
+def process_outbox(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """
+    Delivers the outbox messages that are due, one at a time.
+    :param batch_size: the maximum number of messages to deliver
+    :param max_attempts: attempts after which a message is dead lettered
+    :return: a tuple of the number of messages sent and failed
+    """
+    sent = failed = 0
+    for _ in range(batch_size):
+        message = claim()
+        if message is None:
+            break
+        if deliver(message, max_attempts=max_attempts):
+            sent += 1
+        else:
+            failed += 1
+
+    return sent, failed
@@ -1,3 +1,5 @@
+from django.conf import settings
+
 from events import logic as events_logic
 from utils import plugins
 from utils.install import update_settings
@@ -20,8 +22,39 @@ STAGE = 'typesetting_plugin'
 KANBAN_CARD = 'typesetting/elements/card.html'
 DASHBOARD_TEMPLATE = 'typesetting/elements/dashboard.html'
 
+# Base URL of the pdf.js build used to preview PDF galleys. Deployments
+# without internet access can serve pdf.min.js, pdf_viewer.min.js and
+# pdf.worker.min.js themselves, e.g. TYPESETTING_PDFJS_URL = '/static/pdfjs/'
+PDFJS_URL = getattr(
+    settings,
+    'TYPESETTING_PDFJS_URL',
+    'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/1.6.319/',
+)
+
+# Lets the web server send the files downloaded through the plugin once the
+# permission checks have passed. Either None (files are streamed by Django),
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile).
+# For nginx TYPESETTING_FILE_OFFLOAD_PREFIX is the internal location aliased
+# to the files directory, e.g.:
+#   location /typesetting_files/ { internal; alias /path/to/src/files/; }
+FILE_OFFLOAD = getattr(settings, 'TYPESETTING_FILE_OFFLOAD', None)
+FILE_OFFLOAD_PREFIX = getattr(
+    settings,
+    'TYPESETTING_FILE_OFFLOAD_PREFIX',
+    '/typesetting_files/',
+)
+
+# Records the wall time, queries and response size of the plugin views and
+# the time taken by the notifications, served in the Prometheus text format
+# by the typesetting_metrics view. Scrapers authenticate with an
+# "Authorization: Bearer <TYPESETTING_METRICS_TOKEN>" header, staff users
+# can open the view in a browser.
+METRICS = getattr(settings, 'TYPESETTING_METRICS', False)
+METRICS_TOKEN = getattr(settings, 'TYPESETTING_METRICS_TOKEN', None)
+
 ON_TYPESETTING_COMPLETE = "on_typesetting_complete"
 ON_TYPESETTING_ASSIGN_NOTIFICATION = "on_typesetting_assign_notification"
+ON_TYPESETTING_BULK_ASSIGN_NOTIFICATION = "on_typesetting_bulk_assign_notification"
 ON_TYPESETTING_ASSIGN_DECISION = "on_typesetting_assign_decision"
 ON_TYPESETTING_ASSIGN_CANCELLED = "on_typesetting_assign_cancelled"
 ON_TYPESETTING_ASSIGN_DELETED = "on_typesetting_assign_deleted"
@@ -69,54 +102,59 @@ def hook_registry():
 
 def register_for_events():
     # Plugin modules can't be imported until plugin is loaded
-    from plugins.typesetting.notifications import emails
+    from plugins.typesetting.notifications import emails, outbox
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_ASSIGN_NOTIFICATION,
-        emails.send_typesetting_assign_notification,
+        outbox.queued(emails.send_typesetting_assign_notification),
+    )
+
+    events_logic.Events.register_for_event(
+        ON_TYPESETTING_BULK_ASSIGN_NOTIFICATION,
+        outbox.queued(emails.send_typesetting_bulk_assign_notification),
     )
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_ASSIGN_DECISION,
-        emails.send_typesetting_assign_decision,
+        outbox.queued(emails.send_typesetting_assign_decision),
     )
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_ASSIGN_CANCELLED,
-        emails.send_typesetting_assign_cancelled,
+        outbox.queued(emails.send_typesetting_assign_cancelled),
     )
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_ASSIGN_DELETED,
-        emails.send_typesetting_assign_deleted,
+        outbox.queued(emails.send_typesetting_assign_deleted),
     )
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_ASSIGN_COMPLETE,
-        emails.send_typesetting_assign_complete,
+        outbox.queued(emails.send_typesetting_assign_complete),
     )
 
     events_logic.Events.register_for_event(
         ON_PROOFREADER_ASSIGN_NOTIFICATION,
-        emails.send_proofreader_assign_notification,
+        outbox.queued(emails.send_proofreader_assign_notification),
     )
 
     events_logic.Events.register_for_event(
         ON_PROOFREADER_ASSIGN_CANCELLED,
-        emails.send_proofreader_assign_transaction_email,
+        outbox.queued(emails.send_proofreader_assign_transaction_email),
     )
 
     events_logic.Events.register_for_event(
         ON_PROOFREADER_ASSIGN_RESET,
-        emails.send_proofreader_assign_transaction_email,
+        outbox.queued(emails.send_proofreader_assign_transaction_email),
     )
 
     events_logic.Events.register_for_event(
         ON_PROOFREADER_ASSIGN_COMPLETE,
-        emails.send_proofreader_assign_transaction_email,
+        outbox.queued(emails.send_proofreader_assign_transaction_email),
     )
 
     events_logic.Events.register_for_event(
         ON_TYPESETTING_COMPLETE,
-        emails.send_typesetting_complete,
+        outbox.queued(emails.send_typesetting_complete),
     )
@@ -1,5 +1,6 @@
 from functools import wraps
 
+from django.core.cache import cache
 from django.shortcuts import reverse, redirect, get_object_or_404, Http404
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
@@ -45,11 +46,93 @@ def proofreader_for_article_required(func):
     return wrapper
 
 
+PREVIEW_GRANT_TIMEOUT = 60 * 15
+
+
+def preview_grant_key(user, galley_id, assignment_id=None):
+    return 'typesetting_preview_grant_{0}_{1}_{2}'.format(
+        user.pk,
+        assignment_id or 'editor',
+        galley_id,
+    )
+
+
+def grant_preview(request, galley, assignment=None):
+    """
+    Records that the current user was allowed to preview a galley so that
+    the requests for its figures don't have to check permissions again.
+    Grants expire after PREVIEW_GRANT_TIMEOUT and are revoked when the
+    assignment they were issued for is cancelled, completed or deleted.
+    :param request: HttpRequest
+    :param galley: the Galley object being previewed
+    :param assignment: the GalleyProofing or TypesettingAssignment, if any
+    """
+    model_label, version = None, 0
+    if assignment:
+        model_label = assignment._meta.label_lower
+        version = cache.get(
+            models.preview_grant_version_key(model_label, assignment.pk),
+            0,
+        )
+
+    cache.set(
+        preview_grant_key(
+            request.user,
+            galley.pk,
+            getattr(assignment, 'pk', None),
+        ),
+        {
+            'model': model_label,
+            'version': version,
+            'journal_id': request.journal.pk,
+            'article_id': galley.article_id,
+        },
+        PREVIEW_GRANT_TIMEOUT,
+    )
+
+
+def get_preview_grant(request, galley_id, assignment_id=None):
+    """
+    Returns the preview grant of the current user for a galley, if any
+    :param request: HttpRequest
+    :param galley_id: Galley object PK
+    :param assignment_id: the proofing or typesetting assignment id, if any
+    :return: a dict with the article_id of the galley, or None
+    """
+    if not galley_id:
+        return None
+
+    # The assignment id of the URL is either a proofing or a typesetting
+    # assignment, the grant records which one it was issued for.
+    grant_key = preview_grant_key(request.user, galley_id, assignment_id)
+    version_keys = {}
+    if assignment_id:
+        version_keys = {
+            model._meta.label_lower: models.preview_grant_version_key(
+                model._meta.label_lower,
+                assignment_id,
+            )
+            for model in (models.GalleyProofing, models.TypesettingAssignment)
+        }
+    values = cache.get_many([grant_key] + list(version_keys.values()))
+    grant = values.get(grant_key)
+
+    if not grant or grant['journal_id'] != getattr(request.journal, 'pk', None):
+        return None
+    if assignment_id:
+        version_key = version_keys.get(grant.get('model'))
+        if not version_key or grant['version'] != values.get(version_key, 0):
+            return None
+
+    return grant
+
+
 def can_preview_typesetting_article(func):
     """ Checks if the user should be allowed to preview articles files
 
     The user should either be an editor/production manager, a proofreader
-    for the article or a typesetter for the article
+    for the article or a typesetter for the article. Users holding a preview
+    grant for the galley are let through without querying the database.
     :param func: the function to callback from the decorator
     :return: either the function call or raises an PermissionDenied
     """
@@ -63,6 +146,15 @@ def can_preview_typesetting_article(func):
                 )
             )
 
+        grant = get_preview_grant(
+            request,
+            kwargs.get('galley_id'),
+            kwargs.get('assignment_id'),
+        )
+        if grant:
+            request.typesetting_preview_grant = grant
+            return func(request, *args, **kwargs)
+
         elif request.user.is_editor(request) or request.user.is_staff or request.user.is_production(request):
             return func(request, *args, **kwargs)
 
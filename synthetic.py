@@ -0,0 +1,438 @@
+"""
+Builds synthetic articles in the typesetting stage, with their rounds,
+typesetting and proofreading tasks, corrections and galley files, for
+benchmarking the plugin at a known size or loading a journal with a
+realistic volume of work.
+"""
+import base64
+import math
+import os
+import random
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import models as core_models
+from submission import models as submission_models
+from plugins.typesetting import models, plugin_settings
+
+GALLEY_TYPES = (
+    # (type, mime type, label, extension)
+    ('pdf', 'application/pdf', 'PDF', '.pdf'),
+    ('html', 'text/html', 'HTML', '.html'),
+)
+
+# A 1x1 transparent PNG used for the figures of HTML galleys
+FIGURE_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+    'hwGA60e6kgAAAABJRU5ErkJggg=='
+)
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+# Weighted choices used by generate_load, as ((value, weight), ...)
+LOAD_DISTRIBUTIONS = {
+    'rounds': ((1, 60), (2, 25), (3, 10), (4, 5)),
+    'galleys': ((1, 30), (2, 45), (3, 20), (4, 5)),
+    'proofreaders': ((0, 10), (1, 50), (2, 30), (3, 10)),
+    'figures': ((0, 20), (5, 30), (15, 30), (40, 15), (100, 5)),
+}
+# Share of the galleys corrected in each round after the first
+LOAD_CORRECTION_RATE = 0.7
+# Share of the articles whose last typesetting assignment is completed and
+# waiting for the proofreaders
+LOAD_TYPESET_RATE = 0.4
+LOAD_PDF_MEDIAN_SIZE = 2 * 1024 * 1024
+LOAD_PDF_MAX_SIZE = 50 * 1024 * 1024
+
+
+def dummy_pdf_chunks(size=1024):
+    """
+    Generates the bytes of a one page PDF padded with a comment to size
+    bytes, WRITE_CHUNK_SIZE bytes at a time.
+    """
+    content = (
+        b'%PDF-1.4\n'
+        b'1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n'
+        b'2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n'
+        b'3 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >> '
+        b'endobj\n'
+        b'trailer << /Root 1 0 R >>\n'
+    )
+    yield content
+
+    padding = max(size - len(content) - len(b'%%EOF\n'), 0)
+    while padding > 0:
+        chunk = min(padding, WRITE_CHUNK_SIZE)
+        yield b'%' * chunk
+        padding -= chunk
+
+    yield b'%%EOF\n'
+
+
+def dummy_pdf(size=1024):
+    """
+    Returns the bytes of a one page PDF padded with a comment to size bytes.
+    """
+    return b''.join(dummy_pdf_chunks(size))
+
+
+def dummy_html(figures=0):
+    """
+    Returns the bytes of an HTML galley referencing a number of figures.
+    """
+    body = ''.join(
+        '<figure><img src="fig{0}.png"/>'
+        '<figcaption>Figure {0}</figcaption></figure>'
+        '<table><tr><td>Table {0}</td></tr></table>'.format(index)
+        for index in range(1, figures + 1)
+    )
+    return '<html><body><p>Synthetic galley</p>{0}</body></html>'.format(
+        body,
+    ).encode('utf-8')
+
+
+def article_folder(article):
+    return os.path.join(
+        settings.BASE_DIR,
+        'files',
+        'articles',
+        str(article.pk),
+    )
+
+
+def remove_article_files(article):
+    """ Deletes the files written on disk for an article """
+    shutil.rmtree(article_folder(article), ignore_errors=True)
+
+
+def create_file(article, owner, filename, mime_type, content, is_galley=False):
+    """
+    Creates a core.File for an article and writes its content on disk.
+    :param article: the Article the file belongs to
+    :param owner: the Account owning the file
+    :param filename: the original name of the file
+    :param mime_type: the mime type of the file
+    :param content: the bytes of the file or an iterable of bytes
+    :param is_galley: whether the file is a galley file
+    :return: a core.File object
+    """
+    file_obj = core_models.File.objects.create(
+        mime_type=mime_type,
+        original_filename=filename,
+        uuid_filename='{0}{1}'.format(
+            uuid.uuid4(),
+            os.path.splitext(filename)[1],
+        ),
+        label=filename,
+        owner=owner,
+        is_galley=is_galley,
+        article_id=article.pk,
+    )
+
+    os.makedirs(article_folder(article), exist_ok=True)
+    if isinstance(content, bytes):
+        content = [content]
+    with open(file_obj.self_article_path(), 'wb') as file_handle:
+        for chunk in content:
+            file_handle.write(chunk)
+
+    return file_obj
+
+
+def create_galley(article, owner, galley_type, figures=0, pdf_size=1024):
+    """
+    Creates a galley of one of GALLEY_TYPES and its file. HTML galleys get
+    an image file for each of their figures.
+    :return: a core.Galley object
+    """
+    galley_type, mime_type, label, extension = galley_type
+    if galley_type == 'html':
+        content = dummy_html(figures)
+    else:
+        content = dummy_pdf_chunks(pdf_size)
+
+    galley_file = create_file(
+        article,
+        owner,
+        'galley-{0}{1}'.format(article.pk, extension),
+        mime_type,
+        content,
+        is_galley=True,
+    )
+    galley = core_models.Galley.objects.create(
+        article=article,
+        file=galley_file,
+        label=label,
+        type=galley_type,
+    )
+    if galley_type == 'html' and figures:
+        galley.images.add(*[
+            create_file(
+                article,
+                owner,
+                'fig{0}.png'.format(index),
+                'image/png',
+                FIGURE_PNG,
+            )
+            for index in range(1, figures + 1)
+        ])
+
+    return galley
+
+
+def create_article(
+        journal,
+        owner,
+        manager,
+        typesetter,
+        proofreaders,
+        rounds=1,
+        galleys=1,
+        figures=0,
+        pdf_size=1024,
+        title='Synthetic Article',
+        workflow_element=None,
+        correction_rate=1,
+        typeset=False,
+        rng=random,
+):
+    """
+    Creates an article in the typesetting stage. Every round has a
+    typesetting assignment, a proofreading task per proofreader and, from
+    the second round on, a correction for a share of the galleys. All the
+    tasks of the previous rounds are completed, the tasks of the last round
+    are open.
+    :param journal: the Journal of the article
+    :param owner: the Account owning the article and its files
+    :param manager: the Account managing the typesetting tasks
+    :param typesetter: the Account assigned to typeset every round
+    :param proofreaders: a list of Accounts assigned to proofread every round
+    :param rounds: the number of typesetting rounds
+    :param galleys: the number of galleys, cycling through GALLEY_TYPES
+    :param figures: the number of figures in the HTML galleys
+    :param pdf_size: the size of the PDF galleys in bytes
+    :param title: the title of the article
+    :param workflow_element: the WorkflowElement of the plugin to log the
+    article against
+    :param correction_rate: the share of the galleys corrected in each round
+    after the first
+    :param typeset: whether the typesetting assignment of the last round is
+    completed
+    :param rng: the random.Random instance picking the corrected galleys
+    :return: an Article object
+    """
+    now = timezone.now()
+    article = submission_models.Article.objects.create(
+        owner=owner,
+        title=title,
+        abstract='A synthetic article',
+        stage=plugin_settings.STAGE,
+        journal=journal,
+        correspondence_author=owner,
+        date_submitted=now,
+    )
+    if workflow_element:
+        core_models.WorkflowLog.objects.create(
+            article=article,
+            element=workflow_element,
+        )
+
+    manuscript = create_file(
+        article,
+        owner,
+        'manuscript.docx',
+        'application/vnd.openxmlformats-officedocument.'
+        'wordprocessingml.document',
+        b'Synthetic manuscript',
+    )
+    article.manuscript_files.add(manuscript)
+
+    article_galleys = [
+        create_galley(
+            article,
+            typesetter,
+            GALLEY_TYPES[index % len(GALLEY_TYPES)],
+            figures=figures,
+            pdf_size=pdf_size,
+        )
+        for index in range(galleys)
+    ]
+
+    for round_number in range(1, rounds + 1):
+        is_open = round_number == rounds
+        completed = None if is_open else now
+
+        typesetting_round = models.TypesettingRound.objects.create(
+            article=article,
+            round_number=round_number,
+        )
+        assignment = models.TypesettingAssignment.objects.create(
+            round=typesetting_round,
+            manager=manager,
+            typesetter=typesetter,
+            notified=True,
+            accepted=now,
+            due=now + timedelta(days=7),
+            completed=now if typeset else completed,
+            task='Typeset the article',
+        )
+        assignment.files_to_typeset.add(manuscript)
+        assignment.galleys_created.add(*article_galleys)
+
+        if round_number > 1:
+            models.TypesettingCorrection.objects.bulk_create([
+                models.TypesettingCorrection(
+                    task=assignment,
+                    galley=galley,
+                    label=galley.label,
+                    date_completed=completed,
+                )
+                for galley in article_galleys
+                if rng.random() < correction_rate
+            ])
+
+        for proofreader in proofreaders:
+            proofing = models.GalleyProofing.objects.create(
+                round=typesetting_round,
+                manager=manager,
+                proofreader=proofreader,
+                notified=True,
+                accepted=now,
+                due=now + timedelta(days=7),
+                completed=completed,
+                task='Proofread the galleys',
+            )
+            if not is_open:
+                proofing.proofed_files.add(*article_galleys)
+
+    return article
+
+
+def weighted_choice(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def get_or_create_user(journal, email, role_slug):
+    """
+    Returns the account with the given email, with the given role in the
+    journal, creating them if needed.
+    """
+    user, created = core_models.Account.objects.get_or_create(
+        username=email,
+        defaults={
+            'email': email,
+            'first_name': 'Synthetic',
+            'last_name': email.split('@')[0],
+            'is_active': True,
+        },
+    )
+    if created:
+        user.set_unusable_password()
+        user.save()
+
+    core_models.AccountRole.objects.get_or_create(
+        user=user,
+        journal=journal,
+        role=core_models.Role.objects.get(slug=role_slug),
+    )
+    return user
+
+
+def create_load_users(journal, typesetters, proofreaders):
+    """
+    Returns the manager, typesetters and proofreaders of a load run.
+    :return: a tuple of an Account and two lists of Accounts
+    """
+    manager = get_or_create_user(
+        journal,
+        'load-manager@{}.example.org'.format(journal.code.lower()),
+        'editor',
+    )
+    return manager, [
+        get_or_create_user(
+            journal,
+            'load-typesetter-{0}@{1}.example.org'.format(
+                index,
+                journal.code.lower(),
+            ),
+            'typesetter',
+        )
+        for index in range(typesetters)
+    ], [
+        get_or_create_user(
+            journal,
+            'load-proofreader-{0}@{1}.example.org'.format(
+                index,
+                journal.code.lower(),
+            ),
+            'proofreader',
+        )
+        for index in range(proofreaders)
+    ]
+
+
+def generate_load(
+        journal,
+        articles,
+        typesetters=10,
+        proofreaders=30,
+        pdf_median_size=LOAD_PDF_MEDIAN_SIZE,
+        pdf_max_size=LOAD_PDF_MAX_SIZE,
+        seed=None,
+):
+    """
+    Fills a journal with articles in the typesetting stage following
+    LOAD_DISTRIBUTIONS. The sizes of the PDF galleys follow a log-normal
+    distribution around pdf_median_size.
+    :param journal: the Journal to fill
+    :param articles: the number of articles to create
+    :param typesetters: the number of typesetters sharing the assignments
+    :param proofreaders: the number of proofreaders sharing the tasks
+    :param pdf_median_size: the median size of the PDF galleys in bytes
+    :param pdf_max_size: the largest size of a PDF galley in bytes
+    :param seed: the seed of the random choices, to repeat a run
+    :return: a generator of the Article objects, as they are created
+    """
+    rng = random.Random(seed)
+    manager, typesetter_pool, proofreader_pool = create_load_users(
+        journal,
+        typesetters,
+        proofreaders,
+    )
+    workflow_element = core_models.WorkflowElement.objects.filter(
+        journal=journal,
+        element_name=plugin_settings.PLUGIN_NAME,
+    ).first()
+
+    for index in range(articles):
+        proofreader_count = min(
+            weighted_choice(rng, LOAD_DISTRIBUTIONS['proofreaders']),
+            len(proofreader_pool),
+        )
+        pdf_size = int(min(
+            rng.lognormvariate(math.log(pdf_median_size), 1),
+            pdf_max_size,
+        ))
+        with transaction.atomic():
+            article = create_article(
+                journal,
+                owner=manager,
+                manager=manager,
+                typesetter=rng.choice(typesetter_pool),
+                proofreaders=rng.sample(proofreader_pool, proofreader_count),
+                rounds=weighted_choice(rng, LOAD_DISTRIBUTIONS['rounds']),
+                galleys=weighted_choice(rng, LOAD_DISTRIBUTIONS['galleys']),
+                figures=weighted_choice(rng, LOAD_DISTRIBUTIONS['figures']),
+                pdf_size=pdf_size,
+                title='Load Test Article {}'.format(index + 1),
+                workflow_element=workflow_element,
+                correction_rate=LOAD_CORRECTION_RATE,
+                typeset=rng.random() < LOAD_TYPESET_RATE,
+                rng=rng,
+            )
+        yield article
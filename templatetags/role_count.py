@@ -1,38 +1,41 @@
 from django import template
 
-from plugins.typesetting import models, plugin_settings
-from submission import models as submission_models
+from plugins.typesetting import models
 
 register = template.Library()
 
 
 @register.simple_tag(takes_context=True)
-def typesetting_tasks_count(context):
+def typesetting_dashboard_counts(context):
+    """ Returns all the dashboard counts for the current user and journal
+
+    The counts are read once per request, however many tags use them.
+    """
     request = context['request']
-    return models.TypesettingAssignment.objects.filter(
-        typesetter=request.user,
-        round__article__journal=request.journal,
-        completed__isnull=True,
-        cancelled__isnull=True,
-    ).count()
+    counts = getattr(request, 'typesetting_dashboard_counts', None)
+    if counts is None:
+        user_counter, stage_counter = models.TaskCounter.objects.for_dashboard(
+            request.journal,
+            request.user,
+        )
+        counts = request.typesetting_dashboard_counts = {
+            'typesetting_tasks': user_counter.typesetting_tasks,
+            'proofreading_tasks': user_counter.proofing_tasks,
+            'articles_in_stage': stage_counter.articles_in_stage,
+        }
+    return counts
+
+
+@register.simple_tag(takes_context=True)
+def typesetting_tasks_count(context):
+    return typesetting_dashboard_counts(context)['typesetting_tasks']
 
 
 @register.simple_tag(takes_context=True)
 def proofreading_tasks_count(context):
-    request = context['request']
-    return models.GalleyProofing.objects.filter(
-        round__article__journal=request.journal,
-        proofreader=request.user,
-        completed__isnull=True,
-        cancelled=False,
-    ).count()
+    return typesetting_dashboard_counts(context)['proofreading_tasks']
 
 
 @register.simple_tag(takes_context=True)
 def articles_in_stage_count(context):
-    request = context['request']
-
-    return submission_models.Article.objects.filter(
-        journal=request.journal,
-        stage=plugin_settings.STAGE,
-    ).count()
+    return typesetting_dashboard_counts(context)['articles_in_stage']
@@ -0,0 +1,334 @@
+__copyright__ = "Copyright 2017 Birkbeck, University of London"
+__author__ = "Martin Paul Eve, Andy Byers & Mauro Sanchez"
+__license__ = "AGPL v3"
+__maintainer__ = "Birkbeck Centre for Technology and Publishing"
+
+import json
+import os
+import statistics
+import time
+
+from django.shortcuts import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from plugins.typesetting import plugin_settings, synthetic
+from utils.testing import helpers
+from core import models as core_models
+
+# Size of the synthetic journal at each scale. The article the detail views
+# are requested for has the given number of rounds, galleys and
+# proofreaders, the other articles have one of each.
+SCALES = (
+    ('small', {'articles': 2, 'rounds': 1, 'galleys': 1, 'proofreaders': 1}),
+    ('large', {'articles': 10, 'rounds': 4, 'galleys': 6, 'proofreaders': 4}),
+)
+
+# Requests timed for each view, after a first request warming up the caches
+TIMED_REQUESTS = 3
+
+# Path of a JSON file the measures are written to, for comparing runs and
+# calibrating the budgets
+REPORT_PATH = os.environ.get('TYPESETTING_BENCHMARK_REPORT')
+
+# Queries allowed on top of the count measured for a view
+BUDGET_HEADROOM = 5
+
+# The GET views of urls.py, as (label, url name, user, url kwargs). Views
+# that only change state on POST (claiming, notifying, deleting and
+# uploading) are not benchmarked.
+VIEWS = (
+    ('manager', 'typesetting_manager', 'editor', lambda f: {}),
+    ('articles', 'typesetting_articles', 'editor', lambda f: {}),
+    ('articles_data', 'typesetting_articles_data', 'editor', lambda f: {}),
+    ('article', 'typesetting_article', 'editor', lambda f: {
+        'article_id': f['article'].pk,
+    }),
+    ('assign_typesetter', 'typesetting_assign_typesetter', 'editor',
+     lambda f: {'article_id': f['article'].pk}),
+    ('bulk_assign_typesetter', 'typesetting_bulk_assign_typesetter',
+     'editor', lambda f: {}),
+    ('review_assignment', 'typesetting_review_assignment', 'editor',
+     lambda f: {
+         'article_id': f['article'].pk,
+         'assignment_id': f['assignment'].pk,
+     }),
+    ('edit_galley', 'typesetting_edit_galley', 'editor', lambda f: {
+        'article_id': f['article'].pk,
+        'galley_id': f['galley'].pk,
+    }),
+    ('assign_proofreader', 'typesetting_assign_proofreader', 'editor',
+     lambda f: {'article_id': f['article'].pk}),
+    ('manage_proofing_assignment',
+     'typesetting_manage_proofing_assignment', 'editor', lambda f: {
+         'article_id': f['article'].pk,
+         'assignment_id': f['proofing'].pk,
+     }),
+    ('editor_preview_galley', 'editor_preview_galley', 'editor', lambda f: {
+        'article_id': f['article'].pk,
+        'galley_id': f['galley'].pk,
+    }),
+    ('download_file', 'typesetting_download_file', 'editor', lambda f: {
+        'article_id': f['article'].pk,
+        'file_id': f['galley'].file.pk,
+    }),
+    ('assignments', 'typesetting_assignments', 'typesetter', lambda f: {}),
+    ('assignment', 'typesetting_assignment', 'typesetter', lambda f: {
+        'assignment_id': f['assignment'].pk,
+    }),
+    ('typesetter_download_file', 'typesetting_typesetter_download_file',
+     'typesetter', lambda f: {
+         'assignment_id': f['assignment'].pk,
+         'file_id': f['galley'].file.pk,
+     }),
+    ('typesetter_download_all', 'typesetting_typesetter_download_all',
+     'typesetter', lambda f: {'assignment_id': f['assignment'].pk}),
+    ('typesetter_preview_galley', 'typesetting_preview_galley', 'typesetter',
+     lambda f: {
+         'article_id': f['article'].pk,
+         'galley_id': f['galley'].pk,
+         'assignment_id': f['assignment'].pk,
+     }),
+    ('proofreading_assignments', 'typesetting_proofreading_assignments',
+     'proofreader', lambda f: {}),
+    ('proofreading_assignment', 'typesetting_proofreading_assignment',
+     'proofreader', lambda f: {'assignment_id': f['proofing'].pk}),
+    ('proofing_download', 'typesetting_proofing_download', 'proofreader',
+     lambda f: {
+         'article_id': f['article'].pk,
+         'assignment_id': f['proofing'].pk,
+         'file_id': f['galley'].file.pk,
+     }),
+    ('proofreader_preview_galley', 'typesetting_preview_galley',
+     'proofreader', lambda f: {
+         'article_id': f['article'].pk,
+         'galley_id': f['galley'].pk,
+         'assignment_id': f['proofing'].pk,
+     }),
+)
+
+# The most queries a single request to each view should run, as returned
+# by budgets_from_report() for a report of this suite. Regenerate them when
+# a change to a view legitimately adds queries.
+QUERY_BUDGETS = {
+    'manager': 40,
+    'articles': 40,
+    'articles_data': 30,
+    'article': 80,
+    'assign_typesetter': 60,
+    'bulk_assign_typesetter': 50,
+    'review_assignment': 70,
+    'edit_galley': 60,
+    'assign_proofreader': 60,
+    'manage_proofing_assignment': 60,
+    'editor_preview_galley': 50,
+    'download_file': 30,
+    'assignments': 40,
+    'assignment': 70,
+    'typesetter_download_file': 30,
+    'typesetter_download_all': 30,
+    'typesetter_preview_galley': 50,
+    'proofreading_assignments': 40,
+    'proofreading_assignment': 50,
+    'proofing_download': 30,
+    'proofreader_preview_galley': 50,
+}
+
+# Extra GET parameters of each view
+QUERY_PARAMS = {
+    'articles_data': {'draw': 1, 'start': 0, 'length': 25},
+}
+
+
+def budgets_from_report(path, headroom=BUDGET_HEADROOM):
+    """
+    Computes the query budgets from a report written by the suite.
+    :param path: the path of a TYPESETTING_BENCHMARK_REPORT file
+    :param headroom: the queries allowed on top of the measured counts
+    :return: a dict of view label to query budget, for QUERY_BUDGETS
+    """
+    with open(path) as report:
+        results = json.load(report)
+
+    largest = SCALES[-1][0]
+    return {
+        label: measures[largest]['queries'] + headroom
+        for label, measures in sorted(results.items())
+    }
+
+
+class TestViewBudgets(TestCase):
+    """
+    Requests every view of the plugin against a small and a large synthetic
+    journal and fails when the number of queries of a view grows with the
+    size of the journal or goes over its budget.
+    """
+
+    def setUp(self):
+        self.journal_one, self.journal_two = helpers.create_journals()
+        helpers.create_roles(
+            ["editor", "production", "typesetter", "proofreader"],
+        )
+
+        self.editor = helpers.create_editor(self.journal_one)
+        self.author = helpers.create_regular_user()
+        self.typesetter = helpers.create_user(
+            username='typesetter@janeway.systems',
+            roles=['typesetter'],
+            journal=self.journal_one,
+        )
+        self.proofreaders = [
+            helpers.create_user(
+                username='proofer{}@janeway.systems'.format(index),
+                roles=['proofreader'],
+                journal=self.journal_one,
+            )
+            for index in range(max(
+                scale['proofreaders'] for _, scale in SCALES
+            ))
+        ]
+        for user in [self.editor, self.typesetter] + self.proofreaders:
+            user.is_active = True
+            user.save()
+
+        self.workflow_element = core_models.WorkflowElement.objects.create(
+            journal=self.journal_one,
+            element_name=plugin_settings.PLUGIN_NAME,
+            handshake_url=plugin_settings.HANDSHAKE_URL,
+            jump_url=plugin_settings.JUMP_URL,
+            stage=plugin_settings.STAGE,
+            article_url=True,
+        )
+        workflow, _ = core_models.Workflow.objects.get_or_create(
+            journal=self.journal_one,
+        )
+        workflow.elements.add(self.workflow_element)
+
+        self.articles = []
+
+    def tearDown(self):
+        for article in self.articles:
+            synthetic.remove_article_files(article)
+
+    def add_article(self, rounds=1, galleys=1, proofreaders=1):
+        article = synthetic.create_article(
+            self.journal_one,
+            owner=self.author,
+            manager=self.editor,
+            typesetter=self.typesetter,
+            proofreaders=self.proofreaders[:proofreaders],
+            rounds=rounds,
+            galleys=galleys,
+            figures=galleys,
+            title='Synthetic Article {}'.format(len(self.articles) + 1),
+            workflow_element=self.workflow_element,
+        )
+        self.articles.append(article)
+        return article
+
+    def grow_journal(self, scale):
+        """
+        Adds a target article of the given scale and as many other articles
+        as needed for the journal to reach the scale.
+        :return: the fixtures the view kwargs are built from
+        """
+        article = self.add_article(
+            rounds=scale['rounds'],
+            galleys=scale['galleys'],
+            proofreaders=scale['proofreaders'],
+        )
+        while len(self.articles) < scale['articles']:
+            self.add_article()
+
+        current_round = article.typesettinground_set.order_by(
+            '-round_number',
+        ).first()
+        return {
+            'article': article,
+            'galley': article.galley_set.order_by('pk').first(),
+            'assignment': current_round.typesettingassignment,
+            'proofing': current_round.galleyproofing_set.get(
+                proofreader=self.proofreaders[0],
+            ),
+        }
+
+    def request_view(self, url, params):
+        response = self.client.get(
+            url,
+            params,
+            SERVER_NAME=self.journal_one.domain or 'testserver',
+        )
+        if getattr(response, 'streaming', False):
+            # Streamed responses only hit the disk and database when read
+            b''.join(response.streaming_content)
+        return response
+
+    def measure_view(self, label, url_name, user, kwargs):
+        self.client.force_login(getattr(self, user))
+        url = reverse(url_name, kwargs=kwargs)
+        params = QUERY_PARAMS.get(label, {})
+
+        response = self.request_view(url, params)
+        self.assertLess(
+            response.status_code,
+            400,
+            '{} answered {}'.format(label, response.status_code),
+        )
+
+        timings = []
+        for _ in range(TIMED_REQUESTS):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                self.request_view(url, params)
+                timings.append(time.perf_counter() - start)
+
+        return {
+            'queries': len(queries),
+            'seconds': statistics.median(timings),
+        }
+
+    def write_report(self, results):
+        if not REPORT_PATH:
+            return
+        with open(REPORT_PATH, 'w') as report:
+            json.dump(results, report, indent=2, sort_keys=True)
+
+    def test_query_counts_do_not_grow_with_journal_size(self):
+        results = {label: {} for label, _, _, _ in VIEWS}
+        for scale_name, scale in SCALES:
+            fixtures = self.grow_journal(scale)
+            for label, url_name, user, kwargs in VIEWS:
+                results[label][scale_name] = self.measure_view(
+                    label,
+                    url_name,
+                    user,
+                    kwargs(fixtures),
+                )
+
+        self.write_report(results)
+
+        smallest, largest = SCALES[0][0], SCALES[-1][0]
+        problems = []
+        for label, measures in sorted(results.items()):
+            if measures[smallest]['queries'] != measures[largest]['queries']:
+                problems.append(
+                    '{} runs {} queries for a {} journal and {} for a {} '
+                    'journal'.format(
+                        label,
+                        measures[smallest]['queries'],
+                        smallest,
+                        measures[largest]['queries'],
+                        largest,
+                    )
+                )
+            if measures[largest]['queries'] > QUERY_BUDGETS[label]:
+                problems.append(
+                    '{} runs {} queries, over its budget of {}'.format(
+                        label,
+                        measures[largest]['queries'],
+                        QUERY_BUDGETS[label],
+                    )
+                )
+
+        self.assertEqual(problems, [])
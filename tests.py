@@ -3,14 +3,36 @@ __author__ = "Martin Paul Eve, Andy Byers & Mauro Sanchez"
 __license__ = "AGPL v3"
 __maintainer__ = "Birkbeck Centre for Technology and Publishing"
 
-from mock import Mock
+import hashlib
+import io
+import json
+import os
+import zipfile
+from datetime import timedelta
+from unittest import skipIf
 
+from mock import Mock, patch
+
+from django.db import connection
 from django.test import TestCase
 from django.utils import timezone
-from django.http import HttpRequest
+from django.http import HttpRequest, QueryDict
+from django.shortcuts import reverse
 from django.core.exceptions import PermissionDenied
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from plugins.typesetting import plugin_settings, models, security
+from plugins.typesetting import (
+    plugin_settings,
+    logic,
+    models,
+    security,
+    downloads,
+    uploads,
+    metrics,
+    synthetic,
+)
+from plugins.typesetting.notifications import outbox
+from plugins.typesetting.templatetags import role_count
 from submission import models as submission_models
 from utils.testing import helpers
 from core import models as core_models
@@ -174,6 +196,838 @@ class TestTypesetting(TestCase):
                 "Security Error: Non priviledged user can manage file."
             ) 
 
+    @staticmethod
+    def run_commit_callbacks():
+        """ Runs the on_commit callbacks, a TestCase never commits """
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
+
+    def test_task_counters_follow_assignment_lifecycle(self):
+        assignment = models.TypesettingAssignment.objects.get(
+            pk=self.typesetting_assignment.pk,
+        )
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.assertEqual(user_counter.typesetting_tasks, 1)
+
+        assignment.complete(user=self.typesetter)
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.assertEqual(user_counter.typesetting_tasks, 1)
+
+        self.run_commit_callbacks()
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.assertEqual(user_counter.typesetting_tasks, 0)
+
+        assignment.reopen(user=self.editor)
+        self.run_commit_callbacks()
+        user_counter, stage_counter = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.assertEqual(user_counter.typesetting_tasks, 1)
+        self.assertEqual(stage_counter.articles_in_stage, 1)
+
+    def test_task_counters_follow_proofing_lifecycle(self):
+        proofing = models.GalleyProofing.objects.get(
+            pk=self.galley_proofing.pk,
+        )
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.proofreader,
+        )
+        self.assertEqual(user_counter.proofing_tasks, 2)
+
+        proofing.cancel(user=self.editor)
+        self.run_commit_callbacks()
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.proofreader,
+        )
+        self.assertEqual(user_counter.proofing_tasks, 1)
+
+        proofing.reset(user=self.editor)
+        self.run_commit_callbacks()
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.proofreader,
+        )
+        self.assertEqual(user_counter.proofing_tasks, 2)
+
+    def test_dashboard_counts_read_once_per_request(self):
+        role_count.typesetting_dashboard_counts({
+            'request': self.prepare_request_with_user(
+                self.typesetter,
+                self.journal_one,
+            ),
+        })
+        context = {
+            'request': self.prepare_request_with_user(
+                self.typesetter,
+                self.journal_one,
+            ),
+        }
+
+        with self.assertNumQueries(1):
+            self.assertEqual(role_count.typesetting_tasks_count(context), 1)
+            self.assertEqual(role_count.proofreading_tasks_count(context), 0)
+            self.assertEqual(role_count.articles_in_stage_count(context), 1)
+
+    def test_task_counters_follow_cascade_deletes(self):
+        models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.typesetting_assignment.round.delete()
+        self.run_commit_callbacks()
+
+        user_counter, _ = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.typesetter,
+        )
+        self.assertEqual(user_counter.typesetting_tasks, 0)
+
+    def test_stage_counter_follows_articles_leaving_the_stage(self):
+        _, stage_counter = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.editor,
+        )
+        self.assertEqual(stage_counter.articles_in_stage, 1)
+
+        self.article_in_typesetting.stage = (
+            submission_models.STAGE_READY_FOR_PUBLICATION
+        )
+        self.article_in_typesetting.save()
+        self.run_commit_callbacks()
+
+        _, stage_counter = models.TaskCounter.objects.for_dashboard(
+            self.journal_one,
+            self.editor,
+        )
+        self.assertEqual(stage_counter.articles_in_stage, 0)
+
+    def test_outbox_serialises_deleted_assignment(self):
+        assignment = models.TypesettingAssignment.objects.create(
+            round=models.TypesettingRound.objects.create(
+                article=self.article_in_typesetting,
+                round_number=2,
+            ),
+            manager=self.editor,
+            typesetter=self.typesetter,
+            due=timezone.now(),
+        )
+        assignment.delete(user=self.editor)
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+        request.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+        outbox.queued(lambda **kwargs: None)(
+            assignment=assignment,
+            request=request,
+        )
+        message = models.OutboxMessage.objects.get()
+        kwargs = outbox.deserialise_kwargs(json.loads(message.payload))
+
+        self.assertEqual(kwargs['assignment'].typesetter, self.typesetter)
+        self.assertEqual(kwargs['request'].journal, self.journal_one)
+        self.assertEqual(kwargs['request'].user, self.editor)
+
+    def test_outbox_falls_back_to_fields_of_deleted_instance(self):
+        assignment = models.TypesettingAssignment.objects.create(
+            round=models.TypesettingRound.objects.create(
+                article=self.article_in_typesetting,
+                round_number=2,
+            ),
+            manager=self.editor,
+            typesetter=self.typesetter,
+            due=timezone.now().date(),
+        )
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+        request.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+        outbox.queued(lambda **kwargs: None)(
+            assignment=assignment,
+            request=request,
+        )
+        assignment.delete(user=self.editor)
+        message = models.OutboxMessage.objects.get()
+        kwargs = outbox.deserialise_kwargs(json.loads(message.payload))
+
+        self.assertEqual(kwargs['assignment'].typesetter, self.typesetter)
+        self.assertEqual(kwargs['assignment'].round_id, assignment.round_id)
+
+    def test_outbox_retry_skips_delivered_channels(self):
+        message = models.OutboxMessage.objects.create(
+            handler='send_typesetting_complete',
+            payload='{}',
+        )
+        send = Mock()
+        outbox.Delivery(message).send('email', send, 'email body')
+
+        retry = outbox.Delivery(
+            models.OutboxMessage.objects.get(pk=message.pk),
+        )
+        retry.send('email', send, 'email body')
+        retry.send('slack', send, 'slack body')
+
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(
+            models.OutboxMessage.objects.get(pk=message.pk).delivered_channels,
+            'email,slack',
+        )
+
+    def add_bulk_articles(self):
+        """ Adds an article without a round and one with an empty round """
+        without_round = submission_models.Article.objects.create(
+            owner=self.article_owner,
+            title='An Article Without A Round',
+            stage=plugin_settings.STAGE,
+            journal=self.journal_one,
+        )
+        manuscript = core_models.File.objects.create(
+            mime_type='application/pdf',
+            original_filename='manuscript.pdf',
+            uuid_filename='manuscript.pdf',
+            label='Manuscript',
+            owner=self.article_owner,
+            is_galley=False,
+            article_id=without_round.pk,
+        )
+        without_round.manuscript_files.add(manuscript)
+
+        with_empty_round = submission_models.Article.objects.create(
+            owner=self.article_owner,
+            title='An Article With An Empty Round',
+            stage=plugin_settings.STAGE,
+            journal=self.journal_one,
+        )
+        models.TypesettingRound.objects.create(article=with_empty_round)
+
+        return without_round, with_empty_round, manuscript
+
+    @patch.object(logic.notify, 'event_typesetting_bulk_assignment')
+    def test_bulk_assign_typesetter(self, event):
+        without_round, with_empty_round, manuscript = self.add_bulk_articles()
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+        request.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+        assignments, skipped = logic.bulk_assign_typesetter(
+            request,
+            [self.article_in_typesetting, without_round, with_empty_round],
+            self.typesetter,
+            task='Typeset the issue',
+        )
+
+        self.assertEqual(skipped, [self.article_in_typesetting])
+        self.assertEqual(
+            sorted(assignment.round.article_id for assignment in assignments),
+            sorted([without_round.pk, with_empty_round.pk]),
+        )
+        for article in (without_round, with_empty_round):
+            self.assertEqual(article.typesettinground_set.count(), 1)
+            assignment = models.TypesettingAssignment.objects.get(
+                round__article=article,
+            )
+            self.assertEqual(assignment.typesetter, self.typesetter)
+            self.assertEqual(assignment.manager, self.editor)
+        self.assertEqual(
+            list(models.TypesettingAssignment.objects.get(
+                round__article=without_round,
+            ).files_to_typeset.all()),
+            [manuscript],
+        )
+
+        event.assert_called_once_with(
+            request,
+            self.typesetter,
+            assignments,
+            skip=False,
+        )
+
+    @patch.object(logic.notify, 'event_typesetting_bulk_assignment')
+    def test_bulk_assign_typesetter_view(self, event):
+        without_round, with_empty_round, _ = self.add_bulk_articles()
+        self.client.force_login(self.editor)
+
+        response = self.client.post(
+            reverse('typesetting_bulk_assign_typesetter'),
+            {
+                'typesetter': self.typesetter.pk,
+                'articles': [
+                    self.article_in_typesetting.pk,
+                    without_round.pk,
+                    with_empty_round.pk,
+                ],
+                'task': 'Typeset the issue',
+                'display_proof_comments': 'on',
+            },
+            SERVER_NAME=self.journal_one.domain or 'testserver',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['skipped'], [self.article_in_typesetting.pk])
+        self.assertEqual(
+            sorted(result['assignments']),
+            sorted(models.TypesettingAssignment.objects.filter(
+                round__article__in=[without_round, with_empty_round],
+            ).values_list('pk', flat=True)),
+        )
+        self.assertEqual(event.call_count, 1)
+
+    def test_preview_grant_revoked_on_cancel(self):
+        galley = Mock()
+        galley.pk = 1
+        galley.article_id = self.article_in_typesetting.pk
+        request = self.prepare_request_with_user(
+            self.proofreader,
+            self.journal_one,
+        )
+        proofing = models.GalleyProofing.objects.get(
+            pk=self.galley_proofing.pk,
+        )
+
+        security.grant_preview(request, galley, proofing)
+        self.assertTrue(
+            security.get_preview_grant(request, galley.pk, proofing.pk),
+        )
+
+        proofing.cancel(user=self.editor)
+        self.assertIsNone(
+            security.get_preview_grant(request, galley.pk, proofing.pk),
+            "Security Error: Preview grant survives a cancelled assignment.",
+        )
+
+    def test_preview_grant_revoked_on_delete(self):
+        galley = Mock()
+        galley.pk = 1
+        galley.article_id = self.article_in_typesetting.pk
+        request = self.prepare_request_with_user(
+            self.proofreader,
+            self.journal_one,
+        )
+        proofing = models.GalleyProofing.objects.get(
+            pk=self.galley_proofing.pk,
+        )
+
+        security.grant_preview(request, galley, proofing)
+        proofing_id = proofing.pk
+        proofing.delete()
+        self.assertIsNone(
+            security.get_preview_grant(request, galley.pk, proofing_id),
+            "Security Error: Preview grant survives a deleted assignment.",
+        )
+
+    def test_parse_range(self):
+        self.assertEqual(downloads.parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(downloads.parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(downloads.parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(downloads.parse_range('bytes=0-5000', 1000), (0, 999))
+        self.assertFalse(downloads.parse_range('bytes=1000-', 1000))
+        self.assertIsNone(downloads.parse_range('bytes=0-1,5-9', 1000))
+        self.assertIsNone(downloads.parse_range('items=0-1', 1000))
+
+    def test_typesetter_files(self):
+        assignment = models.TypesettingAssignment.objects.get(
+            pk=self.typesetting_assignment.pk,
+        )
+        self.assertFalse(
+            assignment.typesetter_files().filter(
+                pk=self.private_file.pk,
+            ).exists(),
+            "Security Error: Typesetter can download an unrelated file.",
+        )
+
+        assignment.files_to_typeset.add(self.private_file)
+        self.assertTrue(
+            assignment.typesetter_files().filter(
+                pk=self.private_file.pk,
+            ).exists(),
+        )
+
+    def test_chunked_upload_rejects_out_of_order_chunk(self):
+        upload = models.ChunkedUpload.objects.create(
+            owner=self.typesetter,
+            article=self.article_in_typesetting,
+            assignment=self.typesetting_assignment,
+            kind='galley',
+            filename='article.pdf',
+            size=1024,
+            offset=512,
+        )
+
+        with self.assertRaises(uploads.ChunkedUploadError) as context:
+            uploads.append_chunk(upload, Mock(), 0, 512)
+
+        self.assertEqual(context.exception.status, 409)
+        self.assertEqual(upload.offset, 512)
+
+    def test_staged_galley_upload(self):
+        content = '<p>Café</p>'.encode('utf-8')
+        staged = logic.StagedGalleyUpload(
+            SimpleUploadedFile('article.html', content),
+        ).stage()
+        rejected = logic.StagedGalleyUpload(
+            SimpleUploadedFile('article.xml', '<p>Café</p>'.encode('latin-1')),
+        ).stage()
+
+        try:
+            self.assertIsNone(staged.error)
+            self.assertEqual(staged.checksum, hashlib.md5(content).hexdigest())
+            with open(staged.path, 'rb') as staged_file:
+                self.assertEqual(staged_file.read(), content)
+        finally:
+            staged.delete()
+
+        self.assertEqual(rejected.error, 'Uploaded file is not UTF-8 encoded')
+        self.assertFalse(os.path.exists(rejected.path))
+
+    def create_html_galley(self, figures=2):
+        galley = synthetic.create_galley(
+            self.article_in_typesetting,
+            self.article_owner,
+            synthetic.GALLEY_TYPES[1],
+            figures=figures,
+        )
+        self.addCleanup(
+            synthetic.remove_article_files,
+            self.article_in_typesetting,
+        )
+        return galley
+
+    def test_galleys_with_analysis_reads_stored_analysis(self):
+        galley = self.create_html_galley()
+        analysis = logic.get_galley_analysis(galley)
+
+        self.assertEqual(analysis.image_names, ['fig1.png', 'fig2.png'])
+        self.assertEqual(analysis.missing_images, [])
+        self.assertEqual(
+            analysis.checksum,
+            hashlib.md5(synthetic.dummy_html(2)).hexdigest(),
+        )
+
+        with patch.object(logic, 'analyse_galley') as analyse:
+            with self.assertNumQueries(1):
+                galleys = logic.galleys_with_analysis(
+                    core_models.Galley.objects.filter(pk=galley.pk),
+                )
+        self.assertFalse(analyse.called)
+        self.assertEqual(galleys[0].missing_images, [])
+
+    def test_galley_analysis_rebuilt_when_galley_changes(self):
+        galley = self.create_html_galley()
+        logic.get_galley_analysis(galley)
+
+        def reload_galley():
+            return logic.galleys_with_analysis(
+                core_models.Galley.objects.filter(pk=galley.pk),
+            )[0]
+
+        galley.images.remove(galley.images.get(original_filename='fig2.png'))
+        self.assertEqual(reload_galley().missing_images, ['fig2.png'])
+
+        path = galley.file.self_article_path()
+        with open(path, 'wb') as galley_file:
+            galley_file.write(synthetic.dummy_html(3))
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+        reloaded = reload_galley()
+        self.assertEqual(reloaded.missing_images, ['fig2.png', 'fig3.png'])
+        self.assertEqual(
+            reloaded.typesetting_analysis.checksum,
+            hashlib.md5(synthetic.dummy_html(3)).hexdigest(),
+        )
+
+        galley.xsl_file = core_models.XSLFile.objects.create(
+            label='Test XSL',
+            file='test.xsl',
+        )
+        galley.save()
+        with patch.object(
+                logic,
+                'analyse_galley',
+                wraps=logic.analyse_galley,
+        ) as analyse:
+            reloaded = reload_galley()
+        self.assertTrue(analyse.called)
+        self.assertEqual(
+            reloaded.typesetting_analysis.xsl_file_id,
+            galley.xsl_file_id,
+        )
+
+    @staticmethod
+    def read_zip_response(response):
+        return zipfile.ZipFile(
+            io.BytesIO(b''.join(response.streaming_content)),
+        )
+
+    def test_zip_response_names_and_skips_files(self):
+        article = self.article_in_typesetting
+        self.addCleanup(synthetic.remove_article_files, article)
+        figure = synthetic.create_file(
+            article,
+            self.article_owner,
+            'figure.png',
+            'image/png',
+            synthetic.FIGURE_PNG,
+        )
+        duplicate = synthetic.create_file(
+            article,
+            self.article_owner,
+            'Figure.png',
+            'image/png',
+            synthetic.FIGURE_PNG,
+        )
+        notes = synthetic.create_file(
+            article,
+            self.article_owner,
+            'notes.txt',
+            'text/plain',
+            b'Typesetting notes',
+        )
+        missing = synthetic.create_file(
+            article,
+            self.article_owner,
+            'missing.txt',
+            'text/plain',
+            b'Deleted from disk',
+        )
+        os.unlink(missing.self_article_path())
+
+        archive = self.read_zip_response(downloads.zip_response(
+            [figure, duplicate, missing, notes],
+            ('articles', article.pk),
+            'files.zip',
+        ))
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            archive.namelist(),
+            ['figure.png', 'Figure (1).png', 'notes.txt'],
+        )
+        self.assertEqual(
+            archive.getinfo('figure.png').compress_type,
+            zipfile.ZIP_STORED,
+        )
+        self.assertEqual(
+            archive.getinfo('notes.txt').compress_type,
+            zipfile.ZIP_DEFLATED,
+        )
+        self.assertEqual(archive.read('notes.txt'), b'Typesetting notes')
+
+    def test_typesetter_download_all(self):
+        article = self.article_in_typesetting
+        self.addCleanup(synthetic.remove_article_files, article)
+        manuscript = synthetic.create_file(
+            article,
+            self.article_owner,
+            'manuscript.docx',
+            'application/octet-stream',
+            b'Manuscript',
+        )
+        self.typesetting_assignment.files_to_typeset.add(manuscript)
+        galley = synthetic.create_galley(
+            article,
+            self.article_owner,
+            synthetic.GALLEY_TYPES[0],
+        )
+        self.client.force_login(self.typesetter)
+
+        response = self.client.get(
+            reverse(
+                'typesetting_typesetter_download_all',
+                kwargs={'assignment_id': self.typesetting_assignment.pk},
+            ),
+            SERVER_NAME=self.journal_one.domain or 'testserver',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        archive = self.read_zip_response(response)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted([
+                manuscript.original_filename,
+                galley.file.original_filename,
+            ]),
+        )
+        self.assertNotIn(
+            self.private_file.original_filename,
+            archive.namelist(),
+        )
+
+    def test_save_galley_images_from_zip(self):
+        galley = self.create_html_galley()
+        galley.images.clear()
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('images/', b'')
+            archive.writestr('images/nested/fig1.png', synthetic.FIGURE_PNG)
+            archive.writestr('FIG1.PNG', synthetic.FIGURE_PNG)
+            archive.writestr('other.png', synthetic.FIGURE_PNG)
+
+        results = logic.save_galley_images_from_zip(
+            request,
+            galley,
+            SimpleUploadedFile('images.zip', buffer.getvalue()),
+        )
+
+        self.assertEqual(results, [
+            ('images/nested/fig1.png', True, 'Saved as fig1.png'),
+            ('FIG1.PNG', False, 'Already uploaded'),
+            ('other.png', False, 'Not referenced by the galley'),
+        ])
+        self.assertEqual(
+            list(galley.images.values_list('original_filename', flat=True)),
+            ['fig1.png'],
+        )
+        self.assertEqual(
+            logic.get_galley_analysis(galley).missing_images,
+            ['fig2.png'],
+        )
+
+    def test_save_galley_images_from_invalid_zip(self):
+        galley = self.create_html_galley()
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+
+        results = logic.save_galley_images_from_zip(
+            request,
+            galley,
+            SimpleUploadedFile('images.zip', b'Not a ZIP file'),
+        )
+
+        self.assertEqual(
+            results,
+            [('images.zip', False, 'Not a valid ZIP file')],
+        )
+
+    def test_round_stats(self):
+        round = models.TypesettingRound.objects.with_stats().get(
+            pk=self.typesetting_round.pk,
+        )
+
+        self.assertEqual(round.proofing_total, 2)
+        self.assertEqual(round.proofing_completed, 0)
+        self.assertEqual(round.proofing_open, 2)
+        self.assertTrue(round.has_open_tasks)
+
+    def table_request(self, user=None, **params):
+        request = self.prepare_request_with_user(
+            user or self.editor,
+            self.journal_one,
+        )
+        request.GET = QueryDict(mutable=True)
+        request.GET.update(params)
+        return request
+
+    def add_table_articles(self):
+        """ Adds articles to the stage with distinct sortable columns """
+        articles = []
+        for index, (title, last_name) in enumerate([
+            ('Cartography of Tides', 'Zeller'),
+            ('Anatomy of Lichens', 'Moreau'),
+            ('Brewing in Antiquity', 'Abbott'),
+        ]):
+            author = core_models.Account.objects.create(
+                email='table{}@janeway.systems'.format(index),
+                username='table{}@janeway.systems'.format(index),
+                first_name='Table',
+                last_name=last_name,
+            )
+            articles.append(submission_models.Article.objects.create(
+                owner=self.article_owner,
+                correspondence_author=author,
+                title=title,
+                stage=plugin_settings.STAGE,
+                journal=self.journal_one,
+                date_submitted=timezone.now() - timedelta(days=index),
+            ))
+        submission_models.Article.objects.create(
+            owner=self.article_owner,
+            title='Cartography Outside The Stage',
+            stage=submission_models.STAGE_READY_FOR_PUBLICATION,
+            journal=self.journal_one,
+        )
+        return articles
+
+    @staticmethod
+    def table_pks(table):
+        return [int(row[0]) for row in table['data']]
+
+    def test_articles_table_pages(self):
+        articles = [self.article_in_typesetting] + self.add_table_articles()
+        pks = sorted(article.pk for article in articles)
+
+        first = logic.articles_in_typesetting_table(
+            self.table_request(draw='3', start='0', length='3'),
+        )
+        second = logic.articles_in_typesetting_table(
+            self.table_request(start='3', length='3'),
+        )
+
+        self.assertEqual(first['draw'], 3)
+        self.assertEqual(first['recordsTotal'], 4)
+        self.assertEqual(first['recordsFiltered'], 4)
+        self.assertEqual(self.table_pks(first), pks[:3])
+        self.assertEqual(self.table_pks(second), pks[3:])
+
+    def test_articles_table_search(self):
+        articles = self.add_table_articles()
+
+        by_title = logic.articles_in_typesetting_table(
+            self.table_request(**{'search[value]': 'cartography'}),
+        )
+        by_author = logic.articles_in_typesetting_table(
+            self.table_request(**{'search[value]': 'Moreau'}),
+        )
+        by_pk = logic.articles_in_typesetting_table(
+            self.table_request(**{'search[value]': str(articles[2].pk)}),
+        )
+
+        self.assertEqual(self.table_pks(by_title), [articles[0].pk])
+        self.assertEqual(by_title['recordsTotal'], 4)
+        self.assertEqual(by_title['recordsFiltered'], 1)
+        self.assertEqual(self.table_pks(by_author), [articles[1].pk])
+        self.assertIn(articles[2].pk, self.table_pks(by_pk))
+
+    def test_articles_table_ordering(self):
+        self.add_table_articles()
+        articles = logic.get_articles_in_typesetting(
+            self.table_request(),
+        )
+
+        for column, field in logic.ARTICLE_TABLE_ORDERING.items():
+            for direction, prefix in (('asc', ''), ('desc', '-')):
+                table = logic.articles_in_typesetting_table(
+                    self.table_request(**{
+                        'order[0][column]': str(column),
+                        'order[0][dir]': direction,
+                    }),
+                )
+                self.assertEqual(
+                    self.table_pks(table),
+                    list(articles.order_by(
+                        prefix + field,
+                        'pk',
+                    ).values_list('pk', flat=True)),
+                    'column {} {}'.format(column, direction),
+                )
+
+        by_title = logic.articles_in_typesetting_table(
+            self.table_request(**{'order[0][column]': '1'}),
+        )
+        self.assertEqual(
+            [row[1] for row in by_title['data']],
+            [
+                'A Test Article',
+                'Anatomy of Lichens',
+                'Brewing in Antiquity',
+                'Cartography of Tides',
+            ],
+        )
+
+    def test_articles_table_filters_claimed_articles(self):
+        articles = self.add_table_articles()
+        models.TypesettingClaim.objects.create(
+            editor=self.editor,
+            article=articles[1],
+        )
+
+        table = logic.articles_in_typesetting_table(
+            self.table_request(filter='me'),
+        )
+
+        self.assertEqual(self.table_pks(table), [articles[1].pk])
+        self.assertEqual(table['recordsTotal'], 1)
+        self.assertEqual(table['recordsFiltered'], 1)
+
+    def test_articles_table_view(self):
+        self.add_table_articles()
+        self.client.force_login(self.editor)
+
+        response = self.client.get(
+            reverse('typesetting_articles_data'),
+            {'draw': 1, 'start': 0, 'length': 2},
+            SERVER_NAME=self.journal_one.domain or 'testserver',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        table = response.json()
+        self.assertEqual(table['recordsTotal'], 4)
+        self.assertEqual(len(table['data']), 2)
+
+    def test_typesetter_directory_follows_roles(self):
+        directory = logic.get_typesetter_directory(self.journal_one)
+        self.assertEqual(directory, [self.typesetter])
+        self.assertEqual(directory[0].open_typesetting_tasks, 1)
+
+        core_models.AccountRole.objects.filter(
+            user=self.typesetter,
+            role__slug='typesetter',
+        ).delete()
+        self.assertEqual(logic.get_typesetter_directory(self.journal_one), [])
+
+    @skipIf(metrics.prometheus_client is None, 'prometheus_client missing')
+    def test_metrics_record_failing_views(self):
+        def failing_view(request):
+            raise PermissionDenied
+
+        request = self.prepare_request_with_user(
+            self.editor,
+            self.journal_one,
+        )
+        request.method = 'GET'
+        request.resolver_match = None
+
+        with self.assertRaises(PermissionDenied):
+            metrics.instrument_view(failing_view)(request)
+
+        self.assertIn(
+            'typesetting_view_seconds_count{method="GET",'
+            'view="failing_view"} 1.0',
+            metrics.render().decode(),
+        )
+
+    def test_record_queries_counts_without_debug_cursor(self):
+        force_debug_cursor = connection.force_debug_cursor
+        with metrics.record_queries() as queries:
+            list(models.TypesettingAssignment.objects.all())
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        self.assertEqual(queries.count, 2)
+        self.assertGreaterEqual(queries.seconds, 0)
+        self.assertEqual(connection.force_debug_cursor, force_debug_cursor)
+
+        with metrics.record_queries() as queries:
+            pass
+        self.assertEqual(queries.count, 0)
+
     @classmethod
     def setUpTestData(self):
         """
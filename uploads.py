@@ -0,0 +1,218 @@
+"""
+Resumable uploads for the files of the typesetting plugin.
+
+A client starts an upload by posting the name and size of the file, then
+sends the file in order as PATCH requests whose Upload-Offset header is the
+position of the chunk in the file, optionally with an Upload-Checksum header
+("<algorithm> <base64 digest>") that is verified before the chunk is
+accepted. A GET returns the current offset so that an interrupted upload can
+carry on from the last chunk received. Once the last chunk is received the
+staged file is saved against the article like a regular upload.
+"""
+import base64
+import hashlib
+import mimetypes
+import os
+from datetime import timedelta
+
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+
+from production import logic as production_logic
+from plugins.typesetting import models, logic
+
+CHUNK_MAX_SIZE = 16 * 1024 * 1024
+COPY_BUFFER_SIZE = 64 * 1024
+CHECKSUM_ALGORITHMS = ('md5', 'sha1', 'sha256')
+STALE_UPLOAD_DAYS = 7
+
+
+class ChunkedUploadError(Exception):
+    """ A chunk that can't be accepted, with the HTTP status to answer """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def start_upload(
+        request,
+        article,
+        kind,
+        filename,
+        size,
+        assignment=None,
+        label='',
+        public=True,
+):
+    """
+    Creates a ChunkedUpload and its empty staging file.
+    :param request: HttpRequest
+    :param article: the Article the file is uploaded for
+    :param kind: one of models.chunked_upload_kinds()
+    :param filename: the name of the file being uploaded
+    :param size: the size of the file in bytes
+    :param assignment: the TypesettingAssignment the file is uploaded for
+    :param label: the label of the galley or supplementary file
+    :param public: whether the galley is public
+    :return: a ChunkedUpload object
+    """
+    if kind not in dict(models.chunked_upload_kinds()):
+        raise ChunkedUploadError('Unknown upload kind {}'.format(kind))
+    if size < 0:
+        raise ChunkedUploadError('Invalid upload size')
+
+    upload = models.ChunkedUpload.objects.create(
+        owner=request.user,
+        article=article,
+        assignment=assignment,
+        kind=kind,
+        filename=os.path.basename(filename)[:1000],
+        label=label or '',
+        public=public,
+        size=size,
+    )
+    os.makedirs(os.path.dirname(upload.staging_path), exist_ok=True)
+    open(upload.staging_path, 'wb').close()
+
+    return upload
+
+
+def parse_checksum(header):
+    """
+    Parses an Upload-Checksum header.
+    :param header: the header value, e.g. "sha256 <base64 digest>"
+    :return: a tuple of the algorithm and the digest bytes, or None
+    """
+    if not header:
+        return None
+
+    try:
+        algorithm, digest = header.split(' ', 1)
+        digest = base64.b64decode(digest.strip())
+    except ValueError:
+        raise ChunkedUploadError('Malformed Upload-Checksum header')
+
+    if algorithm.lower() not in CHECKSUM_ALGORITHMS:
+        raise ChunkedUploadError(
+            'Unsupported checksum algorithm {}'.format(algorithm),
+        )
+
+    return algorithm.lower(), digest
+
+
+def append_chunk(upload, stream, offset, length, checksum=None):
+    """
+    Writes a chunk to the staging file of an upload.
+    The chunk is written at the current offset of the upload and anything
+    after it is discarded, so a chunk that was only partially received can
+    simply be sent again.
+    :param upload: a ChunkedUpload object, locked for update
+    :param stream: a file-like object to read the chunk from
+    :param offset: the offset the client sent the chunk for
+    :param length: the length of the chunk
+    :param checksum: the value of the Upload-Checksum header
+    :return: the new offset of the upload
+    """
+    if offset != upload.offset:
+        raise ChunkedUploadError(
+            'Expected a chunk at offset {}'.format(upload.offset),
+            status=409,
+        )
+    if length > CHUNK_MAX_SIZE:
+        raise ChunkedUploadError('Chunk too large', status=413)
+    if offset + length > upload.size:
+        raise ChunkedUploadError('Chunk exceeds the size of the upload')
+
+    expected = parse_checksum(checksum)
+    digest = hashlib.new(expected[0]) if expected else None
+
+    received = 0
+    with open(upload.staging_path, 'r+b') as staged_file:
+        staged_file.seek(offset)
+        while received < length:
+            data = stream.read(min(COPY_BUFFER_SIZE, length - received))
+            if not data:
+                break
+            staged_file.write(data)
+            if digest:
+                digest.update(data)
+            received += len(data)
+
+        if digest and digest.digest() != expected[1]:
+            staged_file.truncate(offset)
+            raise ChunkedUploadError('Checksum mismatch', status=460)
+
+        staged_file.truncate(offset + received)
+
+    upload.offset = offset + received
+    upload.save()
+
+    return upload.offset
+
+
+def commit_upload(request, upload):
+    """
+    Saves a completely received upload against its article with the same
+    production functions used by the upload forms.
+    :param request: HttpRequest
+    :param upload: a ChunkedUpload object whose offset has reached its size
+    :return: the Galley object created for galley uploads, otherwise None
+    """
+    galley = None
+    content_type, _ = mimetypes.guess_type(upload.filename)
+    with open(upload.staging_path, 'rb') as staged_file:
+        uploaded_file = UploadedFile(
+            file=staged_file,
+            name=upload.filename,
+            content_type=content_type or 'application/octet-stream',
+            size=upload.size,
+        )
+
+        if upload.kind == 'galley':
+            galley = logic.save_galley(
+                upload.article,
+                request,
+                uploaded_file,
+                label=upload.label or None,
+                public=upload.public,
+            )
+            if upload.assignment:
+                upload.assignment.galleys_created.add(galley)
+        elif upload.kind == 'source':
+            production_logic.save_source_file(
+                upload.article,
+                request,
+                uploaded_file,
+            )
+        elif upload.kind == 'supp':
+            production_logic.save_supp_file(
+                upload.article,
+                request,
+                uploaded_file,
+                upload.label or 'Supplementary File',
+            )
+        elif upload.kind == 'prod':
+            production_logic.save_prod_file(
+                upload.article,
+                request,
+                uploaded_file,
+                'Production Ready File',
+            )
+
+    upload.date_completed = timezone.now()
+    upload.save()
+    upload.delete_staged_file()
+
+    return galley
+
+
+def stale_uploads(days=STALE_UPLOAD_DAYS):
+    """
+    Returns the uploads that were not completed nor resumed in the given
+    number of days.
+    """
+    return models.ChunkedUpload.objects.filter(
+        date_completed__isnull=True,
+        date_updated__lt=timezone.now() - timedelta(days=days),
+    )
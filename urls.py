@@ -1,6 +1,6 @@
 from django.conf.urls import url
 
-from plugins.typesetting import views
+from plugins.typesetting import metrics, plugin_settings, views
 
 urlpatterns = [
     url(r'^manager/$',
@@ -11,8 +11,24 @@ urlpatterns = [
         views.typesetting_articles,
         name='typesetting_articles'
         ),
+    url(r'^articles/data/$',
+        views.typesetting_articles_data,
+        name='typesetting_articles_data'
+        ),
     url(r'^article/(?P<article_id>\d+)/makegalley/file/(?P<file_id>\d+)/$', views.article_file_make_galley,
         name='typesetting_article_file_make_galley'),
+    url(r'^article/(?P<article_id>\d+)/upload/$',
+        views.typesetting_start_chunked_upload,
+        name='typesetting_start_chunked_upload'
+        ),
+    url(r'^article/(?P<article_id>\d+)/assignment/(?P<assignment_id>\d+)/upload/$',
+        views.typesetting_start_chunked_upload,
+        name='typesetting_assignment_start_chunked_upload'
+        ),
+    url(r'^upload/(?P<token>[0-9a-f-]+)/$',
+        views.typesetting_chunked_upload,
+        name='typesetting_chunked_upload'
+        ),
     url(r'^article/(?P<article_id>\d+)/$',
         views.typesetting_article,
         name='typesetting_article'
@@ -45,6 +61,10 @@ urlpatterns = [
         views.typesetting_assign_typesetter,
         name='typesetting_assign_typesetter'
         ),
+    url(r'^assign/typesetter/bulk/$',
+        views.typesetting_bulk_assign_typesetter,
+        name='typesetting_bulk_assign_typesetter'
+        ),
     url(r'^article/(?P<article_id>\d+)/typesetter/(?P<assignment_id>\d+)/notify/$',
         views.typesetting_notify_typesetter,
         name='typesetting_notify_typesetter'
@@ -59,6 +79,10 @@ urlpatterns = [
         views.typesetting_assignment,
         name='typesetting_assignment'
         ),
+    url(r'^assignments/typesetting/(?P<assignment_id>\d+)/download/all/$',
+        views.typesetting_typesetter_download_all,
+        name='typesetting_typesetter_download_all'
+        ),
     url(r'^assignments/typesetting/(?P<assignment_id>\d+)/download/(?P<file_id>\d+)/$',
         views.typesetting_typesetter_download_file,
         name='typesetting_typesetter_download_file'
@@ -133,4 +157,11 @@ urlpatterns = [
         views.mint_supp_doi,
         name='typesetting_mint_supp_doi'
         ),
+    url(r'^metrics/$',
+        views.typesetting_metrics,
+        name='typesetting_metrics'
+        ),
 ]
+
+if plugin_settings.METRICS:
+    urlpatterns = metrics.instrument_urlpatterns(urlpatterns)
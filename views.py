@@ -1,12 +1,23 @@
 from django.shortcuts import render, get_object_or_404, redirect, reverse
 from django.contrib import messages
-from django.http import Http404
-from django.views.decorators.http import require_POST
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST, require_http_methods
 from django.utils import timezone
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.contrib.auth.decorators import login_required
-
-from plugins.typesetting import plugin_settings, models, logic, forms, security
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+
+from plugins.typesetting import (
+    plugin_settings,
+    models,
+    logic,
+    forms,
+    security,
+    downloads,
+    uploads,
+    metrics,
+)
 from plugins.typesetting.notifications import notify
 from security import decorators
 from submission import models as submission_models
@@ -37,25 +48,26 @@ def typesetting_articles(request):
     """
     article_filter = request.GET.get('filter', None)
 
-    articles_in_typesetting = submission_models.Article.objects.filter(
-        journal=request.journal,
-        stage=plugin_settings.STAGE,
-    )
-
-    if article_filter and article_filter == 'me':
-        articles_in_typesetting = articles_in_typesetting.filter(
-            typesettingclaim__editor=request.user,
-        )
-
     template = 'typesetting/typesetting_articles.html'
     context = {
-        'articles_in_typesetting': articles_in_typesetting,
         'filter': article_filter,
     }
 
     return render(request, template, context)
 
 
+@decorators.has_journal
+@decorators.production_user_or_editor_required
+def typesetting_articles_data(request):
+    """
+    Serves the rows of typesetting_articles for DataTables server-side
+    processing.
+    :param request: HttpRequest
+    :return: JsonResponse
+    """
+    return JsonResponse(logic.articles_in_typesetting_table(request))
+
+
 @decorators.has_journal
 @decorators.production_user_or_editor_required
 def typesetting_article(request, article_id):
@@ -64,11 +76,9 @@ def typesetting_article(request, article_id):
         pk=article_id,
         journal=request.journal,
     )
-    rounds = models.TypesettingRound.objects.filter(article=article)
-    galleys = core_models.Galley.objects.filter(
+    rounds = models.TypesettingRound.objects.with_stats().filter(
         article=article,
     )
-    manuscript_files = logic.production_ready_files(article)
     supp_choice_form = forms.SupplementaryFileChoiceForm(article=article)
     galley_form = forms.GalleyForm()
 
@@ -144,16 +154,11 @@ def typesetting_article(request, article_id):
         )
 
     template = 'typesetting/typesetting_article.html'
-    context = {
-        'article': article,
-        'rounds': rounds,
-        'galleys': galleys,
-        'manuscript_files': manuscript_files,
-        'pending_tasks': logic.typesetting_pending_tasks(rounds[0]),
-        'next_element': logic.get_next_element('typesetting_articles', request),
+    context = logic.load_article_workspace(request, article, rounds)
+    context.update({
         'supp_choice_form': supp_choice_form,
         'galley_form': galley_form,
-    }
+    })
 
     return render(request, template, context)
 
@@ -232,30 +237,24 @@ def typesetting_upload_galley(request, article_id, assignment_id=None):
             typesetter=request.user,
         )
 
-    try:
-        if 'file' in request.FILES and form.is_valid():
-            label = form.cleaned_data.get('label')
-            public = form.cleaned_data.get('public')
-            for uploaded_file in request.FILES.getlist('file'):
-                galley = production_logic.save_galley(
-                    article,
-                    request,
-                    uploaded_file,
-                    True,
-                    label=label,
-                    public=public,
-                )
-    except TypeError as exc:
-        messages.add_message(request, messages.ERROR, str(exc))
-    except UnicodeDecodeError:
-        messages.add_message(request, messages.ERROR,
-                             "Uploaded file is not UTF-8 encoded")
-    except production_logic.ZippedGalleyError:
-        messages.add_message(
-            request, messages.ERROR,
-            "You tried to upload a compressed file. "
-            "Please upload each Typeset File separately",
+    if 'file' in request.FILES and form.is_valid():
+        galleys, errors = logic.save_galleys(
+            article,
+            request,
+            request.FILES.getlist('file'),
+            label=form.cleaned_data.get('label'),
+            public=form.cleaned_data.get('public'),
         )
+        for file_name, error in errors:
+            messages.add_message(
+                request,
+                messages.ERROR,
+                '{0}: {1}'.format(file_name, error),
+            )
+        if galleys:
+            galley = galleys[-1]
+        if assignment and galleys:
+            assignment.galleys_created.add(*galleys)
 
     if 'prod' in request.POST:
         for uploaded_file in request.FILES.getlist('prod-file'):
@@ -266,9 +265,6 @@ def typesetting_upload_galley(request, article_id, assignment_id=None):
                 'Production Ready File',
             )
 
-    if assignment and galley:
-        assignment.galleys_created.add(galley)
-
     if not galley:
         messages.add_message(
             request,
@@ -299,6 +295,153 @@ def typesetting_upload_galley(request, article_id, assignment_id=None):
     )
 
 
+CHUNKED_UPLOAD_MESSAGES = {
+    'galley': 'Typeset file uploaded: %s',
+    'source': 'Source file uploaded: %s',
+    'supp': 'Supplementary file uploaded: %s',
+    'prod': 'Production ready file uploaded: %s',
+}
+
+
+@require_POST
+@decorators.has_journal
+@decorators.typesetting_user_or_production_user_or_editor_required
+def typesetting_start_chunked_upload(request, article_id, assignment_id=None):
+    """
+    Starts a resumable upload, see plugins.typesetting.uploads
+    :param request: HttpRequest
+    :param article_id: Article object PK
+    :param assignment_id: Optional TypesettingAssignment object PK
+    :return: JsonResponse
+    """
+    article = get_object_or_404(
+        submission_models.Article,
+        pk=article_id,
+        journal=request.journal,
+    )
+    assignment = None
+    kind = request.POST.get('kind')
+
+    if assignment_id:
+        assignment = get_object_or_404(
+            models.TypesettingAssignment,
+            pk=assignment_id,
+            typesetter=request.user,
+            completed__isnull=True,
+            round__article=article,
+        )
+        if kind not in ('galley', 'source'):
+            raise PermissionDenied
+    elif not (
+        request.user.is_editor(request)
+        or request.user.is_staff
+        or request.user.is_production(request)
+    ):
+        raise PermissionDenied
+
+    try:
+        upload = uploads.start_upload(
+            request,
+            article,
+            kind,
+            request.POST.get('filename', ''),
+            int(request.POST.get('size', '')),
+            assignment=assignment,
+            label=request.POST.get('label', ''),
+            public=request.POST.get('public') in ('on', 'true', '1'),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid upload size'}, status=400)
+    except uploads.ChunkedUploadError as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+
+    return JsonResponse(
+        {
+            'url': reverse(
+                'typesetting_chunked_upload',
+                kwargs={'token': upload.token},
+            ),
+            'offset': upload.offset,
+            'size': upload.size,
+        },
+        status=201,
+    )
+
+
+@require_http_methods(['GET', 'HEAD', 'PATCH'])
+@decorators.has_journal
+@login_required
+def typesetting_chunked_upload(request, token):
+    """
+    Returns the offset of a resumable upload or receives one of its chunks,
+    saving the file once its last chunk is received.
+    :param request: HttpRequest
+    :param token: ChunkedUpload token
+    :return: JsonResponse
+    """
+    with transaction.atomic():
+        upload = get_object_or_404(
+            models.ChunkedUpload.objects.select_for_update().select_related(
+                'article',
+                'assignment',
+            ),
+            token=token,
+            owner=request.user,
+            article__journal=request.journal,
+            date_completed__isnull=True,
+        )
+
+        if request.method == 'PATCH':
+            try:
+                uploads.append_chunk(
+                    upload,
+                    request,
+                    int(request.META.get('HTTP_UPLOAD_OFFSET', '')),
+                    int(request.META.get('CONTENT_LENGTH') or 0),
+                    checksum=request.META.get('HTTP_UPLOAD_CHECKSUM'),
+                )
+            except ValueError:
+                return JsonResponse(
+                    {'error': 'Invalid Upload-Offset header'},
+                    status=400,
+                )
+            except uploads.ChunkedUploadError as exc:
+                response = JsonResponse(
+                    {'error': str(exc), 'offset': upload.offset},
+                    status=exc.status,
+                )
+                response['Upload-Offset'] = upload.offset
+                return response
+
+        if request.method == 'PATCH' and upload.complete:
+            try:
+                uploads.commit_upload(request, upload)
+                messages.add_message(
+                    request,
+                    messages.INFO,
+                    CHUNKED_UPLOAD_MESSAGES[upload.kind] % upload.filename,
+                )
+            except (
+                TypeError,
+                UnicodeDecodeError,
+                production_logic.ZippedGalleyError,
+            ) as exc:
+                error = logic.galley_upload_error(exc)
+                upload.delete_staged_file()
+                upload.delete()
+                messages.add_message(request, messages.ERROR, error)
+                return JsonResponse({'error': error}, status=422)
+
+    response = JsonResponse({
+        'offset': upload.offset,
+        'size': upload.size,
+        'complete': upload.complete,
+    })
+    response['Upload-Offset'] = upload.offset
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
 @decorators.has_journal
 @decorators.typesetting_user_or_production_user_or_editor_required
 def typesetting_edit_galley(request, galley_id, article_id):
@@ -378,6 +521,27 @@ def typesetting_edit_galley(request, galley_id, article_id):
                     fixed=False,
                 )
 
+        elif 'zip-image-upload' in request.POST and 'zip' in request.FILES:
+            results = logic.save_galley_images_from_zip(
+                request,
+                galley,
+                request.FILES['zip'],
+                label,
+            )
+            saved = [entry for entry, ok, _ in results if ok]
+            messages.add_message(
+                request,
+                messages.SUCCESS if saved else messages.WARNING,
+                '{0} image(s) saved from the archive'.format(len(saved)),
+            )
+            for entry, ok, message in results:
+                if not ok:
+                    messages.add_message(
+                        request,
+                        messages.WARNING,
+                        '{0}: {1}'.format(entry, message),
+                    )
+
         elif 'css-upload' in request.POST:
             for uploaded_file in request.FILES.getlist('css'):
                 production_logic.save_galley_css(
@@ -398,7 +562,7 @@ def typesetting_edit_galley(request, galley_id, article_id):
                 galley_form.save()
 
         if 'replace-galley' in request.POST:
-            production_logic.replace_galley_file(
+            logic.replace_galley_file(
                 article, request,
                 galley,
                 request.FILES.get('galley'),
@@ -410,6 +574,8 @@ def typesetting_edit_galley(request, galley_id, article_id):
             galley.xsl_file = xsl_file
             galley.save()
 
+        logic.get_galley_analysis(galley)
+
         return_path = '?return={return_url}'.format(
             return_url=return_url,
         ) if return_url else ''
@@ -423,11 +589,13 @@ def typesetting_edit_galley(request, galley_id, article_id):
         )
         return redirect(redirect_url)
 
+    analysis = logic.get_galley_analysis(galley)
     template = 'typesetting/edit_galley.html'
     context = {
         'galley': galley,
         'article': galley.article,
-        'image_names': production_logic.get_image_names(galley),
+        'image_names': analysis.image_names,
+        'missing_images': analysis.missing_images,
         'return_url': return_url,
         'data_files': article.data_figure_files.all(),
         'galley_images': galley.images.all(),
@@ -502,7 +670,7 @@ def typesetting_assign_typesetter(request, article_id):
     template = 'typesetting/assign_typesetter.html'
     context = {
         'article': article,
-        'typesetters': typesetters,
+        'typesetters': logic.get_typesetter_directory(request.journal),
         'files': logic.production_ready_files(article),
         'form': form,
         'round': current_round,
@@ -512,6 +680,79 @@ def typesetting_assign_typesetter(request, article_id):
     return render(request, template, context)
 
 
+@decorators.has_journal
+@decorators.production_user_or_editor_required
+def typesetting_bulk_assign_typesetter(request):
+    """
+    Assigns a typesetter to many articles in the Typesetting stage at once.
+    Responds with JSON to AJAX requests so it can be scripted.
+    :param request: HttpRequest
+    :return: HttpResponse, HttpRedirect or JsonResponse
+    """
+    articles = logic.get_articles_in_typesetting(request)
+    typesetters = logic.get_typesetters(request.journal)
+    form = forms.BulkAssignTypesetter(
+        typesetters=typesetters,
+        articles=articles,
+    )
+
+    if request.POST:
+        form = forms.BulkAssignTypesetter(
+            request.POST,
+            typesetters=typesetters,
+            articles=articles,
+        )
+
+        if form.is_valid():
+            assignments, skipped = logic.bulk_assign_typesetter(
+                request,
+                form.cleaned_data['articles'],
+                form.cleaned_data['typesetter'],
+                due=form.cleaned_data['due'],
+                task=form.cleaned_data['task'],
+                display_proof_comments=form.cleaned_data[
+                    'display_proof_comments'
+                ],
+                request_corrections=form.cleaned_data['request_corrections'],
+                skip='skip' in request.POST,
+            )
+
+            if request.is_ajax():
+                return JsonResponse({
+                    'assignments': [
+                        assignment.pk for assignment in assignments
+                    ],
+                    'skipped': [article.pk for article in skipped],
+                })
+
+            messages.add_message(
+                request,
+                messages.SUCCESS,
+                '{0} assignments created.'.format(len(assignments)),
+            )
+            if skipped:
+                messages.add_message(
+                    request,
+                    messages.WARNING,
+                    'Skipped articles that already have a typesetter for '
+                    'their current round: {0}'.format(
+                        ', '.join(str(article.pk) for article in skipped),
+                    ),
+                )
+
+            return redirect(reverse('typesetting_articles'))
+
+        elif request.is_ajax():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+    template = 'typesetting/bulk_assign_typesetter.html'
+    context = {
+        'form': form,
+    }
+
+    return render(request, template, context)
+
+
 @decorators.has_journal
 @decorators.production_user_or_editor_required
 @security.require_not_notified(models.TypesettingAssignment)
@@ -549,12 +790,13 @@ def typesetting_notify_typesetter(request, article_id, assignment_id):
 
     if request.POST:
         message = request.POST.get('message')
-        notify.event_typesetting_assignment(
-            request,
-            assignment,
-            message,
-            skip=True if 'skip' in request.POST else False,
-        )
+        with transaction.atomic():
+            notify.event_typesetting_assignment(
+                request,
+                assignment,
+                message,
+                skip=True if 'skip' in request.POST else False,
+            )
         messages.add_message(
             request,
             messages.SUCCESS,
@@ -635,11 +877,12 @@ def typesetting_review_assignment(request, article_id, assignment_id):
                 'Assignment updated.'
             )
     elif request.POST and "delete" in request.POST:
-        assignment.delete(request.user)
-        notify.event_typesetting_deleted(
-            assignment,
-            request,
-        )
+        with transaction.atomic():
+            assignment.delete(request.user)
+            notify.event_typesetting_deleted(
+                assignment,
+                request,
+            )
         return redirect(
             reverse(
                 'typesetting_article',
@@ -677,15 +920,12 @@ def typesetting_review_assignment(request, article_id, assignment_id):
     context = {
         'article': article,
         'assignment': assignment,
-        'galleys': galleys,
+        'galleys': logic.galleys_with_analysis(galleys),
         'form': edit_form,
-        'typesetters': typesetters,
+        'typesetters': logic.get_typesetter_directory(request.journal),
         'files': logic.production_ready_files(article),
         'decision_form': decision_form,
-        'pending_corrections': [
-            correction for correction in assignment.corrections.all()
-            if not correction.corrected
-        ],
+        'pending_corrections': logic.pending_corrections(assignment),
     }
 
     return render(request, template, context)
@@ -721,35 +961,30 @@ def typesetting_assignments(request):
 @decorators.typesetter_user_required
 def typesetting_typesetter_download_file(request, assignment_id, file_id):
     assignment = get_object_or_404(
-        models.TypesettingAssignment,
+        models.TypesettingAssignment.objects.select_related('round'),
         pk=assignment_id,
         typesetter=request.user,
         completed__isnull=True,
         round__article__journal=request.journal,
     )
+    article_id = assignment.round.article_id
 
     file = get_object_or_404(
         core_models.File,
         pk=file_id,
-        article_id=assignment.round.article.pk,
+        article_id=article_id,
     )
 
-    if (
-        file in assignment.files_to_typeset.all()
-        or file in assignment.round.article.data_figure_files.all()
-        or assignment.proofing_assignments_for_corrections().filter(
-            annotated_files__id=file_id)
-        or file.pk in assignment.round.article.supplementary_files.values_list(
-            'file__pk', flat=True,
-            )
-        or file.pk in assignment.round.article.galley_set.values_list(
-                'file__pk', flat=True,
-            )
-    ):
-        return files.serve_any_file(
+    if assignment.typesetter_files().filter(pk=file.pk).exists():
+        return downloads.conditional_file_response(
             request,
             file,
-            path_parts=('articles', assignment.round.article.pk),
+            lambda: files.serve_any_file(
+                request,
+                file,
+                path_parts=('articles', article_id),
+            ),
+            path_parts=('articles', article_id),
         )
     else:
         raise PermissionDenied(
@@ -757,6 +992,28 @@ def typesetting_typesetter_download_file(request, assignment_id, file_id):
         )
 
 
+@decorators.has_journal
+@decorators.typesetter_user_required
+def typesetting_typesetter_download_all(request, assignment_id):
+    """
+    Streams a ZIP archive of all the files the typesetter can download
+    """
+    assignment = get_object_or_404(
+        models.TypesettingAssignment.objects.select_related('round'),
+        pk=assignment_id,
+        typesetter=request.user,
+        completed__isnull=True,
+        round__article__journal=request.journal,
+    )
+    article_id = assignment.round.article_id
+
+    return downloads.zip_response(
+        assignment.typesetter_files().order_by('pk').iterator(),
+        ('articles', article_id),
+        'article_{0}_typesetting_files.zip'.format(article_id),
+    )
+
+
 @decorators.has_journal
 @security.user_can_manage_file
 def typesetting_download_file(request, article_id, file_id):
@@ -769,10 +1026,15 @@ def typesetting_download_file(request, article_id, file_id):
         article_id=article_id,
     )
 
-    return files.serve_any_file(
+    return downloads.conditional_file_response(
         request,
         file,
-        path_parts=('articles', article_id)
+        lambda: files.serve_any_file(
+            request,
+            file,
+            path_parts=('articles', article_id)
+        ),
+        path_parts=('articles', article_id),
     )
 
 
@@ -852,8 +1114,9 @@ def typesetting_assignment(request, assignment_id):
 
         if 'complete_typesetting' in request.POST:
             note = request.POST.get('note_from_typesetter', None)
-            assignment.complete(note, request.user)
-            notify.event_complete_notification(assignment, request)
+            with transaction.atomic():
+                assignment.complete(note, request.user)
+                notify.event_complete_notification(assignment, request)
 
             return redirect(reverse('typesetting_assignments'))
 
@@ -863,30 +1126,33 @@ def typesetting_assignment(request, assignment_id):
             note = form.cleaned_data.get('note', 'No note supplied.')
             decision = form.cleaned_data.get('decision')
             if decision == 'accept':
-                assignment.accepted = timezone.now()
-                assignment.save()
-                notify.event_decision_notification(
-                    assignment,
-                    request,
-                    note,
-                    decision,
-                )
+                with transaction.atomic():
+                    assignment.accepted = timezone.now()
+                    assignment.save()
+                    notify.event_decision_notification(
+                        assignment,
+                        request,
+                        note,
+                        decision,
+                    )
                 return redirect(reverse(
                     'typesetting_assignment',
                     kwargs={'assignment_id': assignment.pk},
                 ))
             else:
-                assignment.completed = timezone.now()
-                for correction in assignment.corrections.all():
+                for correction in assignment.corrections.select_related(
+                    'galley__file__typesetting_checksum',
+                ):
                     if correction.corrected and not correction.date_completed:
                         correction.date_completed = timezone.now()
-                assignment.save()
-                notify.event_decision_notification(
-                    assignment,
-                    request,
-                    note,
-                    decision,
-                )
+                with transaction.atomic():
+                    assignment.decline()
+                    notify.event_decision_notification(
+                        assignment,
+                        request,
+                        note,
+                        decision,
+                    )
                 messages.add_message(
                     request,
                     messages.INFO,
@@ -895,17 +1161,15 @@ def typesetting_assignment(request, assignment_id):
 
                 return redirect(reverse('typesetting_assignments'))
 
+    galleys = logic.galleys_with_analysis(galleys)
     template = 'typesetting/typesetting_assignment.html'
     context = {
         'assignment': assignment,
         'article': assignment.round.article,
         'form': form,
         'galleys': galleys,
-        'pending_corrections': [
-            correction for correction in assignment.corrections.all()
-            if not correction.corrected
-        ],
-        'missing_images': [g for g in galleys if g.has_missing_image_files()],
+        'pending_corrections': logic.pending_corrections(assignment),
+        'missing_images': [g for g in galleys if g.missing_images],
         'proofing_assignments': assignment.proofing_assignments_for_corrections,
         'galley_form': galley_form,
     }
@@ -1039,16 +1303,17 @@ def typesetting_notify_proofreader(request, article_id, assignment_id):
     if request.POST:
         message = request.POST.get('message')
         skip = True if 'skip' in request.POST else False
-        assignment.assign(
-            user=request.user,
-            skip=skip
-        )
-        notify.galley_proofing_assignment(
-            request,
-            assignment,
-            message,
-            skip=skip
-        )
+        with transaction.atomic():
+            assignment.assign(
+                user=request.user,
+                skip=skip
+            )
+            notify.galley_proofing_assignment(
+                request,
+                assignment,
+                message,
+                skip=skip
+            )
         messages.add_message(
             request,
             messages.SUCCESS,
@@ -1101,39 +1366,42 @@ def typesetting_manage_proofing_assignment(request, article_id, assignment_id):
             action = request.POST.get('action')
 
             if action == 'cancel':
-                assignment.cancel(
-                    user=request.user
-                )
-                notify.galley_proofing_cancel(
-                    request,
-                    assignment,
-                )
+                with transaction.atomic():
+                    assignment.cancel(
+                        user=request.user
+                    )
+                    notify.galley_proofing_cancel(
+                        request,
+                        assignment,
+                    )
                 messages.add_message(
                     request,
                     messages.SUCCESS,
                     'Proofing task cancelled.',
                 )
             elif action == 'reset':
-                assignment.reset(
-                    user=request.user
-                )
-                notify.galley_proofing_reset(
-                    request,
-                    assignment,
-                )
+                with transaction.atomic():
+                    assignment.reset(
+                        user=request.user
+                    )
+                    notify.galley_proofing_reset(
+                        request,
+                        assignment,
+                    )
                 messages.add_message(
                     request,
                     messages.SUCCESS,
                     'Proofing task reset.',
                 )
             elif action == 'complete':
-                assignment.complete(
-                    user=request.user,
-                )
-                notify.galley_proofing_complete(
-                    request,
-                    assignment,
-                )
+                with transaction.atomic():
+                    assignment.complete(
+                        user=request.user,
+                    )
+                    notify.galley_proofing_complete(
+                        request,
+                        assignment,
+                    )
                 messages.add_message(
                     request,
                     messages.SUCCESS,
@@ -1235,13 +1503,14 @@ def typesetting_proofreading_assignment(request, assignment_id):
         if 'complete' in request.POST:
             unproofed_galleys = assignment.unproofed_galleys(galleys)
             if not unproofed_galleys:
-                assignment.complete(
-                    user=request.user
-                )
-                notify.galley_proofing_complete(
-                    request,
-                    assignment
-                )
+                with transaction.atomic():
+                    assignment.complete(
+                        user=request.user
+                    )
+                    notify.galley_proofing_complete(
+                        request,
+                        assignment
+                    )
                 messages.add_message(
                     request,
                     messages.SUCCESS,
@@ -1306,6 +1575,7 @@ def typesetting_preview_galley(
         article_id=article.pk,
     )
 
+    typesetting_task = None
     if assignment_id:
         try:
             proofing_task = models.GalleyProofing.objects.get(
@@ -1314,11 +1584,17 @@ def typesetting_preview_galley(
             )
             proofing_task.proofed_files.add(galley)
         except models.GalleyProofing.DoesNotExist:
-            get_object_or_404(
+            typesetting_task = get_object_or_404(
                 models.TypesettingAssignment,
                 pk=assignment_id,
             )
 
+    security.grant_preview(
+        request,
+        galley,
+        proofing_task or typesetting_task,
+    )
+
     if galley.type == 'xml' or galley.type == 'html':
         template = 'journal/article.html'
     elif galley.type == 'epub':
@@ -1326,7 +1602,7 @@ def typesetting_preview_galley(
     else:
         template = 'typesetting/preview_embedded.html'
 
-    article_content = galley.file_content()
+    article_content, tables_in_galley = logic.galley_preview_content(galley)
 
     context = {
         'proofing_task': proofing_task,
@@ -1335,7 +1611,14 @@ def typesetting_preview_galley(
         'identifier_type': 'id',
         'identifier': article.pk if article else proofing_task.round.article.pk,
         'article_content': article_content,
-        'tables_in_galley': journal_logic.get_all_tables_from_html(article_content),
+        'tables_in_galley': tables_in_galley,
+        'file_url': logic.galley_preview_url(
+            request,
+            galley,
+            proofing_task,
+            typesetting_task,
+        ),
+        'pdfjs_url': plugin_settings.PDFJS_URL,
     }
 
     return render(request, template, context)
@@ -1358,7 +1641,12 @@ def typesetting_proofing_download(request, article_id, assignment_id, file_id):
             file=file,
         )
         assignment.proofed_files.add(galley)
-        return files.serve_file(request, file, assignment.round.article)
+        return downloads.conditional_file_response(
+            request,
+            file,
+            lambda: files.serve_file(request, file, assignment.round.article),
+            path_parts=('articles', assignment.round.article.pk),
+        )
     except core_models.Galley.DoesNotExist:
         messages.add_message(
             request,
@@ -1376,6 +1664,10 @@ def preview_figure(
         assignment_id=None,
         article_id=None,
 ):
+    grant = getattr(request, 'typesetting_preview_grant', None)
+    if grant:
+        # The galley was previewed by this user moments ago
+        return serve_figure(request, grant['article_id'], galley_id, file_name)
 
     if assignment_id:
         try:
@@ -1412,7 +1704,25 @@ def preview_figure(
     else:
         raise PermissionDenied
 
-    return article_figure(request, galley.article.pk, galley.pk, file_name)
+    return serve_figure(request, galley.article_id, galley.pk, file_name)
+
+
+def serve_figure(request, article_id, galley_id, file_name):
+    """ Serves a galley figure, answering conditional requests for it """
+    image = core_models.Galley.images.through.objects.filter(
+        galley_id=galley_id,
+        file__original_filename=file_name,
+    ).select_related('file').first()
+
+    if not image:
+        return article_figure(request, article_id, galley_id, file_name)
+
+    return downloads.conditional_file_response(
+        request,
+        image.file,
+        lambda: article_figure(request, article_id, galley_id, file_name),
+        path_parts=('articles', article_id),
+    )
 
 
 @security.user_can_manage_file
@@ -1480,3 +1790,21 @@ def mint_supp_doi(request, supp_file_id):
 
     return redirect(request.META.get('HTTP_REFERER'))
 
+
+def typesetting_metrics(request):
+    """
+    Serves the plugin metrics in the Prometheus text format to scrapers
+    holding plugin_settings.METRICS_TOKEN and to staff users.
+    """
+    if not plugin_settings.METRICS:
+        raise Http404()
+
+    token = plugin_settings.METRICS_TOKEN
+    token_valid = bool(token) and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''),
+        'Bearer {}'.format(token),
+    )
+    if not token_valid and not request.user.is_staff:
+        raise PermissionDenied
+
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)